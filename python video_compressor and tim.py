@@ -4,39 +4,50 @@ from pathlib import Path
 import subprocess
 import sys
 import time  # Import the time module
+from video_checkpoint import discard_partial, encode_resumable, partial_output_path, publish_output
+from video_encoders import video_encode_options
+from video_filters import (DEDUPLICATE_FILTER, FPS_CAPS, SCALE_FLAGS, fps_cap_filter,
+                           get_bitrate_for_resolution_and_choice, join_filters, scale_filter)
+from video_packaging import faststart_options
+from video_passthrough import apply_stream_handling, choose_stream_handling
+from video_probe import count_video_frames, ffmpeg_capabilities, probe_media
+from video_progress import JsonLinesProgressLog, print_progress, run_with_progress
+from video_segment_encoder import describe_speedup, encode_chunked
+from video_size_target import describe_size_result, encode_to_size, plan_size_target, with_video_bitrate
+from video_time_predictor import EncodeTimePredictor, describe_encode_speed
+from video_trace import span, traced
 
 def check_ffmpeg():
     """Check if FFmpeg is installed and accessible."""
-    try:
-        subprocess.run(['ffmpeg', '-version'], capture_output=True)
+    # Detected once per process and remembered per FFmpeg binary
+    if ffmpeg_capabilities()['available']:
         return True
-    except FileNotFoundError:
-        print("FFmpeg is not installed or not found in system PATH!")
-        print("\nTo install FFmpeg:")
-        print("1. Using Chocolatey (recommended):")
-        print("   - Open PowerShell as Administrator")
-        print("   - Run: choco install ffmpeg")
-        print("\n2. Manual installation:")
-        print("   - Download from: https://github.com/BtbN/FFmpeg-Builds/releases")
-        print("   - Extract and add to system PATH")
-        return False
+    print("FFmpeg is not installed or not found in system PATH!")
+    print("\nTo install FFmpeg:")
+    print("1. Using Chocolatey (recommended):")
+    print("   - Open PowerShell as Administrator")
+    print("   - Run: choco install ffmpeg")
+    print("\n2. Manual installation:")
+    print("   - Download from: https://github.com/BtbN/FFmpeg-Builds/releases")
+    print("   - Extract and add to system PATH")
+    return False
 
-def get_bitrate_for_resolution_and_choice(resolution: str, bitrate_choice: int) -> int:
-    """Get the appropriate bitrate for the selected resolution and bitrate choice."""
-    resolution_bitrates = {
-        '480p': [500, 1000, 2000],
-        '720p': [2500, 3000, 3500],
-        '1080p': [4500, 5000, 6000],
-        '2k': [8000, 10000, 12000],
-        '4k': [15000, 20000, 25000]
-    }
-    return resolution_bitrates.get(resolution, [6000])[bitrate_choice - 1]  # Default to 6000 if invalid resolution
+@traced('compress_video')
+def compress_video(input_path: str, output_path: str, target_size_mb: float = None, 
+                  resolution: str = '1080p', bitrate_choice: int = 2,
+                  chunked: bool = False, workers: int = None, progress_log: str = None,
+                  scale_flags: str = SCALE_FLAGS, resume: bool = False,
+                  cap_fps: bool = False, drop_duplicates: bool = False) -> None:
+    """
+    Compress a video file to a target size while maintaining quality.
 
-def compress_video(input_path: str, output_path: str, target_size_mb: float = 50, 
-                  resolution: str = '1080p', bitrate_choice: int = 2) -> None:
-    """Compress a video file to a target size while maintaining quality."""
+    cap_fps limits the frame rate to FPS_CAPS for the tier and
+    drop_duplicates removes repeated frames; both mean fewer frames to encode.
+    """
     # Check if FFmpeg is installed
-    if not check_ffmpeg():
+    with span('ffmpeg_check'):
+        ffmpeg_found = check_ffmpeg()
+    if not ffmpeg_found:
         sys.exit(1)
     
     # Validate input path
@@ -52,21 +63,31 @@ def compress_video(input_path: str, output_path: str, target_size_mb: float = 50
     print("\nFile found! Starting compression...")
 
     # Get video information
-    probe = ffmpeg.probe(input_path)
-    video_info = next(s for s in probe['streams'] if s['codec_type'] == 'video')
-    duration = float(probe['format']['duration'])
+    with span('probe', path=input_path):
+        media = probe_media(input_path)
+    probe = media.raw
+    video_info = media.video
+    duration = media.duration
     
     # Get the appropriate bitrate for the selected resolution and bitrate choice
     target_video_bitrate = get_bitrate_for_resolution_and_choice(resolution, bitrate_choice)
     
+    # Honor the target size: if the tier bitrate would overshoot it, fall back
+    # to a two-pass encode planned for target_size_mb
+    size_plan = plan_size_target(probe, target_size_mb) if target_size_mb else None
+    size_limited = size_plan is not None and size_plan['video_kbps'] < target_video_bitrate
+    
     print(f"\nCompressing: {os.path.basename(input_path)}")
-    print(f"Target size: {target_size_mb} MB")
+    if target_size_mb:
+        print(f"Target size: {target_size_mb} MB")
     print(f"Selected resolution: {resolution}")
     print(f"Selected bitrate: {target_video_bitrate} kbps")
+    if size_limited:
+        print(f"Bitrate needed to fit {target_size_mb} MB: {size_plan['video_kbps']:.0f} kbps (two-pass)")
     
-    # Estimate time to compress based on duration and target bitrate (in MB per second)
-    avg_bitrate = target_video_bitrate / 8  # Convert kbps to kBps
-    estimated_time_sec = (os.path.getsize(input_path) / (1024 * 1024)) / avg_bitrate  # Estimate time in seconds
+    # Estimate time to compress from the recorded history of earlier encodes
+    predictor = EncodeTimePredictor()
+    estimated_time_sec = predictor.predict(media, resolution, preset='slower')
     estimated_time_min = estimated_time_sec / 60  # Convert to minutes
     
     print(f"Estimated compression time: {estimated_time_min:.2f} minutes")
@@ -78,31 +99,94 @@ def compress_video(input_path: str, output_path: str, target_size_mb: float = 50
     stream = ffmpeg.input(input_path)
     
     # Map all streams (audio, video, subtitles)
-    stream = ffmpeg.output(stream, output_path,
-                         **{
-                             'c:v': 'libx264',
-                             'b:v': f'{target_video_bitrate}k',
-                             'maxrate': f'{target_video_bitrate}k',
-                             'bufsize': f'{target_video_bitrate*2}k',
-                             'preset': 'slower',
-                             'c:a': 'aac',
-                             'b:a': '128k',
-                             'threads': 0,
-                             'loglevel': 'error',
-                             'map': '0',  # This will map all streams (video, audio, subtitles)
-                             'c:s': 'copy',  # Copy subtitle streams without re-encoding
-                             'c:d': 'copy',  # Copy data streams (like chapters) if available
-                         })
+    output_options = {
+        **video_encode_options('libx264', 'smallest', target_video_bitrate, output_path),
+        'c:a': 'aac',
+        'b:a': '128k',
+        'threads': 0,
+        'loglevel': 'error',
+        'map': '0',  # This will map all streams (video, audio, subtitles)
+        'c:s': 'copy',  # Copy subtitle streams without re-encoding
+        'c:d': 'copy',  # Copy data streams (like chapters) if available
+        **faststart_options(output_path),
+    }
+    
+    # Scale down to the selected resolution (never up); the bitrate tiers assume that frame size
+    video_filter = scale_filter(video_info.width, video_info.height, resolution, scale_flags)
+    if video_filter:
+        print(f"Scaling {video_info.width}x{video_info.height} down with: {video_filter}")
+    # Fewer frames to encode: cap the frame rate for the tier and/or drop repeated frames
+    fps_filter = fps_cap_filter(video_info.fps, resolution) if cap_fps else None
+    if fps_filter:
+        print(f"Capping frame rate: {video_info.fps:.2f} -> {FPS_CAPS[resolution]} fps")
+    video_filter = join_filters(fps_filter, video_filter, DEDUPLICATE_FILTER if drop_duplicates else None)
+    if drop_duplicates:
+        # Kept frames keep their timestamps, so the audio stays in sync
+        output_options['fps_mode'] = 'vfr'
+        print("Dropping duplicate frames")
+    if video_filter:
+        output_options['vf'] = video_filter
+    # Copy the streams that already meet the target instead of re-encoding them
+    decision = choose_stream_handling(media, output_path, output_options, size_plan['video_kbps'] if size_limited else target_video_bitrate)
+    output_options = apply_stream_handling(output_options, decision)
+    print(f"Processing path: {decision['path']}")
+    if decision['copy_video']:
+        print(f"Video already meets the target, about {decision['estimated_seconds_avoided'] / 60:.1f} minutes of encoding avoided")
+    # Encode to a side file and only move it into place once verified
+    partial_path = partial_output_path(output_path)
+    published = False
+    stream = ffmpeg.output(stream, partial_path, **output_options)
+    
+    # Report live fps/speed/ETA on the console, and as JSON lines if requested
+    progress_callbacks = (print_progress, JsonLinesProgressLog(progress_log, input=input_path) if progress_log else None)
     
     # Run the compression
     try:
         print("Running compression...")  # Debugging message
-        stream.run(overwrite_output=True)
+        with span('encode', path=decision['path']):
+            if decision['copy_video']:
+                run_with_progress(stream.compile(overwrite_output=True), media.duration, *progress_callbacks)
+            elif chunked or resume:
+                if size_limited:
+                    # Segments are encoded independently, so use the planned bitrate in a single pass
+                    output_options = with_video_bitrate(output_options, size_plan['video_kbps'])
+                if resume:
+                    stats = encode_resumable(input_path, output_path, output_options, media.duration, workers=workers)
+                    published = True
+                    print(f"Encoded {stats['segments']} segments ({stats['resumed_segments']} done by an earlier run)")
+                else:
+                    stats = encode_chunked(input_path, partial_path, output_options, workers=workers)
+                    print(describe_speedup(stats, estimated_time_sec))
+            elif size_limited:
+                result = encode_to_size(input_path, partial_path, output_options, size_plan,
+                                        max_bitrate=target_video_bitrate,
+                                        progress_callbacks=progress_callbacks)
+                print(describe_size_result(result, target_size_mb))
+            else:
+                run_with_progress(stream.compile(overwrite_output=True), media.duration, *progress_callbacks)
+        
+        # The resumable path verifies and publishes its own output
+        if not published:
+            with span('publish'):
+                publish_output(partial_path, output_path, media.duration)
         
         # Record the end time
         end_time = time.time()
         elapsed_time = end_time - start_time  # Calculate elapsed time
         
+        # Plain single-pass encodes teach the predictor for next time
+        if not (decision['copy_video'] or chunked or resume or size_limited or fps_filter or drop_duplicates):
+            predictor.record(media, resolution, elapsed_time, preset='slower')
+        
+        # Report what the frame reduction saved
+        if fps_filter or drop_duplicates:
+            source_frames = round(media.duration * (video_info.fps or 0))
+            output_frames = count_video_frames(output_path)
+            removed = max(0, source_frames - output_frames)
+            if source_frames and output_frames:
+                print(f"Frames encoded: {output_frames} of {source_frames} ({removed} removed, {removed / source_frames:.0%}), "
+                      f"about {elapsed_time * removed / output_frames:.0f} seconds of encoding saved")
+        
         # Print compression results
         original_size = os.path.getsize(input_path) / (1024 * 1024)  # MB
         compressed_size = os.path.getsize(output_path) / (1024 * 1024)  # MB
@@ -114,11 +198,18 @@ def compress_video(input_path: str, output_path: str, target_size_mb: float = 50
         
         # Print the elapsed time
         print(f"\nElapsed time: {elapsed_time:.2f} seconds")
+        if elapsed_time:
+            print(describe_encode_speed(media, resolution, elapsed_time, output_options.get('preset', 'slower'),
+                                        predictor=predictor))
         print(f"Estimated time: {estimated_time_min:.2f} minutes")
 
-    except ffmpeg.Error as e:
+    except (ffmpeg.Error, subprocess.CalledProcessError) as e:
         print(f"An error occurred during compression: {e.stderr.decode() if e.stderr else str(e)}")
         raise
+    finally:
+        # Never leave a truncated encode behind, including after Ctrl-C
+        with span('cleanup'):
+            discard_partial(partial_path)
 
 if __name__ == "__main__":
     # Your specific video path
@@ -162,13 +253,26 @@ if __name__ == "__main__":
     
     bitrate_choice = int(input("Enter your bitrate choice (1-3): "))
     
+    # Long inputs encode much faster when split into segments across all cores
+    chunked = input("Encode in parallel segments? (y/N): ").strip().lower() == 'y'
+    
+    # Animation and low-motion video repeat many frames; skipping them encodes faster
+    reduce_frames = input("Drop duplicate frames and cap the frame rate? (y/N): ").strip().lower() == 'y'
+    # Checkpointed segments let an interrupted encode pick up where it stopped
+    resume = input("Keep checkpoints so an interrupted encode can resume? (y/N): ").strip().lower() == 'y'
+    
+    # Without a cap the resolution and bitrate choice alone decide the size
+    size_answer = input("Cap the output size in MB (press Enter for no cap): ").strip()
+    target_size_mb = float(size_answer) if size_answer else None
+    
     try:
         print(f"Attempting to compress video:")
         print(f"Input: {input_video}")
         print(f"Output: {output_video}")
         
         # Compress the video
-        compress_video(input_video, output_video, target_size_mb=50, resolution=resolution, bitrate_choice=bitrate_choice)
+        compress_video(input_video, output_video, target_size_mb=target_size_mb, resolution=resolution, bitrate_choice=bitrate_choice,
+                       chunked=chunked, resume=resume, cap_fps=reduce_frames, drop_duplicates=reduce_frames)
         
     except Exception as e:
         print(f"\nError: {str(e)}")
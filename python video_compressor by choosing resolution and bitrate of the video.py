@@ -3,39 +3,75 @@ import os
 from pathlib import Path
 import subprocess
 import sys
+import time
+from video_checkpoint import discard_partial, encode_resumable, partial_output_path, publish_output
+from video_complexity import analyze_bitrate
+from video_crop import detect_crop
+from video_encoders import ENCODERS, audio_codec_for, scaled_bitrate, select_encoder, video_encode_options
+from video_filters import (DEDUPLICATE_FILTER, FPS_CAPS, SCALE_FLAGS, fps_cap_filter,
+                           get_bitrate_for_resolution_and_choice, join_filters, scale_filter, subtitle_burn_filter)
+from video_packaging import (FirstSegmentWatcher, directory_size_mb, faststart_options, package_paths,
+                             packaging_options)
+from video_passthrough import apply_stream_handling, choose_stream_handling
+from video_probe import count_video_frames, ffmpeg_capabilities, probe_media
+from video_progress import JsonLinesProgressLog, print_progress, run_with_progress
+from video_segment_encoder import describe_speedup, encode_chunked
+from video_size_target import describe_size_result, encode_to_size, plan_size_target, with_video_bitrate
+from video_sub_merger import choose_subtitle_codecs, normalize_subtitles
+from video_time_predictor import EncodeTimePredictor, describe_encode_speed
+from video_trace import span, traced
 
 def check_ffmpeg():
     """Check if FFmpeg is installed and accessible."""
-    try:
-        subprocess.run(['ffmpeg', '-version'], capture_output=True)
+    # Detected once per process and remembered per FFmpeg binary
+    if ffmpeg_capabilities()['available']:
         return True
-    except FileNotFoundError:
-        print("FFmpeg is not installed or not found in system PATH!")
-        print("\nTo install FFmpeg:")
-        print("1. Using Chocolatey (recommended):")
-        print("   - Open PowerShell as Administrator")
-        print("   - Run: choco install ffmpeg")
-        print("\n2. Manual installation:")
-        print("   - Download from: https://github.com/BtbN/FFmpeg-Builds/releases")
-        print("   - Extract and add to system PATH")
-        return False
+    print("FFmpeg is not installed or not found in system PATH!")
+    print("\nTo install FFmpeg:")
+    print("1. Using Chocolatey (recommended):")
+    print("   - Open PowerShell as Administrator")
+    print("   - Run: choco install ffmpeg")
+    print("\n2. Manual installation:")
+    print("   - Download from: https://github.com/BtbN/FFmpeg-Builds/releases")
+    print("   - Extract and add to system PATH")
+    return False
 
-def get_bitrate_for_resolution_and_choice(resolution: str, bitrate_choice: int) -> int:
-    """Get the appropriate bitrate for the selected resolution and bitrate choice."""
-    resolution_bitrates = {
-        '480p': [500, 1000, 2000],
-        '720p': [2500, 3000, 3500],
-        '1080p': [4500, 5000, 6000],
-        '2k': [8000, 10000, 12000],
-        '4k': [15000, 20000, 25000]
-    }
-    return resolution_bitrates.get(resolution, [6000])[bitrate_choice - 1]  # Default to 6000 if invalid resolution
+@traced('compress_video')
+def compress_video(input_path: str, output_path: str, target_size_mb: float = None, 
+                  resolution: str = '1080p', bitrate_choice: int = 2,
+                  chunked: bool = False, workers: int = None, progress_log: str = None,
+                  scale_flags: str = SCALE_FLAGS, threads: int = 0, show_progress: bool = True,
+                  resume: bool = False, subtitles=None, burn_subtitles: bool = False,
+                  auto_crop: bool = False, cap_fps: bool = False, drop_duplicates: bool = False,
+                  content_aware: bool = False, encoder: str = None, profile: str = None,
+                  packaging: str = 'file') -> dict:
+    """
+    Compress a video file to a target size while maintaining quality.
 
-def compress_video(input_path: str, output_path: str, target_size_mb: float = 50, 
-                  resolution: str = '1080p', bitrate_choice: int = 2) -> None:
-    """Compress a video file to a target size while maintaining quality."""
+    subtitles takes the same files as combine_video_and_subtitles; they are
+    embedded as soft tracks (or, with burn_subtitles, the first one is
+    drawn onto the picture) in the same encode, so no second pass is needed.
+    auto_crop samples the video for black bars and crops them off before
+    scaling. cap_fps limits the frame rate to FPS_CAPS for the tier and
+    drop_duplicates removes repeated frames; both mean fewer frames to encode.
+    content_aware measures the bitrate this title needs from a few sample
+    encodes, using the table bitrate as the upper bound.
+    encoder picks the video encoder (libx264, libx265, libsvtav1,
+    libvpx-vp9) and profile the speed/size trade-off (fastest, balanced,
+    smallest); with only a profile, the best encoder this FFmpeg build has
+    for it is used. packaging 'file' writes one file (MP4 with its index up
+    front); 'hls' and 'dash' write fMP4 segments and a playlist into a
+    directory named after output_path, servable while the encode runs.
+
+    Returns how the video was processed: the stream handling path, the
+    encoder and preset, the encode seconds (without probing and publishing)
+    and whether it was a plain single-pass encode of the full frame, the
+    only kind the encode time predictor models.
+    """
     # Check if FFmpeg is installed
-    if not check_ffmpeg():
+    with span('ffmpeg_check'):
+        ffmpeg_found = check_ffmpeg()
+    if not ffmpeg_found:
         sys.exit(1)
     
     # Validate input path
@@ -51,54 +87,240 @@ def compress_video(input_path: str, output_path: str, target_size_mb: float = 50
     print("\nFile found! Starting compression...")
 
     # Get video information
-    probe = ffmpeg.probe(input_path)
-    video_info = next(s for s in probe['streams'] if s['codec_type'] == 'video')
+    with span('probe', path=input_path):
+        media = probe_media(input_path)
+    probe = media.raw
+    video_info = media.video
+    
+    # Pick the encoder backend; the bitrate table is in x264 terms and scaled for the others
+    encoder, profile = select_encoder(encoder, profile, output_path)
+    
+    # HLS/DASH segments are written straight into place, so they can be served during the encode
+    package_dir, manifest_path = package_paths(output_path, packaging)
+    if packaging != 'file':
+        if subtitles and not burn_subtitles:
+            raise ValueError("HLS/DASH output cannot carry soft subtitles; burn them in instead")
+        if chunked or resume:
+            print("Packaged output is written in a single encode; ignoring parallel segments")
+            chunked = resume = False
     
     # Get the appropriate bitrate for the selected resolution and bitrate choice
-    target_video_bitrate = get_bitrate_for_resolution_and_choice(resolution, bitrate_choice)
+    table_bitrate = get_bitrate_for_resolution_and_choice(resolution, bitrate_choice)
+    target_video_bitrate = scaled_bitrate(encoder, table_bitrate)
+    
+    # Honor the target size: if the tier bitrate would overshoot it, fall back
+    # to a two-pass encode planned for target_size_mb
+    size_plan = plan_size_target(probe, target_size_mb) if target_size_mb else None
+    size_limited = size_plan is not None and size_plan['video_kbps'] < target_video_bitrate
     
     print(f"\nCompressing: {os.path.basename(input_path)}")
-    print(f"Target size: {target_size_mb} MB")
+    if target_size_mb:
+        print(f"Target size: {target_size_mb} MB")
     print(f"Selected resolution: {resolution}")
+    print(f"Encoder: {encoder} ({profile} profile)")
     print(f"Selected bitrate: {target_video_bitrate} kbps")
+    if size_limited:
+        print(f"Bitrate needed to fit {target_size_mb} MB: {size_plan['video_kbps']:.0f} kbps (two-pass)")
     
     # Start the compression process
     stream = ffmpeg.input(input_path)
     
     # Map all streams (audio, video, subtitles)
-    stream = ffmpeg.output(stream, output_path,
-                         **{
-                             'c:v': 'libx264',
-                             'b:v': f'{target_video_bitrate}k',
-                             'maxrate': f'{target_video_bitrate}k',
-                             'bufsize': f'{target_video_bitrate*2}k',
-                             'preset': 'slower',
-                             'c:a': 'aac',
-                             'b:a': '128k',
-                             'threads': 0,
-                             'loglevel': 'error',
-                             'map': '0',  # This will map all streams (video, audio, subtitles)
-                             'c:s': 'copy',  # Copy subtitle streams without re-encoding
-                             'c:d': 'copy',  # Copy data streams (like chapters) if available
-                         })
+    output_options = {
+        **video_encode_options(encoder, profile, target_video_bitrate, output_path),
+        'c:a': audio_codec_for(output_path),
+        'b:a': '128k',
+        'threads': threads,  # 0 lets ffmpeg use every core
+        'loglevel': 'error',
+        'map': '0',  # This will map all streams (video, audio, subtitles)
+        'c:s': 'copy',  # Copy subtitle streams without re-encoding
+        'c:d': 'copy',  # Copy data streams (like chapters) if available
+        **faststart_options(output_path),
+    }
+    
+    # Scale down to the selected resolution (never up); the bitrate tiers assume that frame size
+    # Remove black bars first so neither the scaler nor the encoder spends time on them
+    crop = None
+    if auto_crop:
+        with span('analysis', step='crop'):
+            crop = detect_crop(media)
+    if crop:
+        print(f"Cropping black bars: {video_info.width}x{video_info.height} -> {crop['width']}x{crop['height']} "
+              f"({crop['pixel_reduction']:.0%} fewer pixels, an estimated {1 / (1 - crop['pixel_reduction']):.2f}x "
+              f"faster to encode if encode time scales with pixel count)")
+    elif auto_crop:
+        print("No black bars found")
+    video_filter = scale_filter(video_info.width, video_info.height, resolution, scale_flags,
+                                (crop['width'], crop['height']) if crop else None)
+    if video_filter:
+        print(f"Scaling {video_info.width}x{video_info.height} down with: {video_filter}")
+    video_filter = join_filters(crop['filter'] if crop else None, video_filter)
+    
+    # External subtitles go into this encode instead of a second remux pass
+    subtitle_inputs = []
+    if subtitles:
+        subtitles = normalize_subtitles(subtitles)
+        if burn_subtitles:
+            filters = ffmpeg_capabilities()['filters']
+            if filters and 'subtitles' not in filters:
+                raise ValueError("This FFmpeg build has no 'subtitles' filter (libass) to burn subtitles in")
+            # Drawn after scaling, so text is rendered on the smaller frame
+            video_filter = join_filters(video_filter, subtitle_burn_filter(subtitles[0][0]))
+            print(f"Burning in subtitles: {subtitles[0][0]}")
+        else:
+            codecs = choose_subtitle_codecs(output_path, [path for path, _ in subtitles])
+            subtitle_inputs = [path for path, _ in subtitles]
+            output_options['map'] = ['0', *[f'{index + 1}:0' for index in range(len(subtitles))]]
+            # New tracks come after the source's own subtitle streams
+            first = len(media.subtitle_streams)
+            for index, ((path, language), codec) in enumerate(zip(subtitles, codecs)):
+                output_options[f'c:s:{first + index}'] = codec
+                output_options[f'metadata:s:s:{first + index}'] = f'language={language}'
+            print(f"Embedding {len(subtitles)} subtitle track(s)")
+        if chunked or resume:
+            print("Subtitles are added in a single encode; ignoring parallel segments")
+            chunked = resume = False
+    # Fewer frames to encode: cap the frame rate for the tier and/or drop repeated frames
+    fps_filter = fps_cap_filter(video_info.fps, resolution) if cap_fps else None
+    if fps_filter:
+        print(f"Capping frame rate: {video_info.fps:.2f} -> {FPS_CAPS[resolution]} fps")
+    video_filter = join_filters(fps_filter, video_filter, DEDUPLICATE_FILTER if drop_duplicates else None)
+    if drop_duplicates:
+        # Kept frames keep their timestamps, so the audio stays in sync
+        output_options['fps_mode'] = 'vfr'
+        print("Dropping duplicate frames")
+    if video_filter:
+        output_options['vf'] = video_filter
+    
+    # Per-title bitrate: easy content gets less than the table value, hard content keeps it
+    if content_aware:
+        # Samples are x264 encodes at the profile's speed, compared against the x264 table
+        with span('analysis', step='bitrate'):
+            analysis = analyze_bitrate(input_path, media, table_bitrate, bitrate_choice, video_filter,
+                                       preset=ENCODERS['libx264']['presets'][profile]['preset'])
+        content_bitrate = scaled_bitrate(encoder, analysis['video_kbps'])
+        print(f"Content analysis ({analysis['analysis_seconds']:.1f} s): samples need {analysis['sample_kbps']} kbps, "
+              f"using {content_bitrate} kbps instead of {target_video_bitrate} kbps")
+        target_video_bitrate = content_bitrate
+        output_options = with_video_bitrate(output_options, target_video_bitrate)
+        size_limited = size_plan is not None and size_plan['video_kbps'] < target_video_bitrate
+    
+    # Encoders without two-pass support fit the size target with one pass at the planned bitrate
+    # (as do HLS/DASH outputs, whose segments are published as they are written)
+    if size_limited and (not ENCODERS[encoder]['two_pass'] or packaging != 'file'):
+        output_options = with_video_bitrate(output_options, size_plan['video_kbps'])
+        target_video_bitrate = round(size_plan['video_kbps'])
+        size_limited = False
+        print(f"No two-pass encode for this output; encoding once at {target_video_bitrate} kbps")
+    
+    if packaging != 'file':
+        # Segments carry only video and audio
+        for key in ('c:s', 'c:d', 'movflags'):
+            output_options.pop(key, None)
+        output_options['map'] = ['0:v:0', '0:a?']
+        output_options.update(packaging_options(packaging, package_dir, has_audio=bool(media.audio_streams)))
+        os.makedirs(package_dir, exist_ok=True)
+        print(f"Packaging as {packaging.upper()}: {manifest_path}")
+    
+    # Copy the streams that already meet the target instead of re-encoding them
+    decision = choose_stream_handling(media, output_path, output_options, size_plan['video_kbps'] if size_limited else target_video_bitrate)
+    output_options = apply_stream_handling(output_options, decision)
+    print(f"Processing path: {decision['path']}")
+    if decision['copy_video']:
+        print(f"Video already meets the target, about {decision['estimated_seconds_avoided'] / 60:.1f} minutes of encoding avoided")
+    # Encode to a side file and only move it into place once verified
+    partial_path = partial_output_path(output_path)
+    # Packaged outputs go straight to their playlist; there is no single file to swap in
+    published = packaging != 'file'
+    target_path = partial_path if packaging == 'file' else manifest_path
+    if subtitle_inputs:
+        # ffmpeg-python maps every input given to output() itself
+        stream = ffmpeg.output(stream, *[ffmpeg.input(path) for path in subtitle_inputs], target_path,
+                               **{k: v for k, v in output_options.items() if k != 'map'})
+    else:
+        stream = ffmpeg.output(stream, target_path, **output_options)
+    
+    # Report live fps/speed/ETA on the console, and as JSON lines if requested
+    progress_callbacks = (print_progress if show_progress else None, JsonLinesProgressLog(progress_log, input=input_path) if progress_log else None)
     
     # Run the compression
+    start_time = time.time()
+    if packaging != 'file':
+        progress_callbacks += (FirstSegmentWatcher(package_dir, start_time),)
     try:
         print("Running compression...")  # Debugging message
-        stream.run(overwrite_output=True)
+        with span('encode', path=decision['path'], encoder=encoder):
+            if decision['copy_video']:
+                run_with_progress(stream.compile(overwrite_output=True), media.duration, *progress_callbacks)
+            elif chunked or resume:
+                if size_limited:
+                    # Segments are encoded independently, so use the planned bitrate in a single pass
+                    output_options = with_video_bitrate(output_options, size_plan['video_kbps'])
+                if resume:
+                    stats = encode_resumable(input_path, output_path, output_options, media.duration, workers=workers,
+                                             cores=threads or None)
+                    published = True
+                    print(f"Encoded {stats['segments']} segments ({stats['resumed_segments']} done by an earlier run)")
+                else:
+                    stats = encode_chunked(input_path, partial_path, output_options, workers=workers,
+                                           cores=threads or None)
+                    single_process = EncodeTimePredictor().predict(media, resolution, output_options.get('preset', 'slower'),
+                                                                   cores=threads or None)
+                    print(describe_speedup(stats, single_process))
+            elif size_limited:
+                result = encode_to_size(input_path, partial_path, output_options, size_plan,
+                                        max_bitrate=target_video_bitrate,
+                                        progress_callbacks=progress_callbacks, extra_inputs=subtitle_inputs)
+                print(describe_size_result(result, target_size_mb))
+            else:
+                run_with_progress(stream.compile(overwrite_output=True), media.duration, *progress_callbacks)
+        encode_seconds = time.time() - start_time
+        
+        # The resumable path verifies and publishes its own output
+        if not published:
+            with span('publish'):
+                publish_output(partial_path, output_path, media.duration)
+        elapsed_time = time.time() - start_time
+        
+        # Report what the frame reduction saved
+        if fps_filter or drop_duplicates:
+            source_frames = round(media.duration * (video_info.fps or 0))
+            output_frames = count_video_frames(manifest_path)
+            removed = max(0, source_frames - output_frames)
+            if source_frames and output_frames:
+                print(f"Frames encoded: {output_frames} of {source_frames} ({removed} removed, {removed / source_frames:.0%}), "
+                      f"about {elapsed_time * removed / output_frames:.0f} seconds of encoding saved")
         
         # Compression results
         original_size = os.path.getsize(input_path) / (1024 * 1024)  # MB
-        compressed_size = os.path.getsize(output_path) / (1024 * 1024)  # MB
+        compressed_size = (os.path.getsize(output_path) / (1024 * 1024) if packaging == 'file'
+                           else directory_size_mb(package_dir))  # MB
         print(f"\nCompression complete!")
         print(f"Original size: {original_size:.2f} MB")
         print(f"Compressed size: {compressed_size:.2f} MB")
         print(f"Compression ratio: {original_size/compressed_size:.2f}x")
-        print(f"Saved to: {output_path}")
+        print(f"Saved to: {manifest_path}")
+        if not decision['copy_video'] and encode_seconds:
+            print(describe_encode_speed(media, resolution, encode_seconds, output_options.get('preset', 'slower'),
+                                        cores=threads or None))
         
-    except ffmpeg.Error as e:
+        return {
+            'path': decision['path'],
+            'copy_video': decision['copy_video'],
+            'encoder': encoder,
+            'preset': output_options.get('preset'),
+            'encode_seconds': encode_seconds,
+            'single_pass': not (decision['copy_video'] or chunked or resume or size_limited or crop
+                                or fps_filter or drop_duplicates or packaging != 'file'),
+        }
+        
+    except (ffmpeg.Error, subprocess.CalledProcessError) as e:
         print(f"An error occurred during compression: {e.stderr.decode() if e.stderr else str(e)}")
         raise
+    finally:
+        # Never leave a truncated encode behind, including after Ctrl-C
+        with span('cleanup'):
+            discard_partial(partial_path)
 
 if __name__ == "__main__":
     # Your specific video path
@@ -142,13 +364,52 @@ if __name__ == "__main__":
     
     bitrate_choice = int(input("Enter your bitrate choice (1-3): "))
     
+    # Long inputs encode much faster when split into segments across all cores
+    chunked = input("Encode in parallel segments? (y/N): ").strip().lower() == 'y'
+    # Checkpointed segments let an interrupted encode pick up where it stopped
+    resume = input("Keep checkpoints so an interrupted encode can resume? (y/N): ").strip().lower() == 'y'
+    
+    # External subtitles are added in the same encode
+    subtitle_file = input("Subtitle file to add (press Enter for none): ").strip().strip('"').strip("'")
+    burn_subtitles = bool(subtitle_file) and input("Burn them into the picture? (y/N): ").strip().lower() == 'y'
+    
+    # Letterboxed films encode faster without their black bars
+    auto_crop = input("Detect and crop black bars? (y/N): ").strip().lower() == 'y'
+    
+    # Animation and low-motion video repeat many frames; skipping them encodes faster
+    reduce_frames = input("Drop duplicate frames and cap the frame rate? (y/N): ").strip().lower() == 'y'
+    
+    # Let the content decide the bitrate, with the chosen tier as the ceiling
+    content_aware = input("Pick the bitrate from a quick content analysis? (y/N): ").strip().lower() == 'y'
+    
+    # Newer encoders reach the same quality at a lower bitrate but encode more slowly
+    print("\nSelect an encoding profile (press Enter to keep H.264 'slower'):")
+    print("1. fastest (H.264)")
+    print("2. balanced (best available of AV1, HEVC, H.264)")
+    print("3. smallest (best available of AV1, HEVC, VP9, H.264)")
+    profile = {'1': 'fastest', '2': 'balanced', '3': 'smallest'}.get(input("Enter your profile choice (1-3): ").strip())
+    
+    # HLS/DASH write segments a player can start on while the encode is still running
+    print("\nSelect the output packaging:")
+    print("1. Single file (default)")
+    print("2. HLS (index.m3u8 and segments)")
+    print("3. DASH (manifest.mpd and segments)")
+    packaging = {'2': 'hls', '3': 'dash'}.get(input("Enter your packaging choice (1-3): ").strip(), 'file')
+    
+    # Without a cap the resolution and bitrate choice alone decide the size
+    size_answer = input("Cap the output size in MB (press Enter for no cap): ").strip()
+    target_size_mb = float(size_answer) if size_answer else None
+    
     try:
         print(f"Attempting to compress video:")
         print(f"Input: {input_video}")
         print(f"Output: {output_video}")
         
         # Compress the video
-        compress_video(input_video, output_video, target_size_mb=50, resolution=resolution, bitrate_choice=bitrate_choice)
+        compress_video(input_video, output_video, target_size_mb=target_size_mb, resolution=resolution, bitrate_choice=bitrate_choice,
+                       chunked=chunked, resume=resume, subtitles=subtitle_file or None, burn_subtitles=burn_subtitles,
+                       auto_crop=auto_crop, cap_fps=reduce_frames, drop_duplicates=reduce_frames,
+                       content_aware=content_aware, profile=profile, packaging=packaging)
         
     except Exception as e:
         print(f"\nError: {str(e)}")
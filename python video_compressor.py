@@ -3,30 +3,44 @@ import os
 from pathlib import Path
 import subprocess
 import sys
+from video_checkpoint import discard_partial, encode_resumable, partial_output_path, publish_output
+from video_encoders import video_encode_options
+from video_packaging import faststart_options
+from video_passthrough import apply_stream_handling, choose_stream_handling
+from video_probe import ffmpeg_capabilities, probe_media
+from video_progress import JsonLinesProgressLog, print_progress, run_with_progress
+from video_segment_encoder import describe_speedup, encode_chunked
+from video_size_target import describe_size_result, encode_to_size, plan_size_target
+from video_time_predictor import EncodeTimePredictor
+from video_trace import span, traced
 
 def check_ffmpeg():
     """Check if FFmpeg is installed and accessible."""
-    try:
-        subprocess.run(['ffmpeg', '-version'], capture_output=True)
+    # Detected once per process and remembered per FFmpeg binary
+    if ffmpeg_capabilities()['available']:
         return True
-    except FileNotFoundError:
-        print("FFmpeg is not installed or not found in system PATH!")
-        print("\nTo install FFmpeg:")
-        print("1. Using Chocolatey (recommended):")
-        print("   - Open PowerShell as Administrator")
-        print("   - Run: choco install ffmpeg")
-        print("\n2. Manual installation:")
-        print("   - Download from: https://github.com/BtbN/FFmpeg-Builds/releases")
-        print("   - Extract and add to system PATH")
-        return False
+    print("FFmpeg is not installed or not found in system PATH!")
+    print("\nTo install FFmpeg:")
+    print("1. Using Chocolatey (recommended):")
+    print("   - Open PowerShell as Administrator")
+    print("   - Run: choco install ffmpeg")
+    print("\n2. Manual installation:")
+    print("   - Download from: https://github.com/BtbN/FFmpeg-Builds/releases")
+    print("   - Extract and add to system PATH")
+    return False
 
+@traced('compress_video')
 def compress_video(input_path: str, output_path: str, target_size_mb: float = 50, 
-                  min_bitrate: int = 800, max_bitrate: int = 8000) -> None:
+                  min_bitrate: int = 800, max_bitrate: int = 8000,
+                  chunked: bool = False, workers: int = None, progress_log: str = None,
+                  resume: bool = False) -> None:
     """
     Compress a video file to a target size while maintaining quality.
     """
     # Check if FFmpeg is installed
-    if not check_ffmpeg():
+    with span('ffmpeg_check'):
+        ffmpeg_found = check_ffmpeg()
+    if not ffmpeg_found:
         sys.exit(1)
     
     # Validate input path
@@ -44,40 +58,81 @@ def compress_video(input_path: str, output_path: str, target_size_mb: float = 50
     print("\nFile found! Starting compression...")
     
     # Get video information
-    probe = ffmpeg.probe(input_path)
-    video_info = next(s for s in probe['streams'] if s['codec_type'] == 'video')
-    duration = float(probe['format']['duration'])
-    
-    # Calculate target bitrate (in kbps)
-    target_total_bitrate = (target_size_mb * 8192) / duration
+    with span('probe', path=input_path):
+        media = probe_media(input_path)
+    probe = media.raw
+    video_info = media.video
     
-    # Assume audio bitrate of 128k and subtract it from total bitrate
+    # Calculate target bitrate (in kbps), leaving room for the 128k audio
+    # track and the container overhead
     audio_bitrate = 128
-    target_video_bitrate = max(min(target_total_bitrate - audio_bitrate, max_bitrate), min_bitrate)
+    try:
+        size_plan = plan_size_target(probe, target_size_mb, audio_bitrate, all_streams=False)
+        target_video_bitrate = max(min(size_plan['video_kbps'], max_bitrate), min_bitrate)
+    except ValueError as e:
+        # Too long for the target: encode once at the floor, the output will be larger
+        print(f"Warning: {e}; encoding at the {min_bitrate} kbps minimum instead")
+        size_plan = None
+        target_video_bitrate = min_bitrate
     
     print(f"\nCompressing: {os.path.basename(input_path)}")
     print(f"Target size: {target_size_mb} MB")
     print(f"Calculated video bitrate: {target_video_bitrate:.0f} kbps")
     
     # Set up compression parameters
-    stream = ffmpeg.input(input_path)
+    output_options = {
+        **video_encode_options('libx264', 'smallest', target_video_bitrate, output_path),
+        'maxrate': f'{max_bitrate}k',  # Peaks may go up to the cap, not just the average
+        'bufsize': f'{max_bitrate*2}k',
+        'c:a': 'aac',
+        'b:a': f'{audio_bitrate}k',
+        'threads': 0,
+        'loglevel': 'error',
+        **faststart_options(output_path),
+    }
     
-    stream = ffmpeg.output(stream, output_path,
-                         **{
-                             'c:v': 'libx264',
-                             'b:v': f'{target_video_bitrate}k',
-                             'maxrate': f'{max_bitrate}k',
-                             'bufsize': f'{max_bitrate*2}k',
-                             'preset': 'slower',
-                             'c:a': 'aac',
-                             'b:a': f'{audio_bitrate}k',
-                             'threads': 0,
-                             'loglevel': 'error'
-                         })
+    # Copy the streams that already meet the target instead of re-encoding them
+    decision = choose_stream_handling(media, output_path, output_options, target_video_bitrate)
+    output_options = apply_stream_handling(output_options, decision)
+    print(f"Processing path: {decision['path']}")
+    if decision['copy_video']:
+        print(f"Video already meets the target, about {decision['estimated_seconds_avoided'] / 60:.1f} minutes of encoding avoided")
+    
+    # Report live fps/speed/ETA on the console, and as JSON lines if requested
+    progress_callbacks = (print_progress, JsonLinesProgressLog(progress_log, input=input_path) if progress_log else None)
+    
+    # Encode to a side file and only move it into place once verified
+    partial_path = partial_output_path(output_path)
+    published = False
     
     # Run the compression
     try:
-        stream.run(overwrite_output=True)
+        with span('encode', path=decision['path']):
+            if decision['copy_video']:
+                stream = ffmpeg.input(input_path).output(partial_path, **output_options)
+                run_with_progress(stream.compile(overwrite_output=True), media.duration, *progress_callbacks)
+            elif resume:
+                stats = encode_resumable(input_path, output_path, output_options, media.duration, workers=workers)
+                published = True
+                print(f"Encoded {stats['segments']} segments ({stats['resumed_segments']} done by an earlier run)")
+            elif chunked:
+                stats = encode_chunked(input_path, partial_path, output_options, workers=workers)
+                # No scaling here, so the estimate is for the source resolution
+                print(describe_speedup(stats, EncodeTimePredictor().predict(media, None, 'slower')))
+            elif size_plan is None:
+                stream = ffmpeg.input(input_path).output(partial_path, **output_options)
+                run_with_progress(stream.compile(overwrite_output=True), media.duration, *progress_callbacks)
+            else:
+                # Two-pass encode, re-running only the second pass if the size misses
+                result = encode_to_size(input_path, partial_path, output_options, size_plan,
+                                        min_bitrate=min_bitrate, max_bitrate=max_bitrate,
+                                        progress_callbacks=progress_callbacks)
+                print(describe_size_result(result, target_size_mb))
+        
+        # The resumable path verifies and publishes its own output
+        if not published:
+            with span('publish'):
+                publish_output(partial_path, output_path, media.duration)
         
         # Print compression results
         original_size = os.path.getsize(input_path) / (1024 * 1024)  # MB
@@ -88,9 +143,13 @@ def compress_video(input_path: str, output_path: str, target_size_mb: float = 50
         print(f"Compression ratio: {original_size/compressed_size:.2f}x")
         print(f"Saved to: {output_path}")
         
-    except ffmpeg.Error as e:
+    except (ffmpeg.Error, subprocess.CalledProcessError) as e:
         print(f"An error occurred: {e.stderr.decode() if e.stderr else str(e)}")
         raise
+    finally:
+        # Never leave a truncated encode behind, including after Ctrl-C
+        with span('cleanup'):
+            discard_partial(partial_path)
 
 if __name__ == "__main__":
     # Your specific video path
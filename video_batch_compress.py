@@ -0,0 +1,184 @@
+import argparse
+import csv
+import glob
+import importlib.util
+import json
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from pathlib import Path
+from video_encoders import ENCODERS, PROFILES
+from video_probe import probe_media
+from video_time_predictor import EncodeTimePredictor
+
+VIDEO_EXTENSIONS = {'.mkv', '.mp4', '.avi', '.mov', '.m4v', '.webm', '.wmv', '.flv', '.ts'}
+COMPRESSOR_SCRIPT = 'python video_compressor by choosing resolution and bitrate of the video.py'
+THREADS_PER_JOB = 4  # x264 stops scaling well past a handful of threads per encode
+
+def load_compress_video():
+    """Load compress_video from the resolution/bitrate compressor script next to this file."""
+    path = os.path.join(os.path.dirname(os.path.abspath(__file__)), COMPRESSOR_SCRIPT)
+    spec = importlib.util.spec_from_file_location('video_compressor_resolution', path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module.compress_video
+
+def default_output_path(input_path: str, input_root: str, output_dir: str) -> str:
+    """Mirror the input tree under output_dir, adding a _compressed suffix."""
+    relative = os.path.relpath(input_path, input_root) if input_root else os.path.basename(input_path)
+    stem, ext = os.path.splitext(relative)
+    return os.path.join(output_dir, f'{stem}_compressed{ext}')
+
+def find_jobs(source: str, output_dir: str, resolution: str, bitrate_choice: int) -> list:
+    """
+    Build the job list from a directory tree, a glob pattern, or a CSV/JSON manifest.
+
+    Manifests list one job per row/object with an 'input' field and optional
+    'output', 'resolution' and 'bitrate_choice' fields.
+    """
+    defaults = {'resolution': resolution, 'bitrate_choice': bitrate_choice}
+    if os.path.isfile(source) and source.lower().endswith(('.csv', '.json')):
+        with open(source, newline='') as f:
+            rows = json.load(f) if source.lower().endswith('.json') else list(csv.DictReader(f))
+        jobs = []
+        for row in rows:
+            job = dict(defaults, **{k: v for k, v in row.items() if v not in (None, '')})
+            job['bitrate_choice'] = int(job['bitrate_choice'])
+            job.setdefault('output', default_output_path(job['input'], None, output_dir))
+            jobs.append(job)
+        return jobs
+
+    if os.path.isdir(source):
+        root = source
+        paths = [str(p) for p in Path(source).rglob('*') if p.suffix.lower() in VIDEO_EXTENSIONS]
+    else:
+        root = None
+        paths = [p for p in glob.glob(source, recursive=True) if Path(p).suffix.lower() in VIDEO_EXTENSIONS]
+    return [dict(defaults, input=p, output=default_output_path(p, root, output_dir)) for p in sorted(paths)]
+
+def is_up_to_date(job: dict) -> bool:
+    """True when the output already exists and is newer than its input."""
+    return (os.path.exists(job['output'])
+            and os.path.getmtime(job['output']) >= os.path.getmtime(job['input']))
+
+def plan_concurrency(job_count: int, jobs: int = None, threads_per_job: int = None) -> tuple:
+    """Split the machine's cores between concurrent jobs: returns (jobs, threads per job)."""
+    cores = os.cpu_count() or 1
+    threads_per_job = threads_per_job or min(THREADS_PER_JOB, cores)
+    jobs = jobs or max(1, cores // threads_per_job)
+    return max(1, min(jobs, job_count)), threads_per_job
+
+def run_job(compress_video, job: dict, threads: int, target_size_mb: float, resume: bool = False,
+            auto_crop: bool = False, content_aware: bool = False, encoder: str = None,
+            profile: str = None, predictor: EncodeTimePredictor = None) -> dict:
+    """Compress one file and return its report row, teaching predictor the encode time."""
+    start_time = time.time()
+    result = {'input': job['input'], 'output': job['output'], 'resolution': job['resolution'],
+              'bitrate_choice': job['bitrate_choice']}
+    try:
+        run = compress_video(job['input'], job['output'], target_size_mb=target_size_mb,
+                       resolution=job['resolution'], bitrate_choice=job['bitrate_choice'],
+                       threads=threads, show_progress=False, resume=resume,
+                       # Checkpointed segments share the job's threads instead of taking every core
+                       workers=threads if resume else None,
+                       auto_crop=auto_crop, content_aware=content_aware, encoder=encoder, profile=profile)
+        original_mb = os.path.getsize(job['input']) / (1024 * 1024)
+        compressed_mb = os.path.getsize(job['output']) / (1024 * 1024)
+        result.update(status='ok', original_mb=round(original_mb, 2), compressed_mb=round(compressed_mb, 2),
+                      ratio=round(original_mb / compressed_mb, 2) if compressed_mb else None)
+        # Only real single-pass x264 encodes match what the predictor models; copies and remuxes take no encode time
+        if predictor is not None and run['single_pass'] and run['encoder'] == 'libx264':
+            predictor.record(probe_media(job['input']), job['resolution'], run['encode_seconds'],
+                             preset=run['preset'], cores=threads)
+    except (Exception, SystemExit) as e:
+        # compress_video calls sys.exit() when FFmpeg is missing
+        result.update(status='failed', error=str(e))
+    result['elapsed'] = round(time.time() - start_time, 2)
+    return result
+
+def write_report(results: list, report_path: str):
+    """Write the per-file results as CSV or JSON, chosen by the report extension."""
+    if report_path.lower().endswith('.json'):
+        with open(report_path, 'w') as f:
+            json.dump(results, f, indent=2)
+        return
+    fields = ['input', 'output', 'status', 'resolution', 'bitrate_choice', 'original_mb',
+              'compressed_mb', 'ratio', 'elapsed', 'predicted', 'error']
+    with open(report_path, 'w', newline='') as f:
+        writer = csv.DictWriter(f, fieldnames=fields, extrasaction='ignore')
+        writer.writeheader()
+        writer.writerows(results)
+
+def compress_batch(source: str, output_dir: str, resolution: str = '1080p', bitrate_choice: int = 2,
+                   target_size_mb: float = None, jobs: int = None, threads_per_job: int = None,
+                   force: bool = False, resume: bool = False,
+                   auto_crop: bool = False, content_aware: bool = False, encoder: str = None,
+                   profile: str = None) -> list:
+    """
+    Compress every video found in source, several at a time.
+
+    Outputs that are newer than their inputs are skipped unless force is
+    set. Jobs predicted to be quickest run first. With resume, each file is
+    encoded in checkpointed segments so a rerun after a crash continues
+    where it stopped. auto_crop removes black bars before scaling, and
+    content_aware sizes each file's bitrate from sample encodes. encoder and
+    profile choose the video encoder backend as in compress_video.
+    """
+    compress_video = load_compress_video()
+    predictor = EncodeTimePredictor()
+    results, pending = [], []
+    for job in find_jobs(source, output_dir, resolution, bitrate_choice):
+        if not force and is_up_to_date(job):
+            results.append({'input': job['input'], 'output': job['output'], 'status': 'skipped'})
+            continue
+        pending.append(job)
+
+    concurrent_jobs, threads = plan_concurrency(len(pending), jobs, threads_per_job)
+    for job in pending:
+        try:
+            job['predicted'] = round(predictor.predict(probe_media(job['input']), job['resolution'], cores=threads), 1)
+        except Exception:
+            job['predicted'] = None
+    pending.sort(key=lambda job: job['predicted'] if job['predicted'] is not None else float('inf'))
+    print(f"{len(pending)} file(s) to compress, {len(results)} up to date; "
+          f"running {concurrent_jobs} at a time with {threads} thread(s) each")
+
+    with ThreadPoolExecutor(max_workers=concurrent_jobs) as pool:
+        futures = {pool.submit(run_job, compress_video, job, threads, target_size_mb, resume, auto_crop,
+                               content_aware, encoder, profile, predictor): job
+                   for job in pending}
+        for future in as_completed(futures):
+            result = dict(future.result(), predicted=futures[future]['predicted'])
+            print(f"[{result['status']}] {result['input']} ({result['elapsed']:.1f} s)")
+            results.append(result)
+    return results
+
+def main():
+    parser = argparse.ArgumentParser(description="Compress a directory, glob or manifest of videos.")
+    parser.add_argument('source', help="Directory, glob pattern (quote it) or .csv/.json manifest")
+    parser.add_argument('output_dir', help="Where compressed files are written")
+    parser.add_argument('--resolution', default='1080p', choices=['480p', '720p', '1080p', '2k', '4k'])
+    parser.add_argument('--bitrate-choice', type=int, default=2, choices=[1, 2, 3])
+    parser.add_argument('--target-size-mb', type=float, default=None, help="Cap each output at this size")
+    parser.add_argument('--jobs', type=int, default=None, help="Files to compress at once")
+    parser.add_argument('--threads-per-job', type=int, default=None, help="Encoder threads per file")
+    parser.add_argument('--report', default='compression_report.csv', help="Results file (.csv or .json)")
+    parser.add_argument('--force', action='store_true', help="Re-encode outputs that are up to date")
+    parser.add_argument('--resume', action='store_true', help="Checkpoint encodes so a rerun resumes them")
+    parser.add_argument('--auto-crop', action='store_true', help="Detect and crop black bars")
+    parser.add_argument('--content-aware', action='store_true', help="Lower the bitrate for easy content")
+    parser.add_argument('--encoder', default=None, choices=list(ENCODERS),
+                        help="Video encoder (default: the best available for --profile)")
+    parser.add_argument('--profile', default=None, choices=list(PROFILES),
+                        help="Speed/size trade-off (default: smallest)")
+    args = parser.parse_args()
+
+    results = compress_batch(args.source, args.output_dir, args.resolution, args.bitrate_choice,
+                             args.target_size_mb, args.jobs, args.threads_per_job, args.force, args.resume,
+                             args.auto_crop, args.content_aware, args.encoder, args.profile)
+    write_report(results, args.report)
+    failed = sum(1 for r in results if r['status'] == 'failed')
+    print(f"\nDone: {len(results) - failed} succeeded or skipped, {failed} failed. Report: {args.report}")
+
+if __name__ == "__main__":
+    main()
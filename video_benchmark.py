@@ -0,0 +1,195 @@
+import argparse
+import json
+import multiprocessing
+import os
+import platform
+import re
+import resource
+import subprocess
+import sys
+import time
+from video_batch_compress import load_compress_video
+from video_filters import RESOLUTION_HEIGHTS
+from video_probe import ffmpeg_capabilities, probe_media
+
+BENCH_DIR = os.environ.get('VIDEO_BENCH_DIR', './bench')
+# Relative change that counts as a regression in compare mode
+TIME_TOLERANCE = 0.10
+SIZE_TOLERANCE = 0.05
+QUALITY_TOLERANCE = 0.005  # Absolute SSIM drop
+
+SUBTITLES = """1
+00:00:00,500 --> 00:00:02,000
+Benchmark subtitle one
+
+2
+00:00:02,500 --> 00:00:04,000
+Benchmark subtitle two
+"""
+
+def tier_size(resolution: str) -> tuple:
+    """16:9 frame size for a resolution tier, with even dimensions."""
+    height = RESOLUTION_HEIGHTS[resolution]
+    return int(round(height * 16 / 9 / 2)) * 2, height
+
+def generate_source(resolution: str, duration: float, bench_dir: str = BENCH_DIR) -> str:
+    """
+    Create a deterministic synthetic source for a tier (reused if it already exists).
+
+    The video is ffmpeg's testsrc2 pattern with fixed-seed noise on top so
+    the encoder has real detail to work on; it comes with a sine audio
+    track and an SRT subtitle track. The source is encoded single-threaded
+    at near-lossless quality so every machine generates the same file.
+    """
+    os.makedirs(bench_dir, exist_ok=True)
+    width, height = tier_size(resolution)
+    path = os.path.join(bench_dir, f'source_{resolution}_{duration:g}s.mkv')
+    if os.path.exists(path):
+        return path
+    srt_path = os.path.join(bench_dir, 'bench.srt')
+    with open(srt_path, 'w') as f:
+        f.write(SUBTITLES)
+    cmd = [
+        'ffmpeg', '-y', '-loglevel', 'error',
+        '-f', 'lavfi', '-i', f'testsrc2=size={width}x{height}:rate=30:duration={duration}',
+        '-f', 'lavfi', '-i', f'sine=frequency=440:sample_rate=48000:duration={duration}',
+        '-i', srt_path,
+        '-vf', 'noise=alls=12:allf=t:all_seed=1234',
+        '-map', '0:v', '-map', '1:a', '-map', '2:s',
+        '-c:v', 'libx264', '-preset', 'ultrafast', '-crf', '8', '-threads', '1', '-pix_fmt', 'yuv420p',
+        '-c:a', 'flac', '-c:s', 'srt',
+        '-fflags', '+bitexact', '-flags:v', '+bitexact', '-flags:a', '+bitexact',
+        path
+    ]
+    subprocess.run(cmd, check=True, capture_output=True)
+    return path
+
+def measure_quality(output_path: str, source_path: str) -> dict:
+    """SSIM and PSNR of the output against the source, scaled back to the source size."""
+    video = probe_media(source_path).video
+    width, height = video.width, video.height
+    graph = (f'[0:v]scale={width}:{height}:flags=bicubic,split[a][b];'
+             f'[1:v]split[c][d];[a][c]ssim;[b][d]psnr')
+    result = subprocess.run(['ffmpeg', '-i', output_path, '-i', source_path, '-lavfi', graph, '-f', 'null', '-'],
+                            capture_output=True, text=True)
+    ssim = re.search(r'SSIM .*All:([\d.]+)', result.stderr)
+    psnr = re.search(r'PSNR .*average:([\d.]+|inf)', result.stderr)
+    return {'ssim': float(ssim.group(1)) if ssim else None,
+            'psnr': float(psnr.group(1)) if psnr else None}
+
+def _run_case(source_path: str, output_path: str, resolution: str, chunked: bool, queue):
+    """Child process body: compress once and report wall time and the peak RSS of ffmpeg."""
+    compress_video = load_compress_video()
+    start_time = time.time()
+    compress_video(source_path, output_path, target_size_mb=None, resolution=resolution,
+                   bitrate_choice=2, chunked=chunked, show_progress=False)
+    wall_time = time.time() - start_time
+    # ru_maxrss is in KiB on Linux; the children are the ffmpeg processes
+    queue.put({'wall_time': wall_time,
+               'peak_rss_mb': resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss / 1024})
+
+def run_case(source_path: str, resolution: str, path_name: str, duration: float, bench_dir: str = BENCH_DIR) -> dict:
+    """
+    Run one compressor path on one source in a fresh process and collect its metrics.
+
+    A fresh process per case keeps RUSAGE_CHILDREN's peak RSS scoped to
+    that case's ffmpeg processes.
+    """
+    output_path = os.path.join(bench_dir, f'out_{resolution}_{path_name}.mkv')
+    context = multiprocessing.get_context('spawn')
+    queue = context.Queue()
+    process = context.Process(target=_run_case, args=(source_path, output_path, resolution,
+                                                      path_name == 'chunked', queue))
+    process.start()
+    process.join()
+    if process.exitcode != 0:
+        raise RuntimeError(f"Benchmark case {resolution}/{path_name} failed")
+    metrics = queue.get()
+    frames = duration * 30
+    return {
+        'case': f'{resolution}/{path_name}',
+        'resolution': resolution,
+        'path': path_name,
+        'wall_time': round(metrics['wall_time'], 3),
+        'encode_fps': round(frames / metrics['wall_time'], 2),
+        'peak_rss_mb': round(metrics['peak_rss_mb'], 1),
+        'output_mb': round(os.path.getsize(output_path) / (1024 * 1024), 3),
+        **measure_quality(output_path, source_path),
+    }
+
+def run_benchmark(resolutions: list, paths: list, duration: float, bench_dir: str = BENCH_DIR) -> dict:
+    """Generate the sources and benchmark every (tier, path) combination."""
+    results = []
+    for resolution in resolutions:
+        source_path = generate_source(resolution, duration, bench_dir)
+        for path_name in paths:
+            print(f"Benchmarking {resolution} / {path_name}...")
+            results.append(run_case(source_path, resolution, path_name, duration, bench_dir))
+    return {
+        'environment': {
+            'ffmpeg': ffmpeg_capabilities()['version'],
+            'cpu_count': os.cpu_count(),
+            'platform': platform.platform(),
+            'python': platform.python_version(),
+        },
+        'duration': duration,
+        'time': time.time(),
+        'results': results,
+    }
+
+def compare(current: dict, baseline: dict) -> list:
+    """Return a description of every metric that regressed against the baseline."""
+    baseline_cases = {r['case']: r for r in baseline['results']}
+    regressions = []
+    for result in current['results']:
+        base = baseline_cases.get(result['case'])
+        if base is None:
+            continue
+        if result['wall_time'] > base['wall_time'] * (1 + TIME_TOLERANCE):
+            regressions.append(f"{result['case']}: wall time {base['wall_time']:.2f}s -> {result['wall_time']:.2f}s")
+        if result['output_mb'] > base['output_mb'] * (1 + SIZE_TOLERANCE):
+            regressions.append(f"{result['case']}: output {base['output_mb']:.2f} MB -> {result['output_mb']:.2f} MB")
+        if base.get('ssim') and result.get('ssim') and result['ssim'] < base['ssim'] - QUALITY_TOLERANCE:
+            regressions.append(f"{result['case']}: SSIM {base['ssim']:.4f} -> {result['ssim']:.4f}")
+    return regressions
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark compress_video on synthetic sources.")
+    sub = parser.add_subparsers(dest='command', required=True)
+    run = sub.add_parser('run', help="Run the benchmark and write results to JSON")
+    run.add_argument('--out', default='benchmark.json')
+    run.add_argument('--tiers', default='480p,720p,1080p', help="Comma separated resolution tiers")
+    run.add_argument('--paths', default='single,chunked', help="Compressor paths: single, chunked")
+    run.add_argument('--duration', type=float, default=5, help="Seconds of synthetic video per source")
+    run.add_argument('--baseline', help="Also compare against this baseline JSON")
+    cmp_parser = sub.add_parser('compare', help="Compare a results JSON against a baseline JSON")
+    cmp_parser.add_argument('current')
+    cmp_parser.add_argument('baseline')
+    args = parser.parse_args()
+
+    if args.command == 'run':
+        current = run_benchmark(args.tiers.split(','), args.paths.split(','), args.duration)
+        with open(args.out, 'w') as f:
+            json.dump(current, f, indent=2)
+        for r in current['results']:
+            print(f"{r['case']:>16}: {r['wall_time']:.2f}s, {r['encode_fps']:.1f} fps, "
+                  f"{r['peak_rss_mb']:.0f} MB RSS, {r['output_mb']:.2f} MB, SSIM {r['ssim']}")
+        print(f"Results written to {args.out}")
+        baseline_path = args.baseline
+    else:
+        with open(args.current) as f:
+            current = json.load(f)
+        baseline_path = args.baseline
+
+    if baseline_path:
+        with open(baseline_path) as f:
+            regressions = compare(current, json.load(f))
+        if regressions:
+            print("\nRegressions against the baseline:")
+            for line in regressions:
+                print(f"  {line}")
+            sys.exit(1)
+        print("\nNo regressions against the baseline.")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,406 @@
+import argparse
+import asyncio
+import email
+import email.policy
+import json
+import math
+import os
+import platform
+import random
+import resource
+import statistics
+import subprocess
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs
+import video_probe
+from video_benchmark import tier_size
+from video_time_predictor import EncodeTimePredictor
+
+LOADTEST_DIR = os.environ.get('VIDEO_LOADTEST_DIR', './loadtest')
+DOWNLOADS_DIR = './downloads'  # Where the bot keeps inputs and outputs while it works
+FAKE_TOKEN = '123456:LOADTEST'
+BOT_USER = {'id': 123456, 'is_bot': True, 'first_name': 'Compressor', 'username': 'compressor_loadtest_bot'}
+DISK_SAMPLE_INTERVAL = 0.2
+ERROR_PREFIX = 'An error occurred'
+
+
+class FakeBotAPI:
+    """
+    Local stand-in for the Telegram Bot API, enough for the compression bot.
+
+    Serves getUpdates from updates pushed by the load generator, serves
+    uploaded videos through getFile and the file endpoint, and records
+    each chat's final answer: a sendVideo, or a message reporting an error.
+    """
+
+    def __init__(self, host: str = '127.0.0.1', port: int = 0):
+        handler = type('Handler', (_BotAPIHandler,), {'api': self})
+        self.server = ThreadingHTTPServer((host, port), handler)
+        self.server.daemon_threads = True
+        self.host, self.port = self.server.server_address[:2]
+        self.files = {}
+        self.replies = {}
+        self.calls = {}
+        self._updates = []
+        self._update_ids = iter(range(1, 1 << 62))
+        self._message_ids = iter(range(1, 1 << 62))
+        self._reply_events = {}
+        self._lock = threading.Condition()
+
+    @property
+    def base_url(self) -> str:
+        return f'http://{self.host}:{self.port}/bot'
+
+    @property
+    def base_file_url(self) -> str:
+        return f'http://{self.host}:{self.port}/file/bot'
+
+    def start(self):
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def add_file(self, file_id: str, unique_id: str, path: str):
+        self.files[file_id] = {'file_unique_id': unique_id, 'path': path}
+
+    def push_video(self, chat_id: int, file_id: str, width: int, height: int, duration: float) -> float:
+        """Queue a video message from a user (chat_id doubles as the user id); returns when it was sent."""
+        info = self.files[file_id]
+        with self._lock:
+            self._reply_events[chat_id] = threading.Event()
+            self._updates.append({'update_id': next(self._update_ids), 'message': {
+                'message_id': next(self._message_ids),
+                'date': int(time.time()),
+                'chat': {'id': chat_id, 'type': 'private'},
+                'from': {'id': chat_id, 'is_bot': False, 'first_name': f'user{chat_id}'},
+                'video': {'file_id': file_id, 'file_unique_id': info['file_unique_id'], 'width': width,
+                          'height': height, 'duration': int(round(duration)),
+                          'file_size': os.path.getsize(info['path']), 'mime_type': 'video/mp4'},
+            }})
+            self._lock.notify_all()
+        return time.monotonic()
+
+    def wait_reply(self, chat_id: int, timeout: float):
+        """Block until the chat got its answer; returns (time, kind) or None on timeout."""
+        if not self._reply_events[chat_id].wait(timeout):
+            return None
+        return self.replies[chat_id]
+
+    def _reply(self, chat_id: int, kind: str):
+        with self._lock:
+            if chat_id in self.replies or chat_id not in self._reply_events:
+                return
+            self.replies[chat_id] = (time.monotonic(), kind)
+            self._reply_events[chat_id].set()
+
+    def _message(self, chat_id, text: str = None, **extra) -> dict:
+        message = {'message_id': next(self._message_ids), 'date': int(time.time()),
+                   'chat': {'id': int(chat_id), 'type': 'private'}, 'from': BOT_USER, **extra}
+        if text is not None:
+            message['text'] = text
+        return message
+
+    def call(self, method: str, params: dict):
+        """Answer one Bot API method call."""
+        with self._lock:
+            self.calls[method] = self.calls.get(method, 0) + 1
+        if method == 'getMe':
+            return BOT_USER
+        if method == 'getUpdates':
+            offset = int(params.get('offset') or 0)
+            with self._lock:
+                self._updates = [u for u in self._updates if u['update_id'] >= offset]
+                if not self._updates:
+                    self._lock.wait(float(params.get('timeout') or 0))
+                return list(self._updates)
+        if method == 'getFile':
+            file_id = params['file_id']
+            info = self.files[file_id]
+            return {'file_id': file_id, 'file_unique_id': info['file_unique_id'],
+                    'file_size': os.path.getsize(info['path']), 'file_path': f'videos/{file_id}.mp4'}
+        if method in ('sendMessage', 'editMessageText'):
+            text = params.get('text', '')
+            if method == 'sendMessage' and text.startswith(ERROR_PREFIX):
+                self._reply(int(params['chat_id']), 'error')
+            return self._message(params.get('chat_id', 0), text)
+        if method == 'sendVideo':
+            self._reply(int(params['chat_id']), 'video')
+            return self._message(params['chat_id'], video={
+                'file_id': 'sent', 'file_unique_id': 'sent', 'width': 0, 'height': 0, 'duration': 0})
+        return True  # deleteWebhook, setMyCommands, close and friends
+
+
+class _BotAPIHandler(BaseHTTPRequestHandler):
+    api = None  # Set on the subclass FakeBotAPI creates
+
+    def log_message(self, format, *args):
+        pass
+
+    def _params(self) -> dict:
+        body = self.rfile.read(int(self.headers.get('Content-Length') or 0))
+        content_type = self.headers.get('Content-Type', '')
+        if content_type.startswith('application/json'):
+            return json.loads(body or b'{}')
+        if content_type.startswith('multipart/form-data'):
+            message = email.message_from_bytes(f'Content-Type: {content_type}\r\n\r\n'.encode() + body,
+                                               policy=email.policy.HTTP)
+            params = {}
+            for part in message.iter_parts():
+                name = part.get_param('name', header='content-disposition')
+                payload = part.get_payload(decode=True) or b''
+                # Uploaded files are only counted, their bytes are not kept
+                params[name] = len(payload) if part.get_filename() else payload.decode(errors='replace')
+            return params
+        return {key: values[-1] for key, values in parse_qs(body.decode()).items()}
+
+    def _send_json(self, data: dict, status: int = 200):
+        body = json.dumps(data).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_POST(self):
+        _, _, method = self.path.partition('/bot')[2].partition('/')
+        try:
+            result = self.api.call(method.split('?')[0], self._params())
+        except KeyError as e:
+            self._send_json({'ok': False, 'error_code': 400, 'description': f'Bad Request: {e}'}, 400)
+            return
+        self._send_json({'ok': True, 'result': result})
+
+    def do_GET(self):
+        if not self.path.startswith('/file/bot'):
+            return self.do_POST()
+        file_id = os.path.splitext(os.path.basename(self.path))[0]
+        info = self.api.files.get(file_id)
+        if info is None:
+            self._send_json({'ok': False, 'error_code': 404, 'description': 'Not Found'}, 404)
+            return
+        self.send_response(200)
+        self.send_header('Content-Type', 'video/mp4')
+        self.send_header('Content-Length', str(os.path.getsize(info['path'])))
+        self.end_headers()
+        with open(info['path'], 'rb') as f:
+            while chunk := f.read(256 * 1024):
+                self.wfile.write(chunk)
+
+
+def generate_upload(resolution: str, duration: float, seed: int, streamable: bool,
+                    loadtest_dir: str = LOADTEST_DIR) -> str:
+    """
+    Create a phone-like upload (H.264 + AAC in MP4), reused if it already exists.
+
+    Each seed gives different content, so different seeds never share a
+    cache entry. streamable puts the MP4 index first (faststart); without
+    it the index is at the end, as most phones write it.
+    """
+    os.makedirs(loadtest_dir, exist_ok=True)
+    width, height = tier_size(resolution)
+    layout = 'faststart' if streamable else 'moovlast'
+    path = os.path.join(loadtest_dir, f'upload_{resolution}_{duration:g}s_{seed}_{layout}.mp4')
+    if os.path.exists(path):
+        return path
+    cmd = [
+        'ffmpeg', '-y', '-loglevel', 'error',
+        '-f', 'lavfi', '-i', f'testsrc2=size={width}x{height}:rate=30:duration={duration}',
+        '-f', 'lavfi', '-i', f'sine=frequency={220 + seed}:sample_rate=48000:duration={duration}',
+        '-vf', f'noise=alls=12:allf=t:all_seed={seed}',
+        '-c:v', 'libx264', '-preset', 'ultrafast', '-crf', '18', '-pix_fmt', 'yuv420p',
+        '-c:a', 'aac', '-b:a', '128k',
+        *(['-movflags', '+faststart'] if streamable else []),
+        path
+    ]
+    subprocess.run(cmd, check=True, capture_output=True)
+    return path
+
+def plan_uploads(mix: list, jobs: int, duplicates: float, streamable: float, seed: int = 1) -> list:
+    """
+    Pick the uploads for a run: (resolution, duration) from the mix, a share
+    of them re-sending an earlier video (forwards, which the bot's result
+    cache should answer), and a share with the MP4 index up front.
+    """
+    rng = random.Random(seed)
+    uploads = []
+    for index in range(jobs):
+        if uploads and rng.random() < duplicates:
+            uploads.append(dict(rng.choice([u for u in uploads if not u['duplicate']]), duplicate=True))
+            continue
+        resolution, duration = mix[index % len(mix)]
+        uploads.append({'file_id': f'file{index}', 'resolution': resolution, 'duration': duration,
+                        'seed': index + 1, 'streamable': rng.random() < streamable, 'duplicate': False})
+    return uploads
+
+def directory_size(path: str) -> int:
+    total = 0
+    for root, _, names in os.walk(path):
+        for name in names:
+            try:
+                total += os.path.getsize(os.path.join(root, name))
+            except OSError:
+                pass  # Removed while walking
+    return total
+
+def percentile(values: list, fraction: float):
+    """Nearest-rank percentile, or None for no values."""
+    if not values:
+        return None
+    ordered = sorted(values)
+    return ordered[max(0, math.ceil(fraction * len(ordered)) - 1)]
+
+def _cpu_seconds() -> float:
+    usage = [resource.getrusage(who) for who in (resource.RUSAGE_SELF, resource.RUSAGE_CHILDREN)]
+    return sum(u.ru_utime + u.ru_stime for u in usage)
+
+async def run_level(bot, api: FakeBotAPI, uploads: list, concurrency: int, chat_base: int,
+                    reply_timeout: float, cache_dir: str) -> dict:
+    """Replay the uploads with at most concurrency of them waiting for an answer at once."""
+    from video_cache import ResultCache
+    # Every level starts from an empty result cache so levels are comparable
+    bot.result_cache = ResultCache(cache_dir)
+    application = bot.build_application(FAKE_TOKEN, api.base_url, api.base_file_url)
+
+    peak_disk = 0
+    sampling = threading.Event()
+
+    def sample_disk():
+        nonlocal peak_disk
+        while not sampling.wait(DISK_SAMPLE_INTERVAL):
+            peak_disk = max(peak_disk, directory_size(DOWNLOADS_DIR))
+
+    semaphore = asyncio.Semaphore(concurrency)
+    latencies, outcomes = [], {'video': 0, 'error': 0, 'timeout': 0}
+
+    async def send(index: int, upload: dict):
+        async with semaphore:
+            chat_id = chat_base + index
+            sent = api.push_video(chat_id, upload['file_id'], *tier_size(upload['resolution']), upload['duration'])
+            reply = await asyncio.to_thread(api.wait_reply, chat_id, reply_timeout)
+            if reply is None:
+                outcomes['timeout'] += 1
+                return
+            outcomes[reply[1]] += 1
+            latencies.append(reply[0] - sent)
+
+    sampler = threading.Thread(target=sample_disk, daemon=True)
+    async with application:
+        await application.start()
+        await application.updater.start_polling(poll_interval=0, timeout=1)
+        cpu_start, start = _cpu_seconds(), time.monotonic()
+        sampler.start()
+        try:
+            await asyncio.gather(*(send(i, u) for i, u in enumerate(uploads)))
+        finally:
+            elapsed = time.monotonic() - start
+            cpu = _cpu_seconds() - cpu_start
+            sampling.set()
+            sampler.join()
+            await application.updater.stop()
+            await application.stop()
+
+    return {
+        'concurrency': concurrency,
+        'jobs': len(uploads),
+        'outcomes': outcomes,
+        'elapsed': round(elapsed, 2),
+        'jobs_per_minute': round(outcomes['video'] / elapsed * 60, 2) if elapsed else None,
+        'p50': percentile(latencies, 0.50),
+        'p95': percentile(latencies, 0.95),
+        'p99': percentile(latencies, 0.99),
+        'mean': statistics.mean(latencies) if latencies else None,
+        'cpu_seconds': round(cpu, 2),
+        'cpu_percent': round(cpu / elapsed / (os.cpu_count() or 1) * 100, 1) if elapsed else None,
+        'peak_downloads_mb': round(peak_disk / (1024 * 1024), 2),
+    }
+
+async def run_loadtest(mix: list, jobs: int, duplicates: float, streamable: float, levels: list,
+                       reply_timeout: float, loadtest_dir: str = LOADTEST_DIR) -> dict:
+    """Generate the uploads, start the fake Bot API and the bot against it, and run every concurrency level."""
+    # Keep the probe cache and encode history of synthetic uploads out of the real ./cache
+    os.makedirs(loadtest_dir, exist_ok=True)
+    history_path = os.path.join(loadtest_dir, 'encode_history.jsonl')
+    os.environ['VIDEO_ENCODE_HISTORY'] = history_path
+    os.environ['VIDEO_PROBE_CACHE'] = os.path.join(loadtest_dir, 'probe.sqlite3')
+    # video_benchmark already imported these, so point them at the new paths too
+    video_probe.PROBE_CACHE_PATH = os.environ['VIDEO_PROBE_CACHE']
+    import video_compression_bot as bot
+    bot.predictor = EncodeTimePredictor(history_path)
+
+    uploads = plan_uploads(mix, jobs, duplicates, streamable)
+    api = FakeBotAPI()
+    for upload in uploads:
+        if not upload['duplicate']:
+            path = generate_upload(upload['resolution'], upload['duration'], upload['seed'],
+                                   upload['streamable'], loadtest_dir)
+            api.add_file(upload['file_id'], f"unique_{upload['seed']}", path)
+    os.makedirs(DOWNLOADS_DIR, exist_ok=True)
+    api.start()
+    results = []
+    try:
+        for level_index, concurrency in enumerate(levels):
+            print(f"Concurrency {concurrency}: replaying {len(uploads)} upload(s)...")
+            # Fresh chats per level, so every level sees first-time users
+            result = await run_level(bot, api, uploads, concurrency, (level_index + 1) * 1_000_000,
+                                     reply_timeout, os.path.join(loadtest_dir, f'cache_{level_index}'))
+            print_level(result)
+            results.append(result)
+    finally:
+        api.stop()
+    return {
+        'environment': {'python': platform.python_version(), 'platform': platform.platform(),
+                        'cpus': os.cpu_count(), 'bot_mode': bot.BOT_MODE, 'max_workers': bot.scheduler.max_workers},
+        'mix': [f'{resolution}:{duration:g}' for resolution, duration in mix],
+        'duplicates': duplicates,
+        'streamable': streamable,
+        'api_calls': api.calls,
+        'levels': results,
+    }
+
+def _seconds(value) -> str:
+    return '-' if value is None else f'{value:.2f}s'
+
+def print_level(result: dict):
+    outcomes = result['outcomes']
+    print(f"  {outcomes['video']} video(s), {outcomes['error']} error(s), {outcomes['timeout']} timeout(s) "
+          f"in {result['elapsed']:.1f} s ({result['jobs_per_minute']} jobs/min)")
+    print(f"  time to reply: p50 {_seconds(result['p50'])}, p95 {_seconds(result['p95'])}, "
+          f"p99 {_seconds(result['p99'])}")
+    print(f"  CPU: {result['cpu_seconds']:.1f} s ({result['cpu_percent']}% of the machine), "
+          f"peak {DOWNLOADS_DIR}: {result['peak_downloads_mb']} MB")
+
+def parse_mix(text: str) -> list:
+    """Parse '480p:10,1080p:30' into [(resolution, seconds), ...]."""
+    mix = []
+    for item in text.split(','):
+        resolution, _, duration = item.strip().partition(':')
+        mix.append((resolution, float(duration or 10)))
+    return mix
+
+def main():
+    parser = argparse.ArgumentParser(description="Load-test the compression bot against a local fake Bot API.")
+    parser.add_argument('--mix', default='480p:10,720p:10,1080p:10',
+                        help="Comma separated resolution:seconds uploads, used in turn")
+    parser.add_argument('--jobs', type=int, default=12, help="Uploads per concurrency level")
+    parser.add_argument('--duplicates', type=float, default=0.25, help="Share of uploads re-sending an earlier video")
+    parser.add_argument('--streamable', type=float, default=0.5, help="Share of uploads with the MP4 index first")
+    parser.add_argument('--concurrency', default='1,4', help="Comma separated numbers of uploads in flight")
+    parser.add_argument('--reply-timeout', type=float, default=900, help="Seconds to wait for each answer")
+    parser.add_argument('--dir', default=LOADTEST_DIR, help="Where uploads and per-level caches are kept")
+    parser.add_argument('--out', default=None, help="Write the results as JSON")
+    args = parser.parse_args()
+
+    levels = [int(level) for level in args.concurrency.split(',')]
+    report = asyncio.run(run_loadtest(parse_mix(args.mix), args.jobs, args.duplicates, args.streamable,
+                                      levels, args.reply_timeout, args.dir))
+    if args.out:
+        with open(args.out, 'w') as f:
+            json.dump(report, f, indent=2)
+        print(f"Results written to {args.out}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,156 @@
+import asyncio
+import hashlib
+import json
+import os
+import shutil
+import time
+
+CACHE_DIR = os.environ.get('VIDEO_CACHE_DIR', './cache')
+CACHE_BUDGET_MB = float(os.environ.get('VIDEO_CACHE_BUDGET_MB', 2048))  # Disk budget for cached results
+
+def hash_file(path: str, chunk_size: int = 1024 * 1024) -> str:
+    """Return the SHA-256 hex digest of a file's contents."""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+def make_cache_key(content_hash: str, params: dict) -> str:
+    """Combine an input content hash with the encode parameters into a cache key."""
+    encoded = json.dumps(params, sort_keys=True, separators=(',', ':'))
+    return hashlib.sha256(f'{content_hash}:{encoded}'.encode()).hexdigest()
+
+
+class ResultCache:
+    """
+    Persistent on-disk cache of compressed videos.
+
+    Entries are keyed by the content hash of the input plus the encode
+    parameters and evicted least-recently-used first once the cache grows
+    past its disk budget. Concurrent requests for the same key share a
+    single encode (single-flight) instead of each starting their own.
+    """
+
+    def __init__(self, cache_dir: str = CACHE_DIR, budget_mb: float = CACHE_BUDGET_MB):
+        self.cache_dir = cache_dir
+        self.budget_bytes = int(budget_mb * 1024 * 1024)
+        self.index_path = os.path.join(cache_dir, 'index.json')
+        os.makedirs(cache_dir, exist_ok=True)
+        self._index = self._load_index()
+        self._in_flight = {}
+
+    def _load_index(self) -> dict:
+        try:
+            with open(self.index_path) as f:
+                index = json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError):
+            index = {'entries': {}, 'aliases': {}}
+        # Drop entries whose files were removed behind our back
+        index['entries'] = {key: entry for key, entry in index['entries'].items()
+                            if os.path.exists(self._path_for(key, entry['ext']))}
+        return index
+
+    def _save_index(self):
+        tmp_path = self.index_path + '.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump(self._index, f)
+        os.replace(tmp_path, self.index_path)
+
+    def _path_for(self, key: str, ext: str) -> str:
+        return os.path.join(self.cache_dir, f'{key}{ext}')
+
+    def get(self, key: str):
+        """Return the cached file path for a key, or None on a miss."""
+        entry = self._index['entries'].get(key)
+        if entry is None:
+            return None
+        path = self._path_for(key, entry['ext'])
+        if not os.path.exists(path):
+            del self._index['entries'][key]
+            self._save_index()
+            return None
+        entry['last_used'] = time.time()
+        self._save_index()
+        return path
+
+    def put(self, key: str, source_path: str) -> str:
+        """Move a finished result into the cache and return its cached path."""
+        ext = os.path.splitext(source_path)[1]
+        path = self._path_for(key, ext)
+        shutil.move(source_path, path)
+        self._index['entries'][key] = {
+            'ext': ext,
+            'size': os.path.getsize(path),
+            'last_used': time.time(),
+        }
+        self._evict(keep=key)
+        self._save_index()
+        return path
+
+    def alias(self, name: str, content_hash: str):
+        """Remember the content hash of an input known by another id (e.g. a Telegram file_unique_id)."""
+        self._index['aliases'][name] = content_hash
+        self._save_index()
+
+    def resolve_alias(self, name: str):
+        """Return the content hash recorded for an alias, or None."""
+        return self._index['aliases'].get(name)
+
+    def _evict(self, keep: str = None):
+        """Remove least recently used entries until the cache fits its budget."""
+        entries = self._index['entries']
+        total = sum(entry['size'] for entry in entries.values())
+        for key in sorted(entries, key=lambda k: entries[k]['last_used']):
+            if total <= self.budget_bytes:
+                break
+            if key == keep:
+                continue
+            entry = entries.pop(key)
+            total -= entry['size']
+            path = self._path_for(key, entry['ext'])
+            if os.path.exists(path):
+                os.remove(path)
+
+    async def get_or_create(self, key: str, create):
+        """
+        Return the cached path for a key, running `await create()` on a miss.
+
+        `create` must return the path of a freshly produced file, which is
+        moved into the cache. Callers asking for a key that is already being
+        produced wait for that result instead of starting another one.
+        """
+        path = self.get(key)
+        if path is not None:
+            return path
+
+        async def create_and_put():
+            return self.put(key, await create())
+        return await self.single_flight(key, create_and_put)
+
+    async def single_flight(self, name: str, produce):
+        """
+        Return `await produce()`, running it once for concurrent callers with the same name.
+
+        Callers arriving while a name is in flight wait for that run's
+        result (or exception) instead of starting another one.
+        """
+        if name in self._in_flight:
+            return await asyncio.shield(self._in_flight[name])
+
+        future = asyncio.get_running_loop().create_future()
+        self._in_flight[name] = future
+        try:
+            result = await produce()
+            future.set_result(result)
+            return result
+        except asyncio.CancelledError:
+            future.cancel()
+            raise
+        except Exception as e:
+            future.set_exception(e)
+            # Mark the exception as retrieved when nobody else was waiting
+            future.exception()
+            raise
+        finally:
+            del self._in_flight[name]
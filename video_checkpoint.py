@@ -0,0 +1,158 @@
+import json
+import os
+import shutil
+import time
+import ffmpeg
+from video_probe import media_info_from_probe
+from video_segment_encoder import (MANIFEST_NAME, encode_pending_segments, encoded_path_for, join_segments,
+                                   prepare_job, release_stale_claims, split_output_options, wait_for_segments)
+
+JOURNAL_NAME = 'journal.jsonl'
+# How far the published file's duration may drift from the source's
+DURATION_TOLERANCE = 0.01
+MIN_DURATION_TOLERANCE = 1.0  # Seconds
+
+def partial_output_path(output_path: str) -> str:
+    """Where an output is written until it is verified; keeps the extension so ffmpeg picks the same muxer."""
+    stem, ext = os.path.splitext(output_path)
+    return f'{stem}.partial{ext}'
+
+def work_dir_for(output_path: str) -> str:
+    """Fixed job directory next to the output, so a restarted run finds its earlier segments."""
+    return output_path + '.job'
+
+def verify_output(path: str, expected_duration: float = None):
+    """Raise ValueError unless path is a readable video whose duration matches the source."""
+    # Probed directly: a partial file is transient and not worth a probe cache entry
+    try:
+        media = media_info_from_probe(path, ffmpeg.probe(path))
+    except ffmpeg.Error as e:
+        raise ValueError(f"Output cannot be read: {path}") from e
+    if media.video is None:
+        raise ValueError(f"Output has no video stream: {path}")
+    if expected_duration:
+        tolerance = max(MIN_DURATION_TOLERANCE, expected_duration * DURATION_TOLERANCE)
+        if abs(media.duration - expected_duration) > tolerance:
+            raise ValueError(f"Output is {media.duration:.1f}s long, expected {expected_duration:.1f}s: {path}")
+
+def publish_output(partial_path: str, output_path: str, expected_duration: float = None):
+    """
+    Verify a finished encode and move it into place atomically.
+
+    The output path only ever holds a complete, verified file: either the
+    previous one or the new one, never a truncated encode.
+    """
+    verify_output(partial_path, expected_duration)
+    with open(partial_path, 'rb') as f:
+        os.fsync(f.fileno())
+    os.replace(partial_path, output_path)
+    directory = os.path.dirname(os.path.abspath(output_path))
+    if hasattr(os, 'O_DIRECTORY'):
+        # Persist the rename itself (not supported on Windows)
+        fd = os.open(directory, os.O_RDONLY | os.O_DIRECTORY)
+        try:
+            os.fsync(fd)
+        finally:
+            os.close(fd)
+
+def discard_partial(partial_path: str):
+    """Remove a partial output left by a failed encode."""
+    if os.path.exists(partial_path):
+        os.remove(partial_path)
+
+
+class JobJournal:
+    """
+    Append-only JSON-lines log of a resumable job's progress.
+
+    Every event is flushed to disk before the call returns, so after a
+    crash the journal shows exactly which steps completed.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+
+    def append(self, event: str, **fields):
+        with open(self.path, 'a') as f:
+            f.write(json.dumps({'event': event, 'time': time.time(), **fields}) + '\n')
+            f.flush()
+            os.fsync(f.fileno())
+
+    def events(self) -> list:
+        if not os.path.exists(self.path):
+            return []
+        events = []
+        with open(self.path) as f:
+            for line in f:
+                try:
+                    events.append(json.loads(line))
+                except json.JSONDecodeError:
+                    break  # A torn last line from a crash mid-write
+        return events
+
+
+def _job_identity(input_path: str, video_options: dict, segment_seconds: float) -> dict:
+    """What a job directory must match to be resumed rather than started over."""
+    st = os.stat(input_path)
+    return {'input_path': os.path.abspath(input_path), 'size': st.st_size, 'mtime_ns': st.st_mtime_ns,
+            'video_options': video_options, 'segment_seconds': segment_seconds}
+
+def encode_resumable(input_path: str, output_path: str, output_options: dict, expected_duration: float = None,
+                     workers: int = None, segment_seconds: float = 60, cores: int = None) -> dict:
+    """
+    Encode in durable segments that survive a crash, then publish atomically.
+
+    Segments and a job journal are kept in a directory next to the output.
+    Running the same job again after a crash or Ctrl-C skips every segment
+    that was already finished; changing the input or the video options
+    starts the job over. The joined file is verified before it replaces
+    output_path, and the job directory is removed once it has.
+    """
+    video_options, join_options = split_output_options(output_options)
+    work_dir = work_dir_for(output_path)
+    journal = JobJournal(os.path.join(work_dir, JOURNAL_NAME))
+    identity = _job_identity(input_path, video_options, segment_seconds)
+
+    prepared = [e for e in journal.events() if e['event'] == 'prepared']
+    if prepared and prepared[-1]['identity'] == identity and os.path.exists(os.path.join(work_dir, MANIFEST_NAME)):
+        with open(os.path.join(work_dir, MANIFEST_NAME)) as f:
+            segments = [os.path.join(work_dir, name) for name in json.load(f)['segments']]
+        released = release_stale_claims(work_dir)
+        done = sum(1 for path in segments if os.path.exists(encoded_path_for(path)))
+        print(f"Resuming: {done} of {len(segments)} segments already encoded"
+              + (f", {released} interrupted segment(s) to redo" if released else ""))
+    else:
+        if os.path.exists(work_dir):
+            shutil.rmtree(work_dir)  # Left by a different input or different settings
+        segments = prepare_job(input_path, work_dir, video_options, segment_seconds)
+        journal.append('prepared', identity=identity, segments=len(segments))
+        done = 0
+
+    def record_segment(path, seconds):
+        journal.append('segment_encoded', segment=os.path.basename(path), seconds=seconds)
+
+    start_time = time.time()
+    timings = encode_pending_segments(work_dir, workers, on_segment=record_segment, cores=cores)
+    timings.update(wait_for_segments(work_dir, segments, workers, on_segment=record_segment, cores=cores))
+
+    partial_path = partial_output_path(output_path)
+    try:
+        join_segments(work_dir, input_path, partial_path, join_options)
+        publish_output(partial_path, output_path, expected_duration)
+    except Exception:
+        discard_partial(partial_path)
+        raise
+    journal.append('published', output_path=os.path.abspath(output_path))
+    shutil.rmtree(work_dir, ignore_errors=True)
+
+    wall_time = time.time() - start_time
+    encode_time = sum(timings.values())
+    return {
+        'segments': len(segments),
+        'resumed_segments': done,
+        'wall_time': wall_time,
+        'serial_encode_time': encode_time,
+        # Segment encode seconds per wall second: how many segments ran at once on
+        # average, not a speedup (each segment had fewer threads than one full encode)
+        'parallelism': encode_time / wall_time if wall_time else 1.0,
+    }
@@ -1,109 +1,695 @@
 import asyncio
+import collections
+import hashlib
+import itertools
+import time
+import httpx
 from telegram import Update
 from telegram.ext import Application, CommandHandler, MessageHandler, filters, CallbackContext
 import ffmpeg
 import os
-import subprocess
+from video_cache import ResultCache, make_cache_key
+from video_encoders import video_encode_options
+from video_filters import SCALE_FLAGS, get_bitrate_for_resolution_and_choice, scale_filter
+from video_job_queue import JobQueue
+from video_passthrough import apply_stream_handling, choose_stream_handling
+from video_probe import ffmpeg_capabilities, media_info_from_probe, probe_media
+from video_progress import ProgressParser, format_progress, with_progress_args
+from video_size_target import MIN_VIDEO_KBPS, encode_to_size, next_video_bitrate, plan_size_target, two_pass_commands, with_video_bitrate
+from video_stream import STREAM_CHUNK_SIZE, needs_seeking, prepend, probe_head, split_head, streaming_command
+from video_time_predictor import EncodeTimePredictor, describe_encode_speed
+from video_trace import span, traced
 
-TOKEN = '7667022636:AAFReTf7PNXFFQmdGGRYoZ647oy5q_MXuUY'  # Replace with your actual token
+TOKEN = os.environ.get('BOT_TOKEN', '7667022636:AAFReTf7PNXFFQmdGGRYoZ647oy5q_MXuUY')  # Replace with your actual token
+
+# Encode scheduler settings
+MAX_WORKERS = int(os.environ.get('BOT_MAX_WORKERS', max(1, (os.cpu_count() or 1) // 2)))
+MAX_JOBS_PER_USER = int(os.environ.get('BOT_MAX_JOBS_PER_USER', 1))  # Concurrent encodes per user
+MAX_QUEUE_DEPTH = int(os.environ.get('BOT_MAX_QUEUE_DEPTH', 20))  # Jobs waiting for a worker
+JOB_TIMEOUT = float(os.environ.get('BOT_JOB_TIMEOUT', 30 * 60))  # Seconds per encode
+TELEGRAM_UPLOAD_LIMIT_MB = 50  # Largest file a bot may send
+PROGRESS_EDIT_INTERVAL = 10  # Seconds between progress message edits (Telegram rate limits edits)
+DOWNLOAD_TIMEOUT = float(os.environ.get('BOT_DOWNLOAD_TIMEOUT', 60))  # Seconds without data before a download fails
+# 'local' encodes in this process; 'queue' only accepts uploads and leaves the
+# encoding to video_job_queue.py workers sharing VIDEO_QUEUE_DIR
+BOT_MODE = os.environ.get('BOT_MODE', 'local')
+QUEUE_POLL_INTERVAL = 2  # Seconds between job status checks in queue mode
+
+# Encode settings that change the output; part of the result cache key
+ENCODE_SETTINGS = {
+    'resolution': '1080p',
+    'bitrate_choice': 2,
+    'c:v': 'libx264',
+    'preset': 'slower',
+    'c:a': 'aac',
+    'b:a': '128k',
+    'target_size_mb': TELEGRAM_UPLOAD_LIMIT_MB,
+    'scale_flags': SCALE_FLAGS,
+}
+
+
+class QueueFullError(Exception):
+    """Raised when the encode queue has no room for another job."""
+
+
+class JobCancelledError(Exception):
+    """Raised when an encode job was cancelled before it finished."""
+
+
+class VideoTooLongError(Exception):
+    """Raised when a video is too long to fit the upload limit at any watchable bitrate."""
+
+
+def plan_upload_size(probe: dict, target_size_mb: float) -> dict:
+    """plan_size_target for the upload limit, with an error message meant for the user."""
+    try:
+        return plan_size_target(probe, target_size_mb)
+    except ValueError as e:
+        raise VideoTooLongError(f"This video is too long to fit the {target_size_mb:g} MB upload limit "
+                                f"at a watchable quality. Try sending a shorter clip.") from e
+
+
+class EncodeJob:
+    """A single queued or running compression request."""
+
+    def __init__(self, job_id: int, user_id: int, input_path: str, output_path: str, params: dict,
+                 content_hash: str = None, on_progress=None, predicted_seconds: float = None,
+                 source=None, media=None):
+        self.job_id = job_id
+        self.user_id = user_id
+        self.input_path = input_path
+        self.output_path = output_path
+        self.params = params
+        self.content_hash = content_hash
+        self.source = source  # Async iterator of input bytes when streaming instead of reading input_path
+        self.media = media  # Probe result for streamed inputs, which have no file to probe
+        self.on_progress = on_progress  # Called with every ffmpeg progress snapshot
+        self.predicted_seconds = predicted_seconds or 0.0
+        self.submitted = time.monotonic()
+        self.started = None
+        self.future = asyncio.get_running_loop().create_future()
+        self.process = None
+        self.cancelled = False
+
+
+class EncodeScheduler:
+    """
+    Runs ffmpeg encodes as asyncio subprocesses on a fixed number of workers.
+
+    Jobs are picked fairly: the next job goes to the user with the fewest
+    running encodes, and no user runs more than max_jobs_per_user at once.
+    Among those, the job with the shortest predicted encode time goes first;
+    waiting time counts against the prediction so long jobs are not starved.
+    Each encode gets an equal share of the CPU cores so parallel jobs do not
+    oversubscribe the machine.
+    """
+
+    def __init__(self, max_workers: int = MAX_WORKERS, max_jobs_per_user: int = MAX_JOBS_PER_USER,
+                 max_queue_depth: int = MAX_QUEUE_DEPTH, job_timeout: float = JOB_TIMEOUT):
+        self.max_workers = max(1, max_workers)
+        self.max_jobs_per_user = max(1, max_jobs_per_user)
+        self.max_queue_depth = max_queue_depth
+        self.job_timeout = job_timeout
+        self.threads_per_job = max(1, (os.cpu_count() or 1) // self.max_workers)
+        self._pending = collections.deque()
+        self._running = {}
+        self._ids = itertools.count(1)
+        self._wakeup = None
+        self._workers = []
+
+    def _start(self):
+        """Start the worker tasks on the running event loop (once)."""
+        if self._workers:
+            return
+        self._wakeup = asyncio.Condition()
+        self._workers = [asyncio.create_task(self._worker()) for _ in range(self.max_workers)]
+
+    def _running_for(self, user_id: int) -> int:
+        return sum(1 for job in self._running.values() if job.user_id == user_id)
+
+    def _priority(self, job: EncodeJob) -> float:
+        """Shortest-job-first score, aged by how long the job has been waiting."""
+        return job.predicted_seconds - (time.monotonic() - job.submitted)
+
+    def _next_job(self):
+        """Pop the shortest job of the least busy user that is under its cap."""
+        best = None
+        for job in self._pending:
+            running = self._running_for(job.user_id)
+            if running >= self.max_jobs_per_user:
+                continue
+            key = (running, self._priority(job))
+            if best is None or key < best[0]:
+                best = (key, job)
+        if best is None:
+            return None
+        self._pending.remove(best[1])
+        return best[1]
+
+    def can_start(self, user_id: int) -> bool:
+        """True when a job submitted for this user now would start without queueing."""
+        return (not self._pending and len(self._running) < self.max_workers
+                and self._running_for(user_id) < self.max_jobs_per_user)
+
+    async def submit(self, user_id: int, input_path: str, output_path: str,
+                     content_hash: str = None, on_progress=None, predicted_seconds: float = None,
+                     source=None, media=None, **params) -> tuple:
+        """
+        Queue a job and return (job, position); position 0 means it starts right away.
+
+        With source (an async iterator of input bytes) and media, the input
+        is streamed into ffmpeg instead of read from input_path.
+        """
+        self._start()
+        if len(self._pending) >= self.max_queue_depth:
+            raise QueueFullError("The compression queue is full, please try again later.")
+        job = EncodeJob(next(self._ids), user_id, input_path, output_path, params, content_hash,
+                        on_progress, predicted_seconds, source, media)
+        async with self._wakeup:
+            self._pending.append(job)
+            position = self.position(job)
+            self._wakeup.notify_all()
+        return job, position
+
+    def _jobs_ahead(self, job: EncodeJob) -> list:
+        priority = self._priority(job)
+        return [other for other in self._pending if other is not job and self._priority(other) < priority]
+
+    def position(self, job: EncodeJob) -> int:
+        """Return the number of jobs ahead of this one (0 if it can start now)."""
+        if job.job_id in self._running or job not in self._pending:
+            return 0
+        free_slots = self.max_workers - len(self._running)
+        return max(0, len(self._jobs_ahead(job)) - free_slots + 1)
+
+    def estimated_wait(self, job: EncodeJob) -> float:
+        """Predicted seconds until the job finishes, from the predictions of the jobs ahead of it."""
+        now = time.monotonic()
+        remaining = sum(max(0.0, running.predicted_seconds - (now - running.started))
+                        for running in self._running.values() if running.started)
+        ahead = sum(other.predicted_seconds for other in self._jobs_ahead(job))
+        return (remaining + ahead) / self.max_workers + job.predicted_seconds
+
+    async def wait(self, job: EncodeJob) -> str:
+        """Wait for a job to finish and return its output path."""
+        return await job.future
+
+    def cancel(self, user_id: int) -> int:
+        """Cancel every queued and running job of a user, returning how many were cancelled."""
+        cancelled = 0
+        for job in list(self._pending):
+            if job.user_id == user_id:
+                self._pending.remove(job)
+                job.cancelled = True
+                job.future.set_exception(JobCancelledError("Compression cancelled."))
+                cancelled += 1
+        for job in self._running.values():
+            if job.user_id == user_id and not job.cancelled:
+                job.cancelled = True
+                if job.process and job.process.returncode is None:
+                    job.process.kill()
+                cancelled += 1
+        return cancelled
+
+    async def _worker(self):
+        while True:
+            async with self._wakeup:
+                job = self._next_job()
+                while job is None:
+                    await self._wakeup.wait()
+                    job = self._next_job()
+                self._running[job.job_id] = job
+                job.started = time.monotonic()
+            try:
+                await self._run(job)
+                if job.cancelled:
+                    raise JobCancelledError("Compression cancelled.")
+                job.future.set_result(job.output_path)
+            except Exception as e:
+                if not job.future.done():
+                    job.future.set_exception(e)
+            finally:
+                async with self._wakeup:
+                    del self._running[job.job_id]
+                    self._wakeup.notify_all()
+
+    async def _exec(self, job: EncodeJob, args: list, deadline: float, duration: float = None):
+        """Run one ffmpeg command for a job, killing it when the job runs out of time."""
+        # A cancel between commands (while probing, between passes) has no process to kill
+        if job.cancelled:
+            raise JobCancelledError("Compression cancelled.")
+        parser = ProgressParser(duration)
+        job.process = await asyncio.create_subprocess_exec(
+            *with_progress_args(args), stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.PIPE)
+
+        async def read_progress():
+            async for line in job.process.stdout:
+                snapshot = parser.feed(line.decode(errors='replace'))
+                if snapshot is not None and job.on_progress is not None:
+                    job.on_progress(snapshot)
+
+        try:
+            timeout = max(0, deadline - asyncio.get_running_loop().time())
+            _, stderr, _ = await asyncio.wait_for(
+                asyncio.gather(read_progress(), job.process.stderr.read(), job.process.wait()), timeout=timeout)
+        except asyncio.TimeoutError:
+            job.process.kill()
+            await job.process.wait()
+            raise TimeoutError(f"Compression took longer than {self.job_timeout:.0f} seconds.")
+        if job.cancelled:
+            raise JobCancelledError("Compression cancelled.")
+        if job.process.returncode != 0:
+            raise RuntimeError(f"FFmpeg failed: {stderr.decode(errors='replace').strip()}")
+
+    async def _exec_stream(self, job: EncodeJob, args: list, deadline: float, duration: float = None,
+                           max_bytes: int = None):
+        """
+        Run a streaming ffmpeg command: job.source is fed to stdin and stdout is written to job.output_path.
+
+        Input is written one chunk at a time and only as fast as ffmpeg
+        reads it, so memory per job stays at a chunk or two. The encode is
+        stopped as soon as the output grows past max_bytes.
+        """
+        if job.cancelled:
+            raise JobCancelledError("Compression cancelled.")
+        parser = ProgressParser(duration)
+        errors = collections.deque(maxlen=20)
+        job.process = await asyncio.create_subprocess_exec(
+            *args, stdin=asyncio.subprocess.PIPE, stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.PIPE)
+
+        async def feed_input():
+            try:
+                async for chunk in job.source:
+                    job.process.stdin.write(chunk)
+                    await job.process.stdin.drain()
+            except (BrokenPipeError, ConnectionResetError):
+                pass  # ffmpeg stopped reading; its exit status says why
+            finally:
+                job.process.stdin.close()
+
+        async def write_output():
+            written = 0
+            with open(job.output_path, 'wb') as f:
+                while chunk := await job.process.stdout.read(STREAM_CHUNK_SIZE):
+                    written += len(chunk)
+                    if max_bytes and written > max_bytes:
+                        job.process.kill()
+                        raise RuntimeError(f"The compressed video is larger than {max_bytes / (1024 * 1024):.0f} MB.")
+                    f.write(chunk)
+
+        async def read_progress():
+            # Progress shares stderr with ffmpeg's own messages
+            async for line in job.process.stderr:
+                text = line.decode(errors='replace')
+                snapshot = parser.feed(text)
+                if snapshot is not None and job.on_progress is not None:
+                    job.on_progress(snapshot)
+                elif '=' not in text:
+                    errors.append(text.strip())
+
+        try:
+            timeout = max(0, deadline - asyncio.get_running_loop().time())
+            await asyncio.wait_for(
+                asyncio.gather(feed_input(), write_output(), read_progress(), job.process.wait()), timeout=timeout)
+        except asyncio.TimeoutError:
+            job.process.kill()
+            await job.process.wait()
+            raise TimeoutError(f"Compression took longer than {self.job_timeout:.0f} seconds.")
+        except BaseException:
+            # A failed download or an oversized output; make sure ffmpeg is gone
+            if job.process.returncode is None:
+                job.process.kill()
+                await job.process.wait()
+            raise
+        if job.cancelled:
+            raise JobCancelledError("Compression cancelled.")
+        if job.process.returncode != 0:
+            raise RuntimeError(f"FFmpeg failed: {' '.join(errors)}")
+
+    async def _run(self, job: EncodeJob):
+        """Run one encode as asyncio subprocesses, sized to fit target_size_mb if given."""
+        deadline = asyncio.get_running_loop().time() + self.job_timeout
+        params = dict(job.params)
+        target_size_mb = params.pop('target_size_mb', None)
+        media = job.media or await probe_video(job.input_path, job.content_hash)
+        options = build_output_options(threads=self.threads_per_job, video_info=media.video, **params)
+        tier_bitrate = get_bitrate_for_resolution_and_choice(**params)
+
+        plan = plan_upload_size(media.raw, target_size_mb) if target_size_mb else None
+        if plan is None or plan['video_kbps'] >= tier_bitrate:
+            # The tier bitrate already fits, a single pass is enough; streams
+            # that already meet it (e.g. phone-encoded H.264) are copied
+            decision = choose_stream_handling(media, job.output_path, options, tier_bitrate)
+            options = apply_stream_handling(options, decision)
+            print(f"Job {job.job_id}: {decision['path']}, "
+                  f"~{decision['estimated_seconds_avoided']:.0f}s of encoding avoided")
+            if job.source is not None:
+                max_bytes = int(target_size_mb * 1024 * 1024) if target_size_mb else None
+                await self._exec_stream(job, streaming_command(options), deadline, media.duration, max_bytes)
+            else:
+                stream = ffmpeg.output(ffmpeg.input(job.input_path), job.output_path, **options)
+                await self._exec(job, stream.compile(overwrite_output=True), deadline, media.duration)
+            # Streamed jobs are paced by the download, so their time says nothing about encode cost
+            if not decision['copy_video'] and job.source is None:
+                # Teach the predictor how long this machine took
+                encode_seconds = time.monotonic() - job.started
+                print(f"Job {job.job_id}: " + describe_encode_speed(media, params['resolution'], encode_seconds,
+                                                                    options['preset'], self.threads_per_job, predictor))
+                predictor.record(media, params['resolution'], encode_seconds,
+                                 preset=options['preset'], cores=self.threads_per_job)
+            return
+
+        # Two-pass encode sized for the upload limit; only pass 2 is repeated on a miss
+        if job.source is not None:
+            raise RuntimeError("A streamed input cannot be encoded in two passes.")
+        video_bitrate = plan['video_kbps']
+        passlog = f'{job.output_path}.passlog'
+        try:
+            first_pass, _ = two_pass_commands(job.input_path, job.output_path,
+                                              with_video_bitrate(options, video_bitrate), passlog)
+            await self._exec(job, first_pass, deadline)
+            for _ in range(3):
+                _, second_pass = two_pass_commands(job.input_path, job.output_path,
+                                                   with_video_bitrate(options, video_bitrate), passlog)
+                await self._exec(job, second_pass, deadline, media.duration)
+                size_mb = os.path.getsize(job.output_path) / (1024 * 1024)
+                video_bitrate = next_video_bitrate(plan, video_bitrate, size_mb)
+                if video_bitrate is None:
+                    break
+                video_bitrate = max(video_bitrate, MIN_VIDEO_KBPS)
+            if size_mb > target_size_mb:
+                raise RuntimeError(f"Could not fit the video under {target_size_mb} MB.")
+        finally:
+            for suffix in ('-0.log', '-0.log.mbtree'):
+                if os.path.exists(passlog + suffix):
+                    os.remove(passlog + suffix)
+
+scheduler = EncodeScheduler()
+result_cache = ResultCache()
+predictor = EncodeTimePredictor()
+job_queue = JobQueue() if BOT_MODE == 'queue' else None
+
+def progress_reporter(message):
+    """Return a progress callback that edits a status message at most every PROGRESS_EDIT_INTERVAL seconds."""
+    last_edit = 0.0
+
+    async def edit(text):
+        try:
+            await message.edit_text(text)
+        except Exception as e:
+            print(f"Could not update progress message: {e}")
+
+    def report(snapshot: dict):
+        nonlocal last_edit
+        now = time.monotonic()
+        if snapshot['progress'] != 'end' and now - last_edit < PROGRESS_EDIT_INTERVAL:
+            return
+        last_edit = now
+        asyncio.create_task(edit(f"Compressing: {format_progress(snapshot)}"))
+
+    return report
 
 async def start(update: Update, context: CallbackContext):
     """Handle the /start command."""
     await update.message.reply_text('Hello! Send me a video and I will compress it for you.')
 
+async def cancel(update: Update, context: CallbackContext):
+    """Handle the /cancel command."""
+    if job_queue is not None:
+        cancelled = await asyncio.to_thread(job_queue.cancel, update.effective_user.id)
+    else:
+        cancelled = scheduler.cancel(update.effective_user.id)
+    if cancelled:
+        await update.message.reply_text(f'Cancelled {cancelled} compression job(s).')
+    else:
+        await update.message.reply_text('You have no compression jobs to cancel.')
+
+async def iter_download(url: str, chunk_size: int = STREAM_CHUNK_SIZE):
+    """Yield a file from the Bot API chunk by chunk as it arrives."""
+    async with httpx.AsyncClient(timeout=DOWNLOAD_TIMEOUT) as client:
+        async with client.stream('GET', url) as response:
+            response.raise_for_status()
+            async for chunk in response.aiter_bytes(chunk_size):
+                yield chunk
+
+async def hashing(chunks, digest):
+    """Pass chunks through while feeding them to a hashlib digest."""
+    async for chunk in chunks:
+        digest.update(chunk)
+        yield chunk
+
+async def run_queued(user_id: int, input_path: str, output_path: str, status) -> str:
+    """Hand a job to the worker queue and wait for a worker to finish it, updating the status message."""
+    params = {key: ENCODE_SETTINGS[key] for key in ('resolution', 'bitrate_choice', 'target_size_mb')}
+    job_id = await asyncio.to_thread(job_queue.enqueue, input_path, output_path, params, user_id)
+    last_text, last_edit = None, 0.0
+    while True:
+        await asyncio.sleep(QUEUE_POLL_INTERVAL)
+        job = await asyncio.to_thread(job_queue.get, job_id)
+        if job['status'] == 'done':
+            return output_path
+        if job['status'] == 'failed':
+            raise RuntimeError(job['error'])
+        if job['status'] == 'cancelled':
+            raise JobCancelledError("Compression cancelled.")
+        if job['status'] == 'queued':
+            position = await asyncio.to_thread(job_queue.position, job_id)
+            text = f'Waiting for a free worker, #{position + 1} in line...'
+        else:
+            text = f"Compressing: {job['progress'] or 0:.0f}%"
+        now = time.monotonic()
+        if text != last_text and now - last_edit >= PROGRESS_EDIT_INTERVAL:
+            last_text, last_edit = text, now
+            try:
+                await status.edit_text(text)
+            except Exception as e:
+                print(f"Could not update progress message: {e}")
+
+async def streamable_media(head: bytes, input_path: str, video):
+    """
+    Return the MediaInfo of an input that can be streamed straight into ffmpeg, or None.
+
+    The input has to be readable front to back and its tier bitrate has to
+    fit the upload limit in one pass; otherwise it needs a file on disk.
+    """
+    if needs_seeking(head):
+        return None
+    probe = await asyncio.to_thread(probe_head, head)
+    if probe is None:
+        return None
+    # Only the start of the file was probed, so take the length from Telegram
+    fmt = probe.setdefault('format', {})
+    fmt.setdefault('duration', video.duration)
+    fmt.setdefault('size', video.file_size)
+    if not float(fmt.get('duration') or 0):
+        return None
+    plan = plan_upload_size(probe, ENCODE_SETTINGS['target_size_mb'])
+    tier_bitrate = get_bitrate_for_resolution_and_choice(ENCODE_SETTINGS['resolution'], ENCODE_SETTINGS['bitrate_choice'])
+    if plan['video_kbps'] < tier_bitrate:
+        return None  # Needs the two-pass encode, which reads the input twice
+    return media_info_from_probe(input_path, probe)
+
 async def handle_video(update: Update, context: CallbackContext):
     """Handle video messages."""
     video = update.message.video
     file_id = video.file_id
-    file = await context.bot.get_file(file_id)
-    
-    # Download the video
-    input_path = f'./downloads/{file_id}.mp4'
-    await file.download(input_path)
-    output_path = f'./downloads/compressed_{file_id}.mp4'
-    
-    # Example video compression function
+    user_id = update.effective_user.id
+    # The same clip sent twice at once shares a file_id, so name the files after the update;
+    # file_id and the content hash are only used as cache keys
+    name = f'{file_id}_{update.update_id}'
+    input_path = f'./downloads/{name}.mp4'
+    output_path = f'./downloads/compressed_{name}.mp4'
+    if job_queue is not None:
+        # Workers read and write the shared spool, not this machine's downloads folder
+        input_path = os.path.join(job_queue.input_dir, f'{name}.mp4')
+        output_path = os.path.join(job_queue.output_dir, f'compressed_{name}.mp4')
+
+    async def submit(**stream) -> str:
+        # Queue the compression so the bot keeps answering other updates
+        media = stream.get('media') or await probe_video(input_path, content_hash)
+        predicted_seconds = predictor.predict(media, ENCODE_SETTINGS['resolution'], ENCODE_SETTINGS['preset'],
+                                              cores=scheduler.threads_per_job)
+        status = await update.message.reply_text('Compressing your video...')
+        job, position = await scheduler.submit(
+            user_id, input_path, output_path, content_hash=content_hash,
+            on_progress=progress_reporter(status), predicted_seconds=predicted_seconds,
+            resolution=ENCODE_SETTINGS['resolution'], bitrate_choice=ENCODE_SETTINGS['bitrate_choice'],
+            target_size_mb=ENCODE_SETTINGS['target_size_mb'], **stream)
+        eta_minutes = scheduler.estimated_wait(job) / 60
+        if position:
+            await update.message.reply_text(f'You are #{position} in line, your video should be ready '
+                                            f'in about {eta_minutes:.0f} minute(s).')
+        else:
+            await status.edit_text(f'Compressing your video, about {eta_minutes:.0f} minute(s) to go...')
+        return await scheduler.wait(job)
+
+    async def encode() -> str:
+        if job_queue is not None:
+            status = await update.message.reply_text('Your video is queued for compression...')
+            return await run_queued(user_id, input_path, output_path, status)
+        return await submit()
+
+    # Concurrent jobs share the event loop thread, so each chat gets its own trace row
+    track = f'chat {update.effective_chat.id}'
     try:
-        compress_video(input_path, output_path)
-        # Send the compressed video back
-        await update.message.reply_video(video=open(output_path, 'rb'))
+        # In queue mode FFmpeg only has to be installed on the workers
+        with span('ffmpeg_check', track=track):
+            ffmpeg_missing = job_queue is None and not check_ffmpeg()
+        if ffmpeg_missing:
+            raise Exception("FFmpeg is not installed or accessible.")
+        # Forwarded videos keep their file_unique_id, so a known one skips the download
+        content_hash = result_cache.resolve_alias(video.file_unique_id)
+        cached_path = result_cache.get(make_cache_key(content_hash, ENCODE_SETTINGS)) if content_hash else None
+
+        async def fetch_and_encode():
+            # encode() reads the hash of the downloaded file
+            nonlocal content_hash
+            with span('download', track=track, part='head'):
+                file = await context.bot.get_file(file_id)
+                digest = hashlib.sha256()
+                chunks = hashing(iter_download(file.file_path), digest)
+                head, rest = await split_head(chunks)
+            # Stream only when a local worker is free; a queued job would hold the download open
+            can_stream = job_queue is None and scheduler.can_start(user_id)
+            with span('probe', track=track, streamed=True):
+                media = await streamable_media(head, input_path, video) if can_stream else None
+            if media is not None:
+                # Download, encode and hash in one go, with no copy of the input on disk
+                print(f"Streaming {file_id} straight into ffmpeg")
+                with span('encode', track=track, streamed=True):
+                    await submit(source=prepend(head, rest), media=media)
+                content_hash = digest.hexdigest()
+                result_cache.alias(video.file_unique_id, content_hash)
+                return result_cache.put(make_cache_key(content_hash, ENCODE_SETTINGS), output_path)
+            else:
+                # The input needs seeking, two passes or a remote worker, so it goes to disk first
+                with span('download', track=track, part='rest'):
+                    with open(input_path, 'wb') as f:
+                        async for chunk in prepend(head, rest):
+                            f.write(chunk)
+                content_hash = digest.hexdigest()
+                result_cache.alias(video.file_unique_id, content_hash)
+                with span('encode', track=track, streamed=False):
+                    return await result_cache.get_or_create(make_cache_key(content_hash, ENCODE_SETTINGS), encode)
+
+        if cached_path is None:
+            # A second upload of the same file waits for the first one's encode, streamed or not
+            cached_path = await result_cache.single_flight(f'upload:{video.file_unique_id}', fetch_and_encode)
+
+        # Send the compressed video back; fragmented MP4 can start playing before it has fully loaded
+        with span('upload', track=track, size=os.path.getsize(cached_path)):
+            with open(cached_path, 'rb') as f:
+                await update.message.reply_video(video=f, supports_streaming=True)
+    except VideoTooLongError as e:
+        await update.message.reply_text(str(e))
     except Exception as e:
         await update.message.reply_text(f"An error occurred: {str(e)}")
     finally:
-        # Clean up downloaded files
-        if os.path.exists(input_path):
-            os.remove(input_path)
-        if os.path.exists(output_path):
-            os.remove(output_path)
+        # Clean up downloaded files; the compressed result stays in the cache
+        with span('cleanup', track=track):
+            if os.path.exists(input_path):
+                os.remove(input_path)
+            if os.path.exists(output_path):
+                os.remove(output_path)
 
-def compress_video(input_path: str, output_path: str, target_size_mb: float = 50, 
+def build_output_options(resolution: str = '1080p', bitrate_choice: int = 2, threads: int = 0,
+                         video_info=None) -> dict:
+    """Build the ffmpeg output options used to compress a video."""
+    target_video_bitrate = get_bitrate_for_resolution_and_choice(resolution, bitrate_choice)
+    options = {
+        # libx264 'slower', as recorded in ENCODE_SETTINGS
+        **video_encode_options('libx264', 'smallest', target_video_bitrate, 'compressed.mp4'),
+        'c:a': 'aac',
+        'b:a': '128k',
+        'threads': threads,
+        'loglevel': 'error',
+        'map': '0',  # This will map all streams
+        'c:s': 'copy',  # Copy subtitle streams without re-encoding
+        'c:d': 'copy',  # Copy data streams if available
+        'movflags': '+faststart',  # Index up front so playback starts before the download completes
+    }
+    # Scale down to the selected resolution (never up); the bitrate tiers assume that frame size
+    if video_info is not None:
+        video_filter = scale_filter(video_info.width, video_info.height, resolution)
+        if video_filter:
+            options['vf'] = video_filter
+    return options
+
+async def probe_video(path: str, content_hash: str = None):
+    """Probe a video (cached) without blocking the event loop."""
+    return await asyncio.to_thread(probe_media, path, content_hash)
+
+@traced('compress_video')
+def compress_video(input_path: str, output_path: str, target_size_mb: float = 50,
                   resolution: str = '1080p', bitrate_choice: int = 2) -> None:
     """Compress a video file to a target size while maintaining quality."""
     # Check if FFmpeg is installed
-    if not check_ffmpeg():
+    with span('ffmpeg_check'):
+        ffmpeg_found = check_ffmpeg()
+    if not ffmpeg_found:
         raise Exception("FFmpeg is not installed or accessible.")
-    
+
     # Validate input path
     if not os.path.exists(input_path):
         raise FileNotFoundError(f"Input file not found: {input_path}")
-    
+
     # Create output directory if it doesn't exist
     output_dir = os.path.dirname(output_path)
     if output_dir:
         os.makedirs(output_dir, exist_ok=True)
-    
+
     print("Starting compression...")
-    # Get video information and compress
-    target_video_bitrate = get_bitrate_for_resolution_and_choice(resolution, bitrate_choice)
-    
-    stream = ffmpeg.input(input_path)
-    stream = ffmpeg.output(stream, output_path,
-                         **{
-                             'c:v': 'libx264',
-                             'b:v': f'{target_video_bitrate}k',
-                             'maxrate': f'{target_video_bitrate}k',
-                             'bufsize': f'{target_video_bitrate*2}k',
-                             'preset': 'slower',
-                             'c:a': 'aac',
-                             'b:a': '128k',
-                             'threads': 0,
-                             'loglevel': 'error',
-                             'map': '0',  # This will map all streams
-                             'c:s': 'copy',  # Copy subtitle streams without re-encoding
-                             'c:d': 'copy',  # Copy data streams if available
-                         })
-    
+    with span('probe', path=input_path):
+        media = probe_media(input_path)
+    output_options = build_output_options(resolution, bitrate_choice, video_info=media.video)
+
+    # Fall back to a two-pass encode when the tier bitrate would not fit target_size_mb
+    size_plan = plan_size_target(media.raw, target_size_mb) if target_size_mb else None
+    if size_plan and size_plan['video_kbps'] < get_bitrate_for_resolution_and_choice(resolution, bitrate_choice):
+        with span('encode', path='two-pass'):
+            encode_to_size(input_path, output_path, output_options, size_plan)
+        return
+
+    # Copy the streams that already meet the target instead of re-encoding them
+    decision = choose_stream_handling(media, output_path, output_options,
+                                      get_bitrate_for_resolution_and_choice(resolution, bitrate_choice))
+    output_options = apply_stream_handling(output_options, decision)
+    print(f"Processing path: {decision['path']}")
+
     # Run the compression
-    stream.run(overwrite_output=True)
+    stream = ffmpeg.input(input_path)
+    stream = ffmpeg.output(stream, output_path, **output_options)
+    with span('encode', path=decision['path']):
+        stream.run(overwrite_output=True)
 
 def check_ffmpeg() -> bool:
     """Check if FFmpeg is installed and accessible."""
-    try:
-        subprocess.run(['ffmpeg', '-version'], capture_output=True, check=True)
+    # Detected once per process instead of launching ffmpeg for every video
+    if ffmpeg_capabilities()['available']:
         return True
-    except FileNotFoundError:
-        print("FFmpeg is not installed or not found in system PATH!")
-        return False
-
-def get_bitrate_for_resolution_and_choice(resolution: str, bitrate_choice: int) -> int:
-    """Get the appropriate bitrate for the selected resolution and bitrate choice."""
-    resolution_bitrates = {
-        '480p': [500, 1000, 2000],
-        '720p': [2500, 3000, 3500],
-        '1080p': [4500, 5000, 6000],
-        '2k': [8000, 10000, 12000],
-        '4k': [15000, 20000, 25000]
-    }
-    return resolution_bitrates.get(resolution, [6000])[bitrate_choice - 1]  # Default to 6000 if invalid resolution
+    print("FFmpeg is not installed or not found in system PATH!")
+    return False
 
-async def main():
-    """Set up the bot and start polling for updates."""
-    # Use Application instead of Updater
-    application = Application.builder().token(TOKEN).build()
+def build_application(token: str = TOKEN, base_url: str = None, base_file_url: str = None) -> Application:
+    """Create the bot Application with its handlers; base_url points it at another Bot API server."""
+    # Use Application instead of Updater; concurrent updates let handlers
+    # wait on queued encodes without blocking other users
+    builder = Application.builder().token(token).concurrent_updates(True)
+    if base_url:
+        builder = builder.base_url(base_url)
+    if base_file_url:
+        builder = builder.base_file_url(base_file_url)
+    application = builder.build()
 
     # Add handlers for commands and messages
     application.add_handler(CommandHandler('start', start))
+    application.add_handler(CommandHandler('cancel', cancel))
     application.add_handler(MessageHandler(filters.VIDEO , handle_video))
+    return application
+
+async def main():
+    """Set up the bot and start polling for updates."""
+    application = build_application()
 
     # Start polling for updates
     await application.run_polling()
@@ -0,0 +1,74 @@
+import os
+import re
+import subprocess
+from concurrent.futures import ThreadPoolExecutor
+
+CROP_SAMPLES = 12
+# cropdetect treats pixels darker than this (0-255) as black
+CROP_LIMIT = 24
+# Bars thinner than this share of the frame are not worth a crop
+MIN_CROP_FRACTION = 0.02
+FRAMES_PER_SAMPLE = 3
+
+CROP_PATTERN = re.compile(r'crop=(-?\d+):(-?\d+):(-?\d+):(-?\d+)')
+
+def sample_crop(input_path: str, timestamp: float, limit: int = CROP_LIMIT):
+    """
+    Run cropdetect on a few keyframes at timestamp and return (w, h, x, y), or None.
+
+    -ss before -i seeks straight to the nearest keyframe, and -skip_frame
+    nokey decodes keyframes only, so a sample costs a handful of frames.
+    """
+    cmd = [
+        'ffmpeg', '-hide_banner', '-nostdin',
+        '-ss', f'{timestamp:.3f}', '-skip_frame', 'nokey', '-i', input_path,
+        '-map', '0:v:0', '-vf', f'cropdetect=limit={limit}:round=2:reset=0',
+        '-frames:v', str(FRAMES_PER_SAMPLE), '-an', '-sn', '-dn', '-f', 'null', os.devnull
+    ]
+    result = subprocess.run(cmd, capture_output=True, text=True)
+    matches = CROP_PATTERN.findall(result.stderr)
+    if not matches:
+        return None
+    w, h, x, y = (int(v) for v in matches[-1])
+    # An all-black frame yields an empty or negative rectangle
+    return (w, h, x, y) if w > 0 and h > 0 and x >= 0 and y >= 0 else None
+
+def detect_crop(media, samples: int = CROP_SAMPLES, limit: int = CROP_LIMIT) -> dict:
+    """
+    Find the black bars of a video by sampling frames spread across it.
+
+    Samples skip the first and last 5% (logos and credits) and run in
+    parallel. The result is the smallest rectangle containing every
+    sample's picture, so a dark scene can never cause real picture to be
+    cropped. Returns None when there are no bars worth removing, otherwise
+    the crop rectangle with its filter and the share of pixels removed.
+    """
+    video = media.video
+    if video is None or not media.duration:
+        return None
+    start, span = media.duration * 0.05, media.duration * 0.9
+    timestamps = [start + span * (i + 0.5) / samples for i in range(samples)]
+    with ThreadPoolExecutor(max_workers=min(samples, os.cpu_count() or 1)) as pool:
+        rects = [r for r in pool.map(lambda t: sample_crop(media.path, t, limit), timestamps) if r]
+    if not rects:
+        return None
+
+    left = min(x for w, h, x, y in rects)
+    top = min(y for w, h, x, y in rects)
+    right = max(x + w for w, h, x, y in rects)
+    bottom = max(y + h for w, h, x, y in rects)
+    width, height = min(right, video.width) - left, min(bottom, video.height) - top
+    width, height = width - width % 2, height - height % 2
+
+    reduction = 1 - (width * height) / (video.width * video.height)
+    if reduction < MIN_CROP_FRACTION:
+        return None
+    return {
+        'width': width,
+        'height': height,
+        'x': left,
+        'y': top,
+        'filter': f'crop={width}:{height}:{left}:{top}',
+        'pixel_reduction': reduction,
+        'samples': len(rects),
+    }
@@ -0,0 +1,134 @@
+import os
+from video_probe import ffmpeg_capabilities
+
+# CPU encoders compress_video can use. The RESOLUTION_BITRATES table is in
+# x264 terms; bitrate_factor scales it for encoders that reach the same
+# quality with fewer bits. presets holds each encoder's own options for the
+# speed/efficiency profiles. two_pass marks encoders whose FFmpeg wrapper
+# takes -pass; the others fit a target size with a single capped pass.
+# mp4_options only apply to the MP4 family of containers.
+ENCODERS = {
+    'libx264': {
+        'bitrate_factor': 1.0,
+        'containers': ('.mp4', '.mkv', '.mov', '.m4v'),
+        'vbv': True,
+        'two_pass': True,
+        'presets': {
+            'fastest': {'preset': 'veryfast'},
+            'balanced': {'preset': 'medium'},
+            'smallest': {'preset': 'slower'},
+        },
+    },
+    'libx265': {
+        'bitrate_factor': 0.65,
+        'containers': ('.mp4', '.mkv', '.mov', '.m4v'),
+        'vbv': True,
+        'two_pass': False,
+        'mp4_options': {'tag:v': 'hvc1'},  # Lets Apple players recognise HEVC in MP4
+        'presets': {
+            'fastest': {'preset': 'veryfast'},
+            'balanced': {'preset': 'fast'},
+            'smallest': {'preset': 'slow'},
+        },
+    },
+    'libsvtav1': {
+        'bitrate_factor': 0.55,
+        'containers': ('.mp4', '.mkv', '.webm'),
+        'vbv': False,  # SVT-AV1 only takes maxrate in CRF mode
+        'two_pass': False,
+        'options': {'pix_fmt': 'yuv420p'},
+        'presets': {
+            'fastest': {'preset': '10'},
+            'balanced': {'preset': '8'},
+            'smallest': {'preset': '5'},
+        },
+    },
+    'libvpx-vp9': {
+        'bitrate_factor': 0.7,
+        'containers': ('.webm', '.mkv', '.mp4'),
+        'vbv': True,
+        'two_pass': True,
+        'options': {'row-mt': 1},  # Without it libvpx uses barely more than one core
+        'presets': {
+            'fastest': {'deadline': 'realtime', 'cpu-used': 8},
+            'balanced': {'deadline': 'good', 'cpu-used': 4},
+            'smallest': {'deadline': 'good', 'cpu-used': 1},
+        },
+    },
+}
+
+# Encoders to try for each profile, best first; the first one the local
+# FFmpeg build has (and the container accepts) is used
+PROFILES = {
+    'fastest': ['libx264'],
+    'balanced': ['libsvtav1', 'libx265', 'libx264'],
+    'smallest': ['libsvtav1', 'libx265', 'libvpx-vp9', 'libx264'],
+}
+DEFAULT_ENCODER = 'libx264'
+# With neither an encoder nor a profile given: libx264 'slower', what every script used before
+DEFAULT_PROFILE = 'smallest'
+
+# Containers that share the MP4 sample entry tags
+MP4_CONTAINERS = ('.mp4', '.mov', '.m4v')
+
+# Audio codec by output container; everything else gets AAC
+AUDIO_CODECS = {'.webm': 'libopus'}
+
+def available_encoders() -> list:
+    """Names from ENCODERS that the local FFmpeg build can use."""
+    encoders = ffmpeg_capabilities()['encoders']
+    if not encoders:
+        return [DEFAULT_ENCODER]  # Listing unavailable; assume the common build
+    return [name for name in ENCODERS if name in encoders]
+
+def select_encoder(encoder: str = None, profile: str = None, output_path: str = None) -> tuple:
+    """
+    Resolve an encoder name and/or profile to (encoder, profile).
+
+    With only a profile, the first encoder of that profile that is
+    available and fits the output container is chosen; with neither,
+    DEFAULT_ENCODER at DEFAULT_PROFILE is used. Raises ValueError
+    when the request cannot be met by the local FFmpeg build.
+    """
+    if encoder is None and profile is None:
+        encoder = DEFAULT_ENCODER
+    profile = profile or DEFAULT_PROFILE
+    if profile not in PROFILES:
+        raise ValueError(f"Unknown profile: {profile} (use {', '.join(PROFILES)})")
+    ext = os.path.splitext(output_path)[1].lower() if output_path else None
+    available = available_encoders()
+
+    if encoder is not None:
+        if encoder not in ENCODERS:
+            raise ValueError(f"Unknown encoder: {encoder} (use {', '.join(ENCODERS)})")
+        if encoder not in available:
+            raise ValueError(f"This FFmpeg build does not include {encoder}")
+        if ext and ext not in ENCODERS[encoder]['containers']:
+            raise ValueError(f"{encoder} cannot be written to {ext} files")
+        return encoder, profile
+
+    for candidate in PROFILES[profile]:
+        if candidate in available and (not ext or ext in ENCODERS[candidate]['containers']):
+            return candidate, profile
+    raise ValueError(f"No encoder for the '{profile}' profile is available for {ext or 'this'} output")
+
+def scaled_bitrate(encoder: str, table_kbps: float) -> int:
+    """Convert an x264 table bitrate to the bitrate this encoder needs for similar quality."""
+    return round(table_kbps * ENCODERS[encoder]['bitrate_factor'])
+
+def video_encode_options(encoder: str, profile: str, bitrate_kbps: float, output_path: str = None) -> dict:
+    """Output options for the video encode, in the ffmpeg-python style compress_video uses."""
+    backend = ENCODERS[encoder]
+    options = {'c:v': encoder, 'b:v': f'{bitrate_kbps}k'}
+    if backend['vbv']:
+        options['maxrate'] = f'{bitrate_kbps}k'
+        options['bufsize'] = f'{bitrate_kbps*2}k'
+    options.update(backend['presets'][profile])
+    options.update(backend.get('options', {}))
+    if output_path and os.path.splitext(output_path)[1].lower() in MP4_CONTAINERS:
+        options.update(backend.get('mp4_options', {}))
+    return options
+
+def audio_codec_for(output_path: str) -> str:
+    """The audio encoder that suits the output container."""
+    return AUDIO_CODECS.get(os.path.splitext(output_path)[1].lower(), 'aac')
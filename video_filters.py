@@ -0,0 +1,98 @@
+import os
+
+# Short side of the frame for each resolution tier
+RESOLUTION_HEIGHTS = {
+    '480p': 480,
+    '720p': 720,
+    '1080p': 1080,
+    '2k': 1440,
+    '4k': 2160
+}
+
+# Video bitrate (kbps) for each resolution tier at bitrate choice 1, 2 and 3,
+# in H.264 terms; video_encoders scales them for the other encoders
+RESOLUTION_BITRATES = {
+    '480p': [500, 1000, 2000],
+    '720p': [2500, 3000, 3500],
+    '1080p': [4500, 5000, 6000],
+    '2k': [8000, 10000, 12000],
+    '4k': [15000, 20000, 25000]
+}
+
+# swscale algorithm: 'fast_bilinear' and 'bilinear' are quickest, 'bicubic' is a
+# good default, 'lanczos' is sharpest but slowest
+SCALE_FLAGS = os.environ.get('VIDEO_SCALE_FLAGS', 'bicubic')
+
+# Highest output frame rate per resolution tier when capping the frame rate;
+# tiers not listed keep the source rate
+FPS_CAPS = {
+    '480p': 24,
+    '720p': 30
+}
+
+# Drops frames that (nearly) repeat the previous one. Needs variable frame
+# rate output (-fps_mode vfr) so the kept frames keep their timestamps.
+DEDUPLICATE_FILTER = 'mpdecimate'
+
+def get_bitrate_for_resolution_and_choice(resolution: str, bitrate_choice: int) -> int:
+    """Get the appropriate bitrate for the selected resolution and bitrate choice."""
+    return RESOLUTION_BITRATES.get(resolution, [6000])[bitrate_choice - 1]  # Default to 6000 if invalid resolution
+
+def _even(value: float) -> int:
+    """Round to the nearest even number, as yuv420p needs even dimensions."""
+    return max(2, int(round(value / 2)) * 2)
+
+def scaled_size(width: int, height: int, resolution: str):
+    """
+    Return the (width, height) to encode at for a resolution tier, or None
+    when the source is already at or below the tier.
+
+    The tier applies to the short side so portrait phone videos are
+    treated the same as landscape ones. Aspect ratio is preserved and the
+    frame is never upscaled.
+    """
+    target = RESOLUTION_HEIGHTS.get(resolution)
+    if not target or not width or not height:
+        return None
+    short_side = min(width, height)
+    if short_side <= target:
+        return None
+    factor = target / short_side
+    return _even(width * factor), _even(height * factor)
+
+def scale_filter(width: int, height: int, resolution: str, flags: str = SCALE_FLAGS, crop_size: tuple = None):
+    """
+    Return the ffmpeg scale filter for a resolution tier, or None if no scaling is needed.
+
+    With crop_size (the cropped width, height), the cropped picture is
+    scaled by the factor the full frame would get, so a letterboxed film
+    keeps the width of its tier instead of being shrunk further.
+    """
+    size = scaled_size(width, height, resolution)
+    if size is None:
+        return None
+    if crop_size:
+        factor = size[0] / width
+        size = _even(crop_size[0] * factor), _even(crop_size[1] * factor)
+    return f'scale={size[0]}:{size[1]}:flags={flags}'
+
+def fps_cap_filter(source_fps: float, resolution: str):
+    """Return the fps filter that caps the frame rate for a tier, or None if the source is already at or below it."""
+    cap = FPS_CAPS.get(resolution)
+    if not cap or not source_fps or source_fps <= cap * 1.01:
+        return None
+    return f'fps={cap}'
+
+def subtitle_burn_filter(subtitle_path: str) -> str:
+    """
+    Return the filter that draws a subtitle file (SRT, ASS or VTT) onto the frames.
+
+    Place it after scaling so the text is rendered on the smaller frame.
+    """
+    # Filter arguments treat ':' and quotes as syntax, which breaks Windows paths
+    path = os.path.abspath(subtitle_path).replace('\\', '/').replace(':', '\\:').replace("'", "'\\''")
+    return f"subtitles='{path}'"
+
+def join_filters(*filters) -> str:
+    """Chain the non-empty filters into one -vf filter graph."""
+    return ','.join(f for f in filters if f)
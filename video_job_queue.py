@@ -0,0 +1,278 @@
+import argparse
+import json
+import multiprocessing
+import os
+import signal
+import socket
+import sqlite3
+import sys
+import time
+from contextlib import closing
+
+# Shared spool: the job database plus the input and output files. Workers on
+# other machines mount the same directory.
+QUEUE_DIR = os.environ.get('VIDEO_QUEUE_DIR', './queue')
+LEASE_SECONDS = float(os.environ.get('VIDEO_QUEUE_LEASE_SECONDS', 60))
+HEARTBEAT_SECONDS = LEASE_SECONDS / 4
+MAX_ATTEMPTS = 3  # Leases a job may get before it is failed for good
+IDLE_POLL_SECONDS = 2  # Wait between lease attempts when the queue is empty
+STOP_GRACE_SECONDS = 10  # Wait after SIGTERM before an encode is killed outright
+
+# queued -> leased -> done | failed; cancelled from either of the first two.
+# A lease that runs out (crashed worker) puts the job back up for grabs.
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS jobs (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    user_id INTEGER,
+    input_path TEXT NOT NULL,
+    output_path TEXT NOT NULL,
+    params TEXT NOT NULL,
+    status TEXT NOT NULL DEFAULT 'queued',
+    worker TEXT,
+    lease_expires REAL,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    progress REAL,
+    result TEXT,
+    error TEXT,
+    created REAL NOT NULL,
+    updated REAL NOT NULL
+)
+'''
+
+
+def worker_name() -> str:
+    """Identify this worker process across the machines sharing the queue."""
+    return f'{socket.gethostname()}:{os.getpid()}'
+
+
+class JobQueue:
+    """
+    Durable compression queue in a SQLite database in the spool directory.
+
+    Workers lease jobs for a limited time and keep the lease alive with
+    heartbeats while they encode. A worker that dies stops heartbeating, so
+    its job is leased again once the lease runs out; a job that keeps
+    killing its workers is failed after MAX_ATTEMPTS leases.
+    """
+
+    def __init__(self, queue_dir: str = QUEUE_DIR):
+        self.queue_dir = queue_dir
+        self.db_path = os.path.join(queue_dir, 'jobs.sqlite3')
+        self.input_dir = os.path.join(queue_dir, 'inputs')
+        self.output_dir = os.path.join(queue_dir, 'outputs')
+        self.progress_dir = os.path.join(queue_dir, 'progress')
+        for directory in (self.input_dir, self.output_dir, self.progress_dir):
+            os.makedirs(directory, exist_ok=True)
+        with closing(self._connect()) as conn:
+            conn.execute(SCHEMA)
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = sqlite3.connect(self.db_path, timeout=30, isolation_level=None)
+        conn.row_factory = sqlite3.Row
+        return conn
+
+    def _update(self, sql: str, args: tuple) -> int:
+        with closing(self._connect()) as conn:
+            return conn.execute(sql, args).rowcount
+
+    def enqueue(self, input_path: str, output_path: str, params: dict, user_id: int = None) -> int:
+        """Add a job and return its id."""
+        now = time.time()
+        with closing(self._connect()) as conn:
+            cursor = conn.execute(
+                'INSERT INTO jobs (user_id, input_path, output_path, params, created, updated) '
+                'VALUES (?, ?, ?, ?, ?, ?)', (user_id, input_path, output_path, json.dumps(params), now, now))
+            return cursor.lastrowid
+
+    def lease(self, worker: str, lease_seconds: float = LEASE_SECONDS):
+        """Lease the oldest available job to a worker; returns the job as a dict, or None."""
+        now = time.time()
+        with closing(self._connect()) as conn:
+            # IMMEDIATE takes the write lock up front, so two workers cannot lease the same job
+            conn.execute('BEGIN IMMEDIATE')
+            try:
+                # Jobs whose lease ran out too often are not retried again
+                conn.execute("UPDATE jobs SET status = 'failed', error = ?, updated = ? "
+                             "WHERE status = 'leased' AND lease_expires < ? AND attempts >= ?",
+                             (f'Abandoned by its worker {MAX_ATTEMPTS} times', now, now, MAX_ATTEMPTS))
+                row = conn.execute("SELECT * FROM jobs WHERE status = 'queued' "
+                                   "OR (status = 'leased' AND lease_expires < ?) ORDER BY id LIMIT 1",
+                                   (now,)).fetchone()
+                if row is not None:
+                    conn.execute("UPDATE jobs SET status = 'leased', worker = ?, lease_expires = ?, "
+                                 "attempts = attempts + 1, updated = ? WHERE id = ?",
+                                 (worker, now + lease_seconds, now, row['id']))
+                conn.execute('COMMIT')
+            except BaseException:
+                conn.execute('ROLLBACK')
+                raise
+        if row is None:
+            return None
+        if row['status'] == 'leased':
+            print(f"Job {row['id']}: lease of {row['worker']} expired, re-leasing to {worker}")
+        return dict(row, params=json.loads(row['params']), attempts=row['attempts'] + 1)
+
+    def heartbeat(self, job_id: int, worker: str, progress: float = None,
+                  lease_seconds: float = LEASE_SECONDS) -> bool:
+        """Extend a worker's lease; False means the job was cancelled or re-leased and should stop."""
+        now = time.time()
+        return self._update("UPDATE jobs SET lease_expires = ?, progress = COALESCE(?, progress), updated = ? "
+                            "WHERE id = ? AND worker = ? AND status = 'leased'",
+                            (now + lease_seconds, progress, now, job_id, worker)) == 1
+
+    def complete(self, job_id: int, worker: str, result: dict) -> bool:
+        """Record a finished job; False if the worker no longer held the lease."""
+        return self._update("UPDATE jobs SET status = 'done', result = ?, progress = 100, updated = ? "
+                            "WHERE id = ? AND worker = ? AND status = 'leased'",
+                            (json.dumps(result), time.time(), job_id, worker)) == 1
+
+    def fail(self, job_id: int, worker: str, error: str) -> bool:
+        """Record a job that failed; encode errors are not retried."""
+        return self._update("UPDATE jobs SET status = 'failed', error = ?, updated = ? "
+                            "WHERE id = ? AND worker = ? AND status = 'leased'",
+                            (error, time.time(), job_id, worker)) == 1
+
+    def cancel(self, user_id: int) -> int:
+        """Cancel a user's queued and running jobs, returning how many were cancelled."""
+        return self._update("UPDATE jobs SET status = 'cancelled', updated = ? "
+                            "WHERE user_id = ? AND status IN ('queued', 'leased')", (time.time(), user_id))
+
+    def get(self, job_id: int):
+        """Return a job as a dict, or None."""
+        with closing(self._connect()) as conn:
+            row = conn.execute('SELECT * FROM jobs WHERE id = ?', (job_id,)).fetchone()
+        if row is None:
+            return None
+        return dict(row, params=json.loads(row['params']),
+                    result=json.loads(row['result']) if row['result'] else None)
+
+    def position(self, job_id: int) -> int:
+        """Number of queued jobs ahead of this one."""
+        with closing(self._connect()) as conn:
+            return conn.execute("SELECT COUNT(*) FROM jobs WHERE status = 'queued' AND id < ?",
+                                (job_id,)).fetchone()[0]
+
+    def counts(self) -> dict:
+        """Number of jobs per status."""
+        with closing(self._connect()) as conn:
+            return dict(conn.execute('SELECT status, COUNT(*) FROM jobs GROUP BY status').fetchall())
+
+
+def _last_percent(progress_log: str):
+    """Percent done from the last line of a JSON-lines progress log, or None."""
+    try:
+        with open(progress_log, 'rb') as f:
+            f.seek(max(0, os.path.getsize(progress_log) - 4096))
+            last = f.read().splitlines()[-1]
+        return json.loads(last).get('percent')
+    except (OSError, IndexError, ValueError):
+        return None
+
+def _encode(job: dict, threads: int, progress_log: str, errors):
+    """Child process body: run compress_video for one job, reporting an exception through errors."""
+    from video_batch_compress import load_compress_video
+    # Own process group, so stopping the job also stops the ffmpeg processes it starts
+    if hasattr(os, 'setsid'):
+        os.setsid()
+    try:
+        compress_video = load_compress_video()
+        compress_video(job['input_path'], job['output_path'], threads=threads, show_progress=False,
+                       progress_log=progress_log, **job['params'])
+    except BaseException as e:
+        # compress_video calls sys.exit() when FFmpeg is missing
+        errors.send(str(e) or type(e).__name__)
+        raise SystemExit(1)
+
+def _stop(process):
+    """Stop an encode child together with every ffmpeg process it started."""
+    for sig in (signal.SIGTERM, signal.SIGKILL) if hasattr(os, 'killpg') else ():
+        try:
+            os.killpg(process.pid, sig)
+        except ProcessLookupError:
+            break  # Nothing left in the group, or the child has not called setsid yet
+        process.join(STOP_GRACE_SECONDS)
+    if process.is_alive():
+        # Not yet in its own group, so it has not started ffmpeg either
+        process.kill()
+        process.join(STOP_GRACE_SECONDS)
+    if process.is_alive():
+        print(f"Encode process {process.pid} did not exit; leaving it behind")
+
+def run_job(queue: JobQueue, job: dict, worker: str, threads: int = 0) -> bool:
+    """
+    Encode one leased job in a child process, heartbeating until it ends.
+
+    The child is stopped when the lease is lost (job cancelled, or this
+    worker stalled long enough for another one to take over).
+    """
+    start_time = time.time()
+    progress_log = os.path.join(queue.progress_dir, f"{job['id']}.jsonl")
+    receiver, sender = multiprocessing.Pipe(duplex=False)
+    process = multiprocessing.get_context('spawn').Process(target=_encode, args=(job, threads, progress_log, sender))
+    process.start()
+    sender.close()
+    try:
+        while process.is_alive():
+            process.join(HEARTBEAT_SECONDS)
+            if process.is_alive() and not queue.heartbeat(job['id'], worker, _last_percent(progress_log)):
+                print(f"Job {job['id']}: lease lost (cancelled or taken over), stopping")
+                _stop(process)
+                return False
+        if process.exitcode != 0:
+            error = receiver.recv() if receiver.poll() else f'Worker process exited with code {process.exitcode}'
+            queue.fail(job['id'], worker, error)
+            print(f"Job {job['id']}: failed: {error}")
+            return False
+        elapsed = time.time() - start_time
+        queue.complete(job['id'], worker, {'elapsed': round(elapsed, 2),
+                                           'size': os.path.getsize(job['output_path'])})
+        print(f"Job {job['id']}: done in {elapsed:.1f} s")
+        return True
+    finally:
+        if process.is_alive():
+            _stop(process)
+        receiver.close()
+        if os.path.exists(progress_log):
+            os.remove(progress_log)
+
+def work(queue_dir: str = QUEUE_DIR, threads: int = 0, once: bool = False):
+    """Lease and encode jobs until interrupted (or, with once, until the queue is empty)."""
+    queue = JobQueue(queue_dir)
+    worker = worker_name()
+    print(f"Worker {worker} polling {os.path.abspath(queue_dir)}")
+    while True:
+        job = queue.lease(worker)
+        if job is None:
+            if once:
+                return
+            time.sleep(IDLE_POLL_SECONDS)
+            continue
+        print(f"Job {job['id']}: leased (attempt {job['attempts']}): {job['input_path']}")
+        run_job(queue, job, worker, threads)
+
+def main():
+    parser = argparse.ArgumentParser(description="Run encode workers for the shared compression queue.")
+    parser.add_argument('--queue-dir', default=QUEUE_DIR, help="Spool directory shared with the bot")
+    parser.add_argument('--workers', type=int, default=1, help="Worker processes to run on this machine")
+    parser.add_argument('--threads', type=int, default=None, help="Encoder threads per worker")
+    parser.add_argument('--once', action='store_true', help="Exit when the queue is empty")
+    args = parser.parse_args()
+
+    threads = args.threads or max(1, (os.cpu_count() or 1) // args.workers)
+    if args.workers == 1:
+        work(args.queue_dir, threads, args.once)
+        return
+    processes = [multiprocessing.Process(target=work, args=(args.queue_dir, threads, args.once))
+                 for _ in range(args.workers)]
+    for process in processes:
+        process.start()
+    try:
+        for process in processes:
+            process.join()
+    except KeyboardInterrupt:
+        for process in processes:
+            process.terminate()
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
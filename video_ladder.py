@@ -0,0 +1,195 @@
+import argparse
+import os
+import subprocess
+import time
+from pathlib import Path
+from video_encoders import video_encode_options
+from video_filters import RESOLUTION_HEIGHTS, SCALE_FLAGS, get_bitrate_for_resolution_and_choice, scaled_size
+from video_packaging import (MANIFEST_NAMES, MASTER_PLAYLIST_NAME, PACKAGINGS, SEGMENT_SECONDS, FirstSegmentWatcher,
+                             dash_options, directory_size_mb, faststart_options, hls_options, keyframe_options)
+from video_probe import probe_media
+from video_progress import run_with_progress
+from video_segment_encoder import options_to_args
+
+def plan_ladder(media, resolutions: list, bitrate_choice: int, scale_flags: str = SCALE_FLAGS) -> list:
+    """Pick the renditions to produce, skipping tiers above the source resolution."""
+    video = media.video
+    renditions = []
+    for resolution in resolutions:
+        if resolution not in RESOLUTION_HEIGHTS:
+            raise ValueError(f"Unknown resolution: {resolution}")
+        if min(video.width, video.height) < RESOLUTION_HEIGHTS[resolution]:
+            print(f"Skipping {resolution}: the source is only {video.width}x{video.height}")
+            continue
+        size = scaled_size(video.width, video.height, resolution) or (video.width, video.height)
+        renditions.append({
+            'resolution': resolution,
+            'width': size[0],
+            'height': size[1],
+            'bitrate': get_bitrate_for_resolution_and_choice(resolution, bitrate_choice),
+            'filter': f'scale={size[0]}:{size[1]}:flags={scale_flags}',
+        })
+    return renditions
+
+def split_graph(renditions: list) -> tuple:
+    """Return (labels, filter graph) that decode the video once and scale a copy for every rendition."""
+    labels = [f'v{i}' for i in range(len(renditions))]
+    graph = [f"[0:v:0]split={len(renditions)}{''.join(f'[{label}]' for label in labels)}"]
+    graph += [f"[{label}]{r['filter']}[{label}out]" for label, r in zip(labels, renditions)]
+    return labels, ';'.join(graph)
+
+def rendition_options(rendition: dict, preset: str, output_path: str = None) -> dict:
+    """The libx264 options for one rendition, at its bitrate and the ladder's preset."""
+    return dict(video_encode_options('libx264', 'smallest', rendition['bitrate'], output_path), preset=preset)
+
+def per_stream(options: dict, index: int) -> dict:
+    """Qualify video options with a stream specifier so they only apply to output video stream index."""
+    return {f'{key}:{index}' if key.endswith(':v') else f'{key}:v:{index}': value for key, value in options.items()}
+
+def ladder_command(input_path: str, renditions: list, preset: str = 'slower',
+                   keep_subtitles: bool = False) -> list:
+    """Build one ffmpeg command that decodes once and splits into every rendition."""
+    labels, graph = split_graph(renditions)
+    cmd = ['ffmpeg', '-y', '-loglevel', 'error', '-i', input_path, '-filter_complex', graph]
+    for label, r in zip(labels, renditions):
+        cmd += [
+            '-map', f'[{label}out]', '-map', '0:a?',
+            *options_to_args(rendition_options(r, preset, r['path'])),
+            '-c:a', 'aac', '-b:a', '128k',
+        ]
+        if keep_subtitles:
+            cmd += ['-map', '0:s?', '-c:s', 'copy']
+        cmd += [*options_to_args(faststart_options(r['path'])), r['path']]
+    return cmd
+
+def packaged_ladder_command(input_path: str, renditions: list, package_dir: str, packaging: str,
+                            preset: str = 'slower', has_audio: bool = True,
+                            segment_seconds: float = SEGMENT_SECONDS) -> list:
+    """
+    Build one ffmpeg command that writes every rendition into one HLS or DASH package.
+
+    HLS gets a playlist per rendition (in a directory named after it) and a
+    master playlist listing them all; DASH gets one manifest with a
+    representation per rendition. Keyframes are forced on the same
+    boundaries in every rendition, so players can switch at any segment.
+    """
+    labels, graph = split_graph(renditions)
+    cmd = ['ffmpeg', '-y', '-loglevel', 'error', '-i', input_path, '-filter_complex', graph]
+    for label in labels:
+        cmd += ['-map', f'[{label}out]']
+    if has_audio:
+        # HLS variants each carry their own audio; DASH shares one audio representation
+        cmd += ['-map', '0:a:0'] * (len(renditions) if packaging == 'hls' else 1)
+        cmd += ['-c:a', 'aac', '-b:a', '128k']
+    cmd += options_to_args(keyframe_options(segment_seconds))
+    for i, r in enumerate(renditions):
+        cmd += options_to_args(per_stream(rendition_options(r, preset), i))
+
+    if packaging == 'hls':
+        variants = [f"v:{i},a:{i},name:{r['resolution']}" if has_audio else f"v:{i},name:{r['resolution']}"
+                    for i, r in enumerate(renditions)]
+        cmd += [
+            *options_to_args(hls_options(os.path.join(package_dir, '%v'), segment_seconds)),
+            '-master_pl_name', MASTER_PLAYLIST_NAME,
+            '-var_stream_map', ' '.join(variants),
+            os.path.join(package_dir, '%v', MANIFEST_NAMES['hls']),
+        ]
+    else:
+        cmd += [*options_to_args(dash_options(segment_seconds, has_audio)),
+                os.path.join(package_dir, MANIFEST_NAMES['dash'])]
+    return cmd
+
+def representation_size_mb(package_dir: str, index: int) -> float:
+    """Size of one DASH representation (its init and media segments), in MB."""
+    names = [name for name in os.listdir(package_dir)
+             if name == f'init-{index}.m4s' or name.startswith(f'chunk-{index}-')]
+    return sum(os.path.getsize(os.path.join(package_dir, name)) for name in names) / (1024 * 1024)
+
+def encode_ladder(input_path: str, output_dir: str, resolutions: list = ('480p', '720p', '1080p'),
+                  bitrate_choice: int = 2, preset: str = 'slower', container: str = 'mp4',
+                  scale_flags: str = SCALE_FLAGS, packaging: str = 'file') -> list:
+    """
+    Encode several renditions from the RESOLUTION_BITRATES table in one ffmpeg run.
+
+    The source is decoded once and fanned out with a split filter, so the
+    decode cost is paid once instead of once per rendition. Returns each
+    rendition with its output path, size and timing. All renditions are
+    encoded side by side, so each one's share of the wall time is
+    apportioned by its pixel count.
+
+    With packaging 'hls' or 'dash' the renditions are segmented into a
+    directory named after the input instead, with a master playlist (HLS)
+    or manifest (DASH) that lets players pick and switch between them;
+    segments are servable as soon as each one is written.
+    """
+    if not os.path.exists(input_path):
+        raise FileNotFoundError(f"Input file not found: {input_path}")
+    if packaging not in PACKAGINGS:
+        raise ValueError(f"Unknown packaging: {packaging} (use {', '.join(PACKAGINGS)})")
+    os.makedirs(output_dir, exist_ok=True)
+
+    media = probe_media(input_path)
+    renditions = plan_ladder(media, list(resolutions), bitrate_choice, scale_flags)
+    if not renditions:
+        raise ValueError("None of the selected resolutions fit the source")
+    stem = Path(input_path).stem
+    package_dir = os.path.join(output_dir, stem)
+    for r in renditions:
+        if packaging == 'hls':
+            r['path'] = os.path.join(package_dir, r['resolution'], MANIFEST_NAMES['hls'])
+            os.makedirs(os.path.dirname(r['path']), exist_ok=True)
+        elif packaging == 'dash':
+            r['path'] = os.path.join(package_dir, MANIFEST_NAMES['dash'])
+        else:
+            r['path'] = os.path.join(output_dir, f"{stem}_{r['resolution']}.{container}")
+
+    start_time = time.time()
+    if packaging == 'file':
+        subprocess.run(ladder_command(input_path, renditions, preset, keep_subtitles=container == 'mkv'),
+                       check=True, capture_output=True)
+    else:
+        os.makedirs(package_dir, exist_ok=True)
+        cmd = packaged_ladder_command(input_path, renditions, package_dir, packaging, preset,
+                                      has_audio=bool(media.audio_streams))
+        run_with_progress(cmd, media.duration, FirstSegmentWatcher(package_dir, start_time))
+    wall_time = time.time() - start_time
+
+    total_pixels = sum(r['width'] * r['height'] for r in renditions)
+    for i, r in enumerate(renditions):
+        if packaging == 'hls':
+            r['size_mb'] = directory_size_mb(os.path.dirname(r['path']))
+        elif packaging == 'dash':
+            r['size_mb'] = representation_size_mb(package_dir, i)
+        else:
+            r['size_mb'] = os.path.getsize(r['path']) / (1024 * 1024)
+        r['wall_time'] = wall_time
+        r['encode_time_share'] = wall_time * r['width'] * r['height'] / total_pixels
+    return renditions
+
+def main():
+    parser = argparse.ArgumentParser(description="Encode several resolutions from a single decode.")
+    parser.add_argument('input', help="Source video")
+    parser.add_argument('output_dir', help="Directory for the renditions")
+    parser.add_argument('--resolutions', default='480p,720p,1080p', help="Comma separated tiers")
+    parser.add_argument('--bitrate-choice', type=int, default=2, choices=[1, 2, 3])
+    parser.add_argument('--container', default='mp4', choices=['mp4', 'mkv'])
+    parser.add_argument('--packaging', default='file', choices=PACKAGINGS,
+                        help="file: one file per rendition; hls/dash: segments with a master playlist")
+    args = parser.parse_args()
+
+    try:
+        renditions = encode_ladder(args.input, args.output_dir, args.resolutions.split(','),
+                                   args.bitrate_choice, container=args.container, packaging=args.packaging)
+    except subprocess.CalledProcessError as e:
+        print(f"An error occurred during compression: {e.stderr.decode() if e.stderr else str(e)}")
+        raise
+
+    print(f"\nLadder complete in {renditions[0]['wall_time']:.2f} seconds:")
+    for r in renditions:
+        print(f"  {r['resolution']:>5} {r['width']}x{r['height']} @ {r['bitrate']} kbps: "
+              f"{r['size_mb']:.2f} MB, ~{r['encode_time_share']:.2f} s -> {r['path']}")
+    if args.packaging == 'hls':
+        print(f"Master playlist: {os.path.join(os.path.dirname(os.path.dirname(renditions[0]['path'])), MASTER_PLAYLIST_NAME)}")
+
+if __name__ == "__main__":
+    main()
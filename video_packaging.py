@@ -0,0 +1,107 @@
+import os
+import time
+
+PACKAGINGS = ('file', 'hls', 'dash')
+SEGMENT_SECONDS = 6
+# Containers whose index (moov) can be moved to the front for progressive playback
+FASTSTART_EXTENSIONS = ('.mp4', '.m4v', '.mov')
+MANIFEST_NAMES = {'hls': 'index.m3u8', 'dash': 'manifest.mpd'}
+MASTER_PLAYLIST_NAME = 'master.m3u8'
+
+def faststart_options(output_path: str) -> dict:
+    """
+    Output options that put the MP4 index at the front of the file.
+
+    Players can then start after the first few kilobytes instead of
+    fetching the whole file; ffmpeg moves the index in one extra pass over
+    the output once the encode is done.
+    """
+    if os.path.splitext(output_path)[1].lower() in FASTSTART_EXTENSIONS:
+        return {'movflags': '+faststart'}
+    return {}
+
+def keyframe_options(segment_seconds: float = SEGMENT_SECONDS) -> dict:
+    """Force a keyframe at every segment boundary, so every rendition cuts at the same times."""
+    return {'force_key_frames': f'expr:gte(t,n_forced*{segment_seconds:g})'}
+
+def package_paths(output_path: str, packaging: str) -> tuple:
+    """
+    Return (directory, manifest path) for a packaged output.
+
+    The segments go in a directory named after the output file without
+    its extension; 'file' packaging is the output file itself.
+    """
+    if packaging not in PACKAGINGS:
+        raise ValueError(f"Unknown packaging: {packaging} (use {', '.join(PACKAGINGS)})")
+    if packaging == 'file':
+        return os.path.dirname(output_path), output_path
+    directory = os.path.splitext(output_path)[0]
+    return directory, os.path.join(directory, MANIFEST_NAMES[packaging])
+
+def hls_options(directory: str, segment_seconds: float = SEGMENT_SECONDS) -> dict:
+    """
+    Muxer options for HLS with fMP4 segments.
+
+    The playlist is an EVENT playlist rewritten after every segment, so
+    players can start on the first segments while the encode continues;
+    temp_file keeps them from seeing half-written segments.
+    """
+    return {
+        'f': 'hls',
+        'hls_time': segment_seconds,
+        'hls_playlist_type': 'event',
+        'hls_segment_type': 'fmp4',
+        'hls_fmp4_init_filename': 'init.mp4',
+        'hls_segment_filename': os.path.join(directory, 'segment_%05d.m4s'),
+        'hls_flags': 'independent_segments+temp_file',
+    }
+
+def dash_options(segment_seconds: float = SEGMENT_SECONDS, has_audio: bool = True) -> dict:
+    """Muxer options for DASH with fMP4 segments; the manifest is rewritten as segments complete."""
+    return {
+        'f': 'dash',
+        'seg_duration': segment_seconds,
+        'use_template': 1,
+        'use_timeline': 1,
+        'init_seg_name': 'init-$RepresentationID$.m4s',
+        'media_seg_name': 'chunk-$RepresentationID$-$Number%05d$.m4s',
+        'adaptation_sets': 'id=0,streams=v id=1,streams=a' if has_audio else 'id=0,streams=v',
+    }
+
+def packaging_options(packaging: str, directory: str, segment_seconds: float = SEGMENT_SECONDS,
+                      has_audio: bool = True) -> dict:
+    """Muxer and keyframe options for an HLS or DASH output."""
+    if packaging == 'hls':
+        muxer = hls_options(directory, segment_seconds)
+    else:
+        muxer = dash_options(segment_seconds, has_audio)
+    return {**keyframe_options(segment_seconds), **muxer}
+
+def directory_size_mb(directory: str) -> float:
+    """Total size of the files in a packaged output directory, in MB."""
+    total = 0
+    for root, _, names in os.walk(directory):
+        total += sum(os.path.getsize(os.path.join(root, name)) for name in names)
+    return total / (1024 * 1024)
+
+
+class FirstSegmentWatcher:
+    """
+    Progress callback that reports when the first segment becomes servable.
+
+    That moment, not the end of the encode, is when playback can start.
+    """
+
+    def __init__(self, directory: str, started: float):
+        self.directory = directory
+        self.started = started
+        self.ready_after = None
+
+    def __call__(self, snapshot: dict):
+        if self.ready_after is not None or not os.path.isdir(self.directory):
+            return
+        for _, _, names in os.walk(self.directory):
+            if any(name.endswith('.m4s') and not name.startswith('init') for name in names):
+                self.ready_after = time.time() - self.started
+                print(f"\nFirst segment ready after {self.ready_after:.1f} seconds; playback can start now")
+                return
@@ -0,0 +1,100 @@
+import os
+
+# Options that only matter when the stream is re-encoded; video_segment_encoder
+# also uses this list to tell the per-segment encode options from the rest
+VIDEO_ENCODE_KEYS = ('b:v', 'maxrate', 'bufsize', 'preset', 'crf', 'tune', 'profile:v',
+                     'pix_fmt', 'vf', 'fps_mode', 'g', 'force_key_frames', 'deadline', 'cpu-used', 'row-mt',
+                     'x264-params', 'x265-params', 'svtav1-params')
+AUDIO_ENCODE_KEYS = ('b:a', 'ac', 'ar')
+
+# Rough x264 'slower' throughput in pixels per second, only used to report the
+# encode time a passthrough avoided
+REFERENCE_PIXEL_RATE = float(os.environ.get('VIDEO_REFERENCE_PIXEL_RATE', 1920 * 1080 * 20))
+
+def stream_bitrate_kbps(stream, media=None):
+    """Return a stream's bitrate in kbps from ffprobe or its Matroska BPS tag, or None."""
+    if stream.bit_rate:
+        return stream.bit_rate / 1000
+    for key, value in stream.raw.get('tags', {}).items():
+        if key.upper() == 'BPS' or key.upper().startswith('BPS-'):
+            try:
+                return float(value) / 1000
+            except ValueError:
+                pass
+    # Single video stream files: whatever the audio does not use is video.
+    # With more video streams (e.g. cover art) the split is unknown.
+    if (media is not None and stream.codec_type == 'video' and media.bit_rate
+            and len([s for s in media.streams if s.codec_type == 'video']) == 1):
+        audio_kbps = sum(stream_bitrate_kbps(a) or 128 for a in media.audio_streams)
+        return media.bit_rate / 1000 - audio_kbps
+    return None
+
+def video_can_be_copied(media, video_codec: str, target_video_bitrate: float, needs_filters: bool) -> bool:
+    """True when the source video already matches the codec and is at or below the bitrate."""
+    video = media.video
+    if video is None or needs_filters:
+        return False
+    codec_names = {'libx264': 'h264', 'libx265': 'hevc', 'libsvtav1': 'av1', 'libvpx-vp9': 'vp9'}
+    if video.codec_name != codec_names.get(video_codec, video_codec):
+        return False
+    if video.pix_fmt not in (None, 'yuv420p'):
+        return False
+    bitrate = stream_bitrate_kbps(video, media)
+    return bitrate is not None and bitrate <= target_video_bitrate
+
+def audio_can_be_copied(media, audio_codec: str, target_audio_bitrate: float) -> bool:
+    """True when every audio track is already in the target codec at or below the bitrate."""
+    codec_names = {'libopus': 'opus', 'libvorbis': 'vorbis', 'libmp3lame': 'mp3'}
+    for audio in media.audio_streams:
+        if audio.codec_name != codec_names.get(audio_codec, audio_codec):
+            return False
+        bitrate = stream_bitrate_kbps(audio)
+        if bitrate is None or bitrate > target_audio_bitrate:
+            return False
+    return True
+
+def choose_stream_handling(media, output_path: str, output_options: dict, target_video_bitrate: float) -> dict:
+    """
+    Decide per stream whether compress_video has to re-encode.
+
+    Returns a decision with a 'path' of:
+      'stream-copy'  - nothing needs re-encoding and the container stays the same
+      'remux-only'   - nothing needs re-encoding but the container changes
+      'audio-only'   - the video is copied and only the audio is re-encoded
+      'video-only'   - the audio is copied and only the video is re-encoded
+      'full'         - everything is re-encoded
+    """
+    copy_video = video_can_be_copied(media, output_options.get('c:v'), target_video_bitrate,
+                                     needs_filters='vf' in output_options)
+    audio_bitrate = float(str(output_options.get('b:a', '128k')).rstrip('k'))
+    copy_audio = audio_can_be_copied(media, output_options.get('c:a'), audio_bitrate)
+
+    if copy_video and copy_audio:
+        same_container = os.path.splitext(media.path)[1].lower() == os.path.splitext(output_path)[1].lower()
+        path = 'stream-copy' if same_container else 'remux-only'
+    elif copy_video:
+        path = 'audio-only'
+    elif copy_audio:
+        path = 'video-only'
+    else:
+        path = 'full'
+
+    video = media.video
+    avoided = 0.0
+    if copy_video and video is not None and video.fps:
+        avoided = media.duration * video.fps * video.width * video.height / REFERENCE_PIXEL_RATE
+    return {'path': path, 'copy_video': copy_video, 'copy_audio': copy_audio,
+            'estimated_seconds_avoided': avoided}
+
+def apply_stream_handling(output_options: dict, decision: dict) -> dict:
+    """Return output options that stream-copy whatever the decision allows."""
+    options = dict(output_options)
+    if decision['copy_video']:
+        for key in VIDEO_ENCODE_KEYS:
+            options.pop(key, None)
+        options['c:v'] = 'copy'
+    if decision['copy_audio']:
+        for key in AUDIO_ENCODE_KEYS:
+            options.pop(key, None)
+        options['c:a'] = 'copy'
+    return options
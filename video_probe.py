@@ -0,0 +1,245 @@
+import functools
+import itertools
+import json
+import os
+import re
+import shutil
+import sqlite3
+import subprocess
+import threading
+import time
+from collections import OrderedDict
+from contextlib import closing
+from dataclasses import dataclass, field
+from typing import Optional
+import ffmpeg
+
+PROBE_CACHE_PATH = os.environ.get('VIDEO_PROBE_CACHE', './cache/probe.sqlite3')
+PROBE_CACHE_MAX_ENTRIES = int(os.environ.get('VIDEO_PROBE_CACHE_MAX_ENTRIES', 50000))
+PROBE_CACHE_PRUNE_INTERVAL = 100  # Inserts between size checks of the probe store
+PROBE_MEMORY_MAX_ENTRIES = 256  # Per process; older probes are still on disk
+
+
+@dataclass
+class StreamInfo:
+    """A single stream of a probed file."""
+    index: int
+    codec_type: str
+    codec_name: Optional[str]
+    bit_rate: Optional[int]  # bits per second, when the container reports it
+    language: Optional[str]
+    raw: dict = field(repr=False, default_factory=dict)
+
+
+@dataclass
+class VideoStreamInfo(StreamInfo):
+    width: int = 0
+    height: int = 0
+    fps: float = 0.0
+    pix_fmt: Optional[str] = None
+
+
+@dataclass
+class AudioStreamInfo(StreamInfo):
+    channels: int = 0
+    sample_rate: int = 0
+
+
+@dataclass
+class MediaInfo:
+    """Typed view of ffprobe's output for one file."""
+    path: str
+    format_name: str
+    duration: float
+    size: int
+    bit_rate: Optional[int]
+    streams: list
+    raw: dict = field(repr=False, default_factory=dict)
+
+    @property
+    def video(self) -> Optional[VideoStreamInfo]:
+        """The first video stream, if any."""
+        return next((s for s in self.streams if s.codec_type == 'video'), None)
+
+    @property
+    def audio_streams(self) -> list:
+        return [s for s in self.streams if s.codec_type == 'audio']
+
+    @property
+    def subtitle_streams(self) -> list:
+        return [s for s in self.streams if s.codec_type == 'subtitle']
+
+
+def _int_or_none(value) -> Optional[int]:
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return None
+
+def _parse_rate(rate: str) -> float:
+    """Turn an ffprobe frame rate like '30000/1001' into frames per second."""
+    try:
+        num, _, den = (rate or '0/0').partition('/')
+        return float(num) / float(den or 1)
+    except (ValueError, ZeroDivisionError):
+        return 0.0
+
+def _stream_info(stream: dict) -> StreamInfo:
+    common = {
+        'index': stream.get('index', 0),
+        'codec_type': stream.get('codec_type', ''),
+        'codec_name': stream.get('codec_name'),
+        'bit_rate': _int_or_none(stream.get('bit_rate')),
+        'language': stream.get('tags', {}).get('language'),
+        'raw': stream,
+    }
+    if common['codec_type'] == 'video':
+        return VideoStreamInfo(**common, width=stream.get('width', 0), height=stream.get('height', 0),
+                               fps=_parse_rate(stream.get('avg_frame_rate')) or _parse_rate(stream.get('r_frame_rate')),
+                               pix_fmt=stream.get('pix_fmt'))
+    if common['codec_type'] == 'audio':
+        return AudioStreamInfo(**common, channels=stream.get('channels', 0),
+                               sample_rate=_int_or_none(stream.get('sample_rate')) or 0)
+    return StreamInfo(**common)
+
+def media_info_from_probe(path: str, probe: dict) -> MediaInfo:
+    """Build a MediaInfo from a raw ffprobe result."""
+    fmt = probe.get('format', {})
+    return MediaInfo(
+        path=path,
+        format_name=fmt.get('format_name', ''),
+        duration=float(fmt.get('duration') or 0),
+        size=_int_or_none(fmt.get('size')) or 0,
+        bit_rate=_int_or_none(fmt.get('bit_rate')),
+        streams=[_stream_info(s) for s in probe.get('streams', [])],
+        raw=probe,
+    )
+
+def _connect() -> sqlite3.Connection:
+    directory = os.path.dirname(PROBE_CACHE_PATH)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    conn = sqlite3.connect(PROBE_CACHE_PATH, timeout=30)
+    conn.execute('CREATE TABLE IF NOT EXISTS probes (key TEXT PRIMARY KEY, data TEXT, last_used REAL)')
+    conn.execute('CREATE INDEX IF NOT EXISTS probes_last_used ON probes (last_used)')
+    return conn
+
+def _cache_get(key: str) -> Optional[dict]:
+    with closing(_connect()) as conn, conn:
+        row = conn.execute('SELECT data FROM probes WHERE key = ?', (key,)).fetchone()
+        if row is None:
+            return None
+        conn.execute('UPDATE probes SET last_used = ? WHERE key = ?', (time.time(), key))
+    return json.loads(row[0])
+
+_inserts_since_prune = itertools.count()
+
+def _cache_put(key: str, data: dict):
+    with closing(_connect()) as conn, conn:
+        conn.execute('INSERT OR REPLACE INTO probes VALUES (?, ?, ?)', (key, json.dumps(data), time.time()))
+        # Keep the store bounded, checking its size only now and then; the
+        # least recently used entries go first
+        if next(_inserts_since_prune) % PROBE_CACHE_PRUNE_INTERVAL == 0:
+            excess = conn.execute('SELECT COUNT(*) FROM probes').fetchone()[0] - PROBE_CACHE_MAX_ENTRIES
+            if excess > 0:
+                conn.execute('DELETE FROM probes WHERE key IN '
+                             '(SELECT key FROM probes ORDER BY last_used LIMIT ?)', (excess,))
+
+def probe_cache_key(path: str, content_hash: str = None) -> str:
+    """Key a probe by content hash when known, otherwise by (path, size, mtime)."""
+    if content_hash:
+        return f'sha256:{content_hash}'
+    st = os.stat(path)
+    return f'file:{os.path.abspath(path)}:{st.st_size}:{st.st_mtime_ns}'
+
+# Least recently used last; shared by the bot's worker threads
+_memory_cache = OrderedDict()
+_memory_lock = threading.Lock()
+
+def _memory_get(key: str):
+    with _memory_lock:
+        probe = _memory_cache.get(key)
+        if probe is not None:
+            _memory_cache.move_to_end(key)
+        return probe
+
+def _memory_put(key: str, probe: dict):
+    with _memory_lock:
+        _memory_cache[key] = probe
+        _memory_cache.move_to_end(key)
+        while len(_memory_cache) > PROBE_MEMORY_MAX_ENTRIES:
+            _memory_cache.popitem(last=False)
+
+def probe_media(path: str, content_hash: str = None) -> MediaInfo:
+    """
+    Probe a file once and return its typed metadata.
+
+    Recent results are kept in memory for the process and all of them in
+    a SQLite store on disk, so unchanged files are never probed twice.
+    """
+    key = probe_cache_key(path, content_hash)
+    probe = _memory_get(key)
+    if probe is None:
+        probe = _cache_get(key)
+        if probe is None:
+            probe = ffmpeg.probe(path)
+            _cache_put(key, probe)
+        _memory_put(key, probe)
+    return media_info_from_probe(path, probe)
+
+def count_video_frames(path: str) -> int:
+    """Count the frames of the first video stream by reading its packets, without decoding."""
+    result = subprocess.run(['ffprobe', '-v', 'error', '-select_streams', 'v:0', '-count_packets',
+                             '-show_entries', 'stream=nb_read_packets', '-of', 'csv=p=0', path],
+                            capture_output=True, text=True)
+    try:
+        return int(result.stdout.strip().split(',')[0])
+    except ValueError:
+        return 0
+
+def _run_listing(binary: str, flag: str) -> str:
+    return subprocess.run([binary, '-hide_banner', flag], capture_output=True, text=True).stdout
+
+def _parse_listing(output: str) -> list:
+    """Return the names listed after the '--' / '------' separator of -encoders or -muxers."""
+    names, started = [], False
+    for line in output.splitlines():
+        if not started:
+            started = line.strip() in ('--', '------')
+            continue
+        parts = line.split()
+        if len(parts) >= 2:
+            names.append(parts[1])
+    return names
+
+def _parse_filters(output: str) -> list:
+    return re.findall(r'^\s*[T.][S.][C.]?\s+(\S+)\s+\S*->\S*', output, re.MULTILINE)
+
+@functools.lru_cache(maxsize=None)
+def ffmpeg_capabilities(binary: str = 'ffmpeg') -> dict:
+    """
+    Detect what the local FFmpeg build can do.
+
+    Runs at most once per process, and the result is stored per binary
+    (path, size, mtime) so a new process reuses it until FFmpeg changes.
+    """
+    path = shutil.which(binary)
+    if path is None:
+        return {'available': False, 'version': None, 'encoders': [], 'filters': [], 'muxers': []}
+
+    st = os.stat(path)
+    key = f'ffmpeg:{path}:{st.st_size}:{st.st_mtime_ns}'
+    cached = _cache_get(key)
+    if cached is not None:
+        return cached
+
+    version_output = subprocess.run([path, '-version'], capture_output=True, text=True).stdout
+    capabilities = {
+        'available': True,
+        'version': version_output.splitlines()[0] if version_output else None,
+        'encoders': _parse_listing(_run_listing(path, '-encoders')),
+        'filters': _parse_filters(_run_listing(path, '-filters')),
+        'muxers': _parse_listing(_run_listing(path, '-muxers')),
+    }
+    _cache_put(key, capabilities)
+    return capabilities
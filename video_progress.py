@@ -0,0 +1,137 @@
+import json
+import subprocess
+import sys
+import threading
+import time
+
+def with_progress_args(cmd: list) -> list:
+    """Make an ffmpeg command write machine-readable progress to stdout."""
+    return [cmd[0], '-progress', 'pipe:1', '-nostats', *cmd[1:]]
+
+def _parse_time(value: str) -> float:
+    """Turn ffmpeg's HH:MM:SS.micro out_time into seconds."""
+    try:
+        hours, minutes, seconds = value.split(':')
+        return int(hours) * 3600 + int(minutes) * 60 + float(seconds)
+    except ValueError:
+        return 0.0
+
+def _parse_number(value: str) -> float:
+    try:
+        return float(value.rstrip('x').replace('kbits/s', ''))
+    except (AttributeError, ValueError):
+        return 0.0
+
+
+class ProgressParser:
+    """
+    Turn ffmpeg's -progress key=value lines into progress snapshots.
+
+    ffmpeg writes a block of keys ending in progress=continue (or
+    progress=end for the last block); every completed block becomes one
+    snapshot dict with frame, fps, speed, out_time, bitrate, percent and
+    eta (seconds, or None while unknown).
+    """
+
+    def __init__(self, duration: float = None):
+        self.duration = duration
+        self.started = time.monotonic()
+        self._block = {}
+
+    def feed(self, line: str):
+        """Feed one line; returns a snapshot when a block completes, else None."""
+        key, sep, value = line.strip().partition('=')
+        if not sep:
+            return None
+        self._block[key] = value
+        if key != 'progress':
+            return None
+        block, self._block = self._block, {}
+
+        out_time = _parse_time(block.get('out_time', '0:0:0'))
+        speed = _parse_number(block.get('speed', '0'))
+        percent = eta = None
+        if self.duration:
+            percent = min(100.0, out_time / self.duration * 100)
+            if speed:
+                eta = max(0.0, (self.duration - out_time) / speed)
+        return {
+            'progress': value,
+            'frame': int(_parse_number(block.get('frame', '0'))),
+            'fps': _parse_number(block.get('fps', '0')),
+            'speed': speed,
+            'out_time': out_time,
+            'bitrate_kbps': _parse_number(block.get('bitrate', '0')),
+            'total_size': int(_parse_number(block.get('total_size', '0'))),
+            'percent': percent,
+            'eta': 0.0 if value == 'end' else eta,
+            'elapsed': time.monotonic() - self.started,
+        }
+
+
+def iter_progress(cmd: list, duration: float = None):
+    """
+    Run an ffmpeg command and yield progress snapshots while it encodes.
+
+    Raises subprocess.CalledProcessError (with stderr) if ffmpeg fails.
+    """
+    parser = ProgressParser(duration)
+    process = subprocess.Popen(with_progress_args(cmd), stdout=subprocess.PIPE,
+                               stderr=subprocess.PIPE, text=True)
+    # Drain stderr alongside stdout: a damaged input can log more warnings than
+    # the pipe holds, which would block ffmpeg while we wait on its progress
+    stderr_lines = []
+    drain = threading.Thread(target=lambda: stderr_lines.extend(process.stderr), daemon=True)
+    drain.start()
+    try:
+        for line in process.stdout:
+            snapshot = parser.feed(line)
+            if snapshot is not None:
+                yield snapshot
+    finally:
+        if process.poll() is None:
+            process.kill()
+        process.wait()
+        drain.join()
+    if process.returncode != 0:
+        raise subprocess.CalledProcessError(process.returncode, cmd, stderr=''.join(stderr_lines).encode())
+
+def run_with_progress(cmd: list, duration: float = None, *callbacks) -> dict:
+    """Run an ffmpeg command, passing every progress snapshot to the callbacks; returns the last one."""
+    snapshot = None
+    for snapshot in iter_progress(cmd, duration):
+        for callback in callbacks:
+            if callback is not None:
+                callback(snapshot)
+    return snapshot
+
+def format_progress(snapshot: dict) -> str:
+    """Render a snapshot as one human readable line."""
+    parts = []
+    if snapshot['percent'] is not None:
+        parts.append(f"{snapshot['percent']:.0f}%")
+    parts.append(f"{snapshot['fps']:.1f} fps")
+    parts.append(f"{snapshot['speed']:.2f}x")
+    parts.append(f"{snapshot['bitrate_kbps']:.0f} kbps")
+    if snapshot['eta'] is not None:
+        minutes, seconds = divmod(int(snapshot['eta']), 60)
+        parts.append(f"ETA {minutes}:{seconds:02d}")
+    return ' | '.join(parts)
+
+def print_progress(snapshot: dict):
+    """Console callback that keeps rewriting a single status line."""
+    end = '\n' if snapshot['progress'] == 'end' else ''
+    sys.stdout.write(f"\rProgress: {format_progress(snapshot)}   {end}")
+    sys.stdout.flush()
+
+
+class JsonLinesProgressLog:
+    """Callback that appends every snapshot to a JSON-lines file for later analysis."""
+
+    def __init__(self, path: str, **fields):
+        self.path = path
+        self.fields = fields  # Extra fields (e.g. input file) added to every line
+
+    def __call__(self, snapshot: dict):
+        with open(self.path, 'a') as f:
+            f.write(json.dumps({'time': time.time(), **self.fields, **snapshot}) + '\n')
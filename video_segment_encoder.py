@@ -0,0 +1,307 @@
+import argparse
+import glob
+import json
+import os
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+from video_passthrough import VIDEO_ENCODE_KEYS
+
+# Output options that belong to the per-segment video encode; everything else
+# (audio, subtitles, data, mapping) is applied once when the segments are joined
+VIDEO_OPTION_KEYS = {'c:v', *VIDEO_ENCODE_KEYS}
+MANIFEST_NAME = 'job.json'
+# A worker refreshes its segment claim while encoding; a claim untouched for
+# longer than the lease belongs to a worker that is gone (even on another host)
+CLAIM_LEASE_SECONDS = 120
+CLAIM_REFRESH_SECONDS = 15
+
+def options_to_args(options: dict) -> list:
+    """Turn an ffmpeg-python style options dict into command line arguments; list values repeat the flag."""
+    args = []
+    for key, value in options.items():
+        for item in value if isinstance(value, (list, tuple)) else [value]:
+            args.append(f'-{key}')
+            if item is not None:
+                args.append(str(item))
+    return args
+
+def split_output_options(output_options: dict) -> tuple:
+    """Split compress_video's output options into (video options, join options)."""
+    video_options = {k: v for k, v in output_options.items() if k in VIDEO_OPTION_KEYS}
+    join_options = {k: v for k, v in output_options.items()
+                    if k not in VIDEO_OPTION_KEYS and k not in ('map', 'threads', 'loglevel')}
+    return video_options, join_options
+
+def split_at_keyframes(input_path: str, work_dir: str, segment_seconds: float) -> list:
+    """
+    Cut the first video stream into segments without re-encoding.
+
+    The segment muxer only cuts on keyframes, so every segment starts with
+    an IDR frame and the source's own scene-cut keyframes become boundaries.
+    """
+    pattern = os.path.join(work_dir, 'src_%05d.mkv')
+    cmd = [
+        'ffmpeg', '-y', '-loglevel', 'error',
+        '-i', input_path,
+        '-map', '0:v:0', '-c', 'copy',
+        '-f', 'segment', '-segment_time', str(segment_seconds),
+        '-reset_timestamps', '1',
+        pattern
+    ]
+    subprocess.run(cmd, check=True, capture_output=True)
+    return sorted(glob.glob(os.path.join(work_dir, 'src_*.mkv')))
+
+def encoded_path_for(segment_path: str) -> str:
+    """Return where the encoded version of a source segment is written."""
+    directory, name = os.path.split(segment_path)
+    return os.path.join(directory, name.replace('src_', 'enc_', 1))
+
+def encode_segment(segment_path: str, video_options: dict, threads: int = 0) -> float:
+    """Encode one segment and return the time it took in seconds, refreshing its claim meanwhile."""
+    output_path = encoded_path_for(segment_path)
+    tmp_path = output_path + '.part.mkv'
+    cmd = ['ffmpeg', '-y', '-loglevel', 'error', '-i', segment_path,
+           *options_to_args(video_options), '-threads', str(threads), '-an', '-sn', '-dn', tmp_path]
+    start_time = time.time()
+    process = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    while True:
+        try:
+            stdout, stderr = process.communicate(timeout=CLAIM_REFRESH_SECONDS)
+            break
+        except subprocess.TimeoutExpired:
+            refresh_claim(segment_path)
+        except BaseException:
+            process.kill()
+            process.wait()
+            raise
+    if process.returncode != 0:
+        raise subprocess.CalledProcessError(process.returncode, cmd, stdout, stderr)
+    # Flush to disk before the rename marks the segment done, so a crash cannot leave a torn segment
+    with open(tmp_path, 'rb') as f:
+        os.fsync(f.fileno())
+    os.replace(tmp_path, output_path)
+    return time.time() - start_time
+
+def claim_segment(segment_path: str) -> bool:
+    """Claim a segment for this worker with an exclusive lock file in the shared directory."""
+    try:
+        fd = os.open(segment_path + '.lock', os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+    except FileExistsError:
+        return False
+    os.write(fd, f'{socket.gethostname()}:{os.getpid()}'.encode())
+    os.close(fd)
+    return True
+
+def refresh_claim(segment_path: str):
+    """Renew this worker's claim on a segment it is still encoding."""
+    try:
+        os.utime(segment_path + '.lock')
+    except FileNotFoundError:
+        pass
+
+def _process_alive(pid: int) -> bool:
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True  # Exists, but belongs to another user
+    return True
+
+def _claim_is_stale(lock_path: str) -> bool:
+    """
+    Whether a segment claim was left by a worker that is no longer encoding it.
+
+    A claim is stale once its lease runs out, whichever host made it (a
+    restarted container usually comes back under a new hostname). Claims
+    from this host are stale straight away if their process is gone or is
+    this one: claims are only checked while this process holds none, so one
+    with our PID was left by an earlier process that had the same PID.
+    """
+    try:
+        if time.time() - os.path.getmtime(lock_path) > CLAIM_LEASE_SECONDS:
+            return True
+        with open(lock_path) as f:
+            host, _, pid = f.read().rpartition(':')
+        pid = int(pid)
+    except FileNotFoundError:
+        return False
+    except (OSError, ValueError):
+        return False  # Still being written; the lease decides later
+    return host == socket.gethostname() and (pid == os.getpid() or not _process_alive(pid))
+
+def release_stale_claims(work_dir: str) -> int:
+    """
+    Remove claims left behind by workers that are no longer running.
+
+    A worker killed mid-segment leaves its lock file but no encoded output;
+    without this, a restarted job would wait forever for that segment.
+    Returns the number of claims released.
+    """
+    released = 0
+    for lock_path in glob.glob(os.path.join(work_dir, 'src_*.mkv.lock')):
+        encoded_path = encoded_path_for(lock_path[:-len('.lock')])
+        if os.path.exists(encoded_path) or not _claim_is_stale(lock_path):
+            continue
+        if os.path.exists(encoded_path + '.part.mkv'):
+            os.remove(encoded_path + '.part.mkv')
+        os.remove(lock_path)
+        released += 1
+    return released
+
+def encode_pending_segments(work_dir: str, workers: int = None, on_segment=None, cores: int = None) -> dict:
+    """
+    Encode every unclaimed segment of a prepared job directory.
+
+    Several machines can run this against the same shared directory at
+    once; each segment is claimed through a lock file so it is encoded only
+    once. on_segment(path, seconds) is called as each segment finishes.
+    cores caps the threads used by all segment encodes together (default:
+    every core). Returns a mapping of segment path to encode seconds for the segments
+    this call encoded.
+    """
+    with open(os.path.join(work_dir, MANIFEST_NAME)) as f:
+        manifest = json.load(f)
+    cores = cores or os.cpu_count() or 1
+    workers = workers or cores
+    threads = max(1, cores // workers)
+
+    def run(segment_path):
+        if os.path.exists(encoded_path_for(segment_path)) or not claim_segment(segment_path):
+            return None
+        seconds = encode_segment(segment_path, manifest['video_options'], threads)
+        if on_segment is not None:
+            on_segment(segment_path, seconds)
+        return seconds
+
+    segments = [os.path.join(work_dir, name) for name in manifest['segments']]
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        timings = dict(zip(segments, pool.map(run, segments)))
+    return {path: seconds for path, seconds in timings.items() if seconds is not None}
+
+def wait_for_segments(work_dir: str, segments: list, workers: int = None, on_segment=None,
+                      cores: int = None, stall_seconds: float = 2 * CLAIM_LEASE_SECONDS) -> dict:
+    """
+    Wait until every segment is encoded, taking over segments whose claims go stale.
+
+    Other machines sharing the work directory may still be encoding some
+    segments. Raises TimeoutError if no segment finishes and no claim is
+    refreshed for stall_seconds. Returns the timings of the segments
+    encoded here.
+    """
+    timings = {}
+    last_state, last_change = None, time.time()
+    while True:
+        pending = [path for path in segments if not os.path.exists(encoded_path_for(path))]
+        if not pending:
+            return timings
+        if release_stale_claims(work_dir):
+            timings.update(encode_pending_segments(work_dir, workers, on_segment, cores))
+            continue
+        # Progress is a segment finishing or another worker refreshing its claim
+        state = (len(pending), max((os.path.getmtime(path + '.lock') for path in pending
+                                    if os.path.exists(path + '.lock')), default=None))
+        if state != last_state:
+            last_state, last_change = state, time.time()
+        elif time.time() - last_change > stall_seconds:
+            raise TimeoutError(f"{len(pending)} segment(s) in {work_dir} made no progress "
+                               f"for {stall_seconds:.0f} seconds")
+        time.sleep(1)
+
+def join_segments(work_dir: str, input_path: str, output_path: str, join_options: dict):
+    """Concatenate the encoded segments losslessly and add the other streams once."""
+    with open(os.path.join(work_dir, MANIFEST_NAME)) as f:
+        manifest = json.load(f)
+    list_path = os.path.join(work_dir, 'concat.txt')
+    with open(list_path, 'w') as f:
+        for name in manifest['segments']:
+            encoded = os.path.abspath(encoded_path_for(os.path.join(work_dir, name)))
+            if not os.path.exists(encoded):
+                raise FileNotFoundError(f"Segment has not been encoded yet: {encoded}")
+            f.write("file '{}'\n".format(encoded.replace("'", r"'\''")))
+
+    cmd = [
+        'ffmpeg', '-y', '-loglevel', 'error',
+        '-f', 'concat', '-safe', '0', '-i', list_path,
+        '-i', input_path,
+        '-map', '0:v', '-map', '1:a?', '-map', '1:s?', '-map', '1:d?',
+        '-map_metadata', '1', '-map_chapters', '1',
+        '-c:v', 'copy',
+        *options_to_args({'c:s': 'copy', 'c:d': 'copy', **join_options}),
+        output_path
+    ]
+    subprocess.run(cmd, check=True, capture_output=True)
+
+def prepare_job(input_path: str, work_dir: str, video_options: dict, segment_seconds: float) -> list:
+    """Split the input into a job directory that local or remote workers can encode."""
+    os.makedirs(work_dir, exist_ok=True)
+    segments = split_at_keyframes(input_path, work_dir, segment_seconds)
+    with open(os.path.join(work_dir, MANIFEST_NAME), 'w') as f:
+        json.dump({
+            'input_path': os.path.abspath(input_path),
+            'video_options': video_options,
+            'segments': [os.path.basename(path) for path in segments],
+        }, f, indent=2)
+    return segments
+
+def encode_chunked(input_path: str, output_path: str, output_options: dict, workers: int = None,
+                   segment_seconds: float = 60, work_dir: str = None, cores: int = None) -> dict:
+    """
+    Encode a video as keyframe-aligned segments in parallel and join them.
+
+    All segments use the same rate control settings (bitrate, maxrate and
+    bufsize), so quality stays even across boundaries. Pass a work_dir on
+    shared storage to let other machines help by running this module with
+    --work-dir. Returns timing statistics, including the average number
+    of segments that were encoding at once.
+    """
+    video_options, join_options = split_output_options(output_options)
+    own_work_dir = work_dir is None
+    work_dir = work_dir or tempfile.mkdtemp(prefix='segments_', dir=os.path.dirname(output_path) or None)
+    start_time = time.time()
+    try:
+        segments = prepare_job(input_path, work_dir, video_options, segment_seconds)
+        timings = encode_pending_segments(work_dir, workers, cores=cores)
+        # Wait for segments claimed by other machines sharing the work directory
+        timings.update(wait_for_segments(work_dir, segments, workers, cores=cores))
+        join_segments(work_dir, input_path, output_path, join_options)
+    finally:
+        if own_work_dir:
+            shutil.rmtree(work_dir, ignore_errors=True)
+
+    wall_time = time.time() - start_time
+    encode_time = sum(timings.values())
+    return {
+        'segments': len(segments),
+        'wall_time': wall_time,
+        'serial_encode_time': encode_time,
+        # Segment encode seconds per wall second: how many segments ran at once on
+        # average, not a speedup (each segment had fewer threads than one full encode)
+        'parallelism': encode_time / wall_time if wall_time else 1.0,
+    }
+
+def describe_speedup(stats: dict, single_process_seconds: float) -> str:
+    """One line comparing a chunked encode's wall time with a single-process encode of the same file."""
+    return (f"Encoded {stats['segments']} segments in parallel in {stats['wall_time']:.1f} s; a single process "
+            f"is estimated at {single_process_seconds:.1f} s, about {single_process_seconds / stats['wall_time']:.2f}x "
+            f"faster (estimate from the encode time history)")
+
+def main():
+    parser = argparse.ArgumentParser(description="Encode pending segments of a shared chunked job.")
+    parser.add_argument('--work-dir', required=True, help="Job directory created by encode_chunked")
+    parser.add_argument('--workers', type=int, default=None, help="Segments to encode at once")
+    args = parser.parse_args()
+
+    if not os.path.exists(os.path.join(args.work_dir, MANIFEST_NAME)):
+        print(f"No chunked job found in: {args.work_dir}")
+        sys.exit(1)
+    timings = encode_pending_segments(args.work_dir, args.workers)
+    print(f"Encoded {len(timings)} segment(s) in {sum(timings.values()):.2f} seconds of encode time")
+
+if __name__ == "__main__":
+    main()
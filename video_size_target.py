@@ -0,0 +1,142 @@
+import os
+import subprocess
+import tempfile
+from video_progress import run_with_progress
+from video_segment_encoder import options_to_args, split_output_options
+
+CONTAINER_OVERHEAD = 0.02  # Fraction of the file taken by muxing overhead
+SIZE_TOLERANCE = 0.05  # Results between target*(1-tolerance) and target are accepted
+SUBTITLE_KBPS_ESTIMATE = 2  # Used when a copied subtitle/data stream reports no size
+MAX_ATTEMPTS = 3  # Second-pass encodes before giving up on the size window
+MIN_VIDEO_KBPS = 100  # Below this a size target leaves no watchable video
+
+def copied_stream_kbps(stream: dict, duration: float) -> float:
+    """Estimate the bitrate of a stream that is copied as-is into the output."""
+    if stream.get('bit_rate'):
+        return float(stream['bit_rate']) / 1000
+    # Matroska stores per-stream statistics as tags (NUMBER_OF_BYTES or NUMBER_OF_BYTES-eng)
+    for key, value in stream.get('tags', {}).items():
+        if key.upper().startswith('NUMBER_OF_BYTES') and duration:
+            return float(value) * 8 / duration / 1000
+    return SUBTITLE_KBPS_ESTIMATE
+
+def plan_size_target(probe: dict, target_size_mb: float, audio_bitrate: int = 128,
+                     all_streams: bool = True) -> dict:
+    """
+    Work out the video bitrate that makes the output land on target_size_mb.
+
+    Every stream that ends up in the output is accounted for: re-encoded
+    audio tracks at audio_bitrate, and (when all streams are mapped, as with
+    'map': '0') the copied subtitle and data streams. Container overhead is
+    taken off the top. Raises ValueError when the target leaves less than
+    MIN_VIDEO_KBPS for the video.
+    """
+    duration = float(probe['format']['duration'])
+    audio_streams = [s for s in probe['streams'] if s['codec_type'] == 'audio']
+    other_kbps = audio_bitrate * (len(audio_streams) if all_streams else min(1, len(audio_streams)))
+    if all_streams:
+        other_kbps += sum(copied_stream_kbps(s, duration) for s in probe['streams']
+                          if s['codec_type'] in ('subtitle', 'data'))
+
+    total_kbps = target_size_mb * 8192 / duration * (1 - CONTAINER_OVERHEAD)
+    video_kbps = total_kbps - other_kbps
+    if video_kbps < MIN_VIDEO_KBPS:
+        raise ValueError(f"A {target_size_mb} MB target is too small for {duration / 60:.0f} minutes of video: "
+                         f"it leaves {video_kbps:.0f} kbps for the picture, at least {MIN_VIDEO_KBPS} kbps is needed")
+    return {
+        'duration': duration,
+        'target_size_mb': target_size_mb,
+        'other_kbps': other_kbps,
+        'video_kbps': video_kbps,
+    }
+
+def next_video_bitrate(plan: dict, video_bitrate: float, size_mb: float,
+                       tolerance: float = SIZE_TOLERANCE):
+    """Return a corrected video bitrate if size_mb misses the target window, else None."""
+    target_size_mb = plan['target_size_mb']
+    if target_size_mb * (1 - tolerance) <= size_mb <= target_size_mb:
+        return None
+    # Only the video part of the file scales with the video bitrate
+    other_mb = plan['other_kbps'] * plan['duration'] / 8192
+    goal_video_mb = target_size_mb * (1 - tolerance / 2) - other_mb
+    actual_video_mb = max(size_mb - other_mb, 0.001)
+    return video_bitrate * goal_video_mb / actual_video_mb
+
+def with_video_bitrate(output_options: dict, video_bitrate: float) -> dict:
+    """Return output options using video_bitrate, keeping maxrate at or above it."""
+    options = dict(output_options, **{'b:v': f'{video_bitrate:.0f}k'})
+    if 'maxrate' in options and float(str(options['maxrate']).rstrip('k')) < video_bitrate:
+        options['maxrate'] = f'{video_bitrate:.0f}k'
+        options['bufsize'] = f'{video_bitrate*2:.0f}k'
+    return options
+
+def two_pass_commands(input_path: str, output_path: str, output_options: dict, passlog: str,
+                      extra_inputs: tuple = ()) -> tuple:
+    """
+    Build the (first pass, second pass) ffmpeg commands for the given options.
+
+    extra_inputs (e.g. subtitle files) are only read by the second pass,
+    which writes the output.
+    """
+    video_options, _ = split_output_options(output_options)
+    first_pass = [
+        'ffmpeg', '-y', '-loglevel', 'error', '-i', input_path,
+        '-map', '0:v:0', *options_to_args(video_options),
+        '-threads', str(output_options.get('threads', 0)),
+        '-pass', '1', '-passlogfile', passlog,
+        '-an', '-sn', '-dn', '-f', 'null', os.devnull
+    ]
+    second_pass = [
+        'ffmpeg', '-y', '-i', input_path,
+        *[arg for path in extra_inputs for arg in ('-i', path)],
+        *options_to_args(output_options),
+        '-pass', '2', '-passlogfile', passlog,
+        output_path
+    ]
+    return first_pass, second_pass
+
+def encode_to_size(input_path: str, output_path: str, output_options: dict, plan: dict,
+                   min_bitrate: float = MIN_VIDEO_KBPS, max_bitrate: float = None,
+                   max_attempts: int = MAX_ATTEMPTS, progress_callbacks: tuple = (),
+                   extra_inputs: tuple = ()) -> dict:
+    """
+    Two-pass encode towards plan['target_size_mb'], re-running only the second pass on a miss.
+
+    The first-pass statistics are reused for every retry, so a correction
+    costs one encode instead of two. Second-pass progress snapshots are
+    passed to progress_callbacks.
+    """
+    def clamp(bitrate):
+        if max_bitrate is not None:
+            bitrate = min(bitrate, max_bitrate)
+        return max(bitrate, min_bitrate)
+
+    video_bitrate = clamp(plan['video_kbps'])
+    with tempfile.TemporaryDirectory(prefix='passlog_') as log_dir:
+        passlog = os.path.join(log_dir, 'ffmpeg2pass')
+        first_pass, _ = two_pass_commands(input_path, output_path,
+                                          with_video_bitrate(output_options, video_bitrate), passlog)
+        subprocess.run(first_pass, check=True, capture_output=True)
+
+        for attempt in range(1, max_attempts + 1):
+            _, second_pass = two_pass_commands(input_path, output_path,
+                                               with_video_bitrate(output_options, video_bitrate), passlog,
+                                               extra_inputs)
+            run_with_progress(second_pass, plan['duration'], *progress_callbacks)
+            size_mb = os.path.getsize(output_path) / (1024 * 1024)
+            corrected = next_video_bitrate(plan, video_bitrate, size_mb)
+            if corrected is None or clamp(corrected) == video_bitrate:
+                break
+            print(f"Output is {size_mb:.2f} MB, re-encoding at {clamp(corrected):.0f} kbps to hit {plan['target_size_mb']} MB")
+            video_bitrate = clamp(corrected)
+
+    return {'video_bitrate': video_bitrate, 'size_mb': size_mb, 'attempts': attempt,
+            'within_target': size_mb <= plan['target_size_mb']}
+
+def describe_size_result(result: dict, target_size_mb: float) -> str:
+    """One line saying whether an encode_to_size result made the target."""
+    if result['within_target']:
+        return (f"Size target reached in {result['attempts']} pass-2 attempt(s) at {result['video_bitrate']:.0f} kbps: "
+                f"{result['size_mb']:.2f} MB of {target_size_mb} MB")
+    return (f"Size target missed: {result['size_mb']:.2f} MB is over the {target_size_mb} MB target "
+            f"after {result['attempts']} pass-2 attempt(s), last at {result['video_bitrate']:.0f} kbps")
@@ -0,0 +1,80 @@
+import json
+import struct
+import subprocess
+from video_segment_encoder import options_to_args
+
+STREAM_CHUNK_SIZE = 256 * 1024
+# Start of the input held back to decide whether it can be streamed; MP4
+# indexes (moov) larger than this fall back to a temp file
+HEAD_BYTES = 8 * 1024 * 1024
+# Fragmented MP4 needs no index at the end, so it can be written to a pipe
+FRAGMENTED_MP4_MOVFLAGS = 'frag_keyframe+empty_moov+default_base_moof'
+
+def needs_seeking(head: bytes) -> bool:
+    """
+    True when a file starting with head cannot be decoded from a pipe.
+
+    MP4/MOV files keep their index in the moov box; when it comes after the
+    media data (mdat), as most phones and cameras write it, ffmpeg has to
+    seek to the end before it can decode anything. Other containers
+    (Matroska, WebM, MPEG-TS) are read front to back.
+    """
+    if head[4:8] != b'ftyp':
+        return False
+    offset = 0
+    while offset + 8 <= len(head):
+        size, box = struct.unpack('>I4s', head[offset:offset + 8])
+        if box == b'moov':
+            return False
+        if box == b'mdat':
+            return True
+        if size == 1:  # 64-bit size follows the box type
+            if offset + 16 > len(head):
+                break
+            size = struct.unpack('>Q', head[offset + 8:offset + 16])[0]
+        if size < 8:  # 0 means the box runs to the end of the file
+            break
+        offset += size
+    # The index was not found in the head; only a seekable file will do
+    return True
+
+def probe_head(head: bytes):
+    """ffprobe the start of a file fed through stdin; returns the raw probe result, or None if unreadable."""
+    result = subprocess.run(['ffprobe', '-v', 'error', '-show_format', '-show_streams', '-of', 'json', 'pipe:0'],
+                            input=head, capture_output=True)
+    if result.returncode != 0:
+        return None
+    try:
+        probe = json.loads(result.stdout)
+    except ValueError:
+        return None
+    return probe if probe.get('streams') else None
+
+def streaming_command(output_options: dict) -> list:
+    """
+    Build an ffmpeg command that reads the input from stdin and writes fragmented MP4 to stdout.
+
+    Progress goes to stderr (stdout carries the video), so parse it from there.
+    Fragmented output is already playable from the start, so any faststart
+    flag in the options is replaced.
+    """
+    options = {k: v for k, v in output_options.items() if k != 'movflags'}
+    return ['ffmpeg', '-progress', 'pipe:2', '-nostats', '-i', 'pipe:0', *options_to_args(options),
+            '-movflags', FRAGMENTED_MP4_MOVFLAGS, '-f', 'mp4', 'pipe:1']
+
+async def split_head(chunks, size: int = HEAD_BYTES) -> tuple:
+    """Read up to size bytes from an async iterator of chunks; returns (head, iterator over the rest)."""
+    head = bytearray()
+    iterator = chunks.__aiter__()
+    async for chunk in iterator:
+        head += chunk
+        if len(head) >= size:
+            break
+    return bytes(head), iterator
+
+async def prepend(head: bytes, chunks):
+    """Yield head and then every chunk of an async iterator."""
+    if head:
+        yield head
+    async for chunk in chunks:
+        yield chunk
@@ -1,16 +1,142 @@
 import subprocess
 import os
+import re
+import threading
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
+from video_probe import ffmpeg_capabilities, probe_media
+from video_trace import span
 
-def combine_video_and_subtitles(video_path, srt_path, output_path=None):
+# Subtitle file extensions and the format ffmpeg reads them as
+SUBTITLE_FORMATS = {'.srt': 'subrip', '.ass': 'ass', '.ssa': 'ass', '.vtt': 'webvtt'}
+# Text subtitle codecs already in a video, by the format they convert like
+TEXT_SUBTITLE_CODECS = {'subrip': 'subrip', 'srt': 'subrip', 'mov_text': 'subrip',
+                        'ass': 'ass', 'ssa': 'ass', 'webvtt': 'webvtt'}
+
+# Per output container: its muxer, and the subtitle codecs to try for each
+# subtitle format, best first ('copy' keeps the text and styling untouched)
+CONTAINER_SUBTITLE_CODECS = {
+    '.mp4': ('mp4', {'subrip': ['mov_text'], 'ass': ['mov_text'], 'webvtt': ['mov_text']}),
+    '.m4v': ('ipod', {'subrip': ['mov_text'], 'ass': ['mov_text'], 'webvtt': ['mov_text']}),
+    '.mov': ('mov', {'subrip': ['mov_text'], 'ass': ['mov_text'], 'webvtt': ['mov_text']}),
+    '.mkv': ('matroska', {'subrip': ['copy', 'srt'], 'ass': ['copy', 'ass'], 'webvtt': ['copy', 'webvtt']}),
+    '.webm': ('webm', {'subrip': ['webvtt'], 'ass': ['webvtt'], 'webvtt': ['copy', 'webvtt']}),
+}
+
+VIDEO_EXTENSIONS = {'.mkv', '.mp4', '.avi', '.mov', '.m4v', '.webm', '.wmv', '.flv', '.ts'}
+EPISODE_PATTERN = re.compile(r'S(\d{1,2})E(\d{1,3})', re.IGNORECASE)
+# Stream-copy remuxes are limited by disk throughput, not CPU: a couple of
+# jobs per disk keeps it busy without turning reads into random seeks
+JOBS_PER_DISK = 2
+
+DEFAULT_LANGUAGE = 'eng'
+# Two-letter tags as used in file names (movie.en.srt) mapped to the
+# three-letter codes MP4 and MKV store
+LANGUAGE_CODES = {
+    'en': 'eng', 'es': 'spa', 'fr': 'fre', 'de': 'ger', 'it': 'ita', 'pt': 'por', 'nl': 'dut',
+    'ru': 'rus', 'ja': 'jpn', 'ko': 'kor', 'zh': 'chi', 'ar': 'ara', 'hi': 'hin', 'ta': 'tam',
+    'te': 'tel', 'ml': 'mal', 'tr': 'tur', 'pl': 'pol', 'sv': 'swe', 'fi': 'fin', 'no': 'nor',
+    'da': 'dan', 'el': 'gre', 'he': 'heb', 'id': 'ind', 'th': 'tha', 'vi': 'vie', 'uk': 'ukr',
+}
+
+def subtitle_language(subtitle_path: str) -> str:
+    """Read the language tag from a name like movie.en.srt or movie.eng.srt."""
+    tag = Path(Path(subtitle_path).stem).suffix.lstrip('.').lower()
+    if tag in LANGUAGE_CODES:
+        return LANGUAGE_CODES[tag]
+    if tag in LANGUAGE_CODES.values():
+        return tag
+    return DEFAULT_LANGUAGE
+
+def normalize_subtitles(subtitles) -> list:
+    """Accept one path, a list of paths, or (path, language) pairs; return (path, language) pairs."""
+    if isinstance(subtitles, (str, os.PathLike)):
+        subtitles = [subtitles]
+    pairs = []
+    for item in subtitles:
+        if isinstance(item, (tuple, list)):
+            path, language = item
+        else:
+            path, language = item, None
+        pairs.append((str(path), language or subtitle_language(str(path))))
+    return pairs
+
+def _container_codecs(output_path: str):
+    """Return the subtitle codecs by format for the output container and the local FFmpeg encoders."""
+    ext = Path(output_path).suffix.lower()
+    if ext not in CONTAINER_SUBTITLE_CODECS:
+        raise ValueError(f"Cannot embed subtitles in {ext} files; use one of: {', '.join(CONTAINER_SUBTITLE_CODECS)}")
+    muxer, codecs_by_format = CONTAINER_SUBTITLE_CODECS[ext]
+    capabilities = ffmpeg_capabilities()
+    if capabilities['muxers'] and muxer not in capabilities['muxers']:
+        raise ValueError(f"This FFmpeg build cannot write {ext} files")
+    return ext, codecs_by_format, capabilities['encoders']
+
+def _usable_codecs(codecs_by_format: dict, encoders: list, subtitle_format: str) -> list:
+    return [codec for codec in codecs_by_format[subtitle_format]
+            if codec == 'copy' or not encoders or codec in encoders]
+
+def choose_subtitle_codecs(output_path: str, subtitle_paths: list) -> list:
+    """
+    Pick a subtitle codec for every subtitle file before any data is copied.
+
+    The choice depends on the output container and the subtitle format and
+    is checked against the encoders and muxers of the local FFmpeg build.
+    Raises ValueError if some subtitle cannot be stored in the container.
     """
-    Combines a video file with an SRT subtitle file using FFmpeg.
+    ext, codecs_by_format, encoders = _container_codecs(output_path)
+    codecs = []
+    for path in subtitle_paths:
+        subtitle_format = SUBTITLE_FORMATS.get(Path(path).suffix.lower())
+        if subtitle_format is None:
+            raise ValueError(f"Unsupported subtitle format: {path} (use {', '.join(SUBTITLE_FORMATS)})")
+        usable = _usable_codecs(codecs_by_format, encoders, subtitle_format)
+        if not usable:
+            raise ValueError(f"This FFmpeg build cannot store {Path(path).suffix} subtitles in {ext} files")
+        codecs.append(usable[0])
+    return codecs
+
+def choose_existing_subtitle_codecs(media, output_path: str) -> list:
+    """
+    Pick a codec for every subtitle track the video already has, or None to drop it.
+
+    Text tracks are copied when the container takes them as they are and
+    converted like a subtitle file otherwise. Image tracks (PGS, DVD) can
+    only be copied, and only into Matroska.
+    """
+    ext, codecs_by_format, encoders = _container_codecs(output_path)
+    codecs = []
+    for stream in media.subtitle_streams:
+        subtitle_format = TEXT_SUBTITLE_CODECS.get(stream.codec_name)
+        if subtitle_format is None:
+            codecs.append('copy' if ext == '.mkv' else None)
+            continue
+        usable = _usable_codecs(codecs_by_format, encoders, subtitle_format)
+        if stream.codec_name in usable or (stream.codec_name == subtitle_format and 'copy' in usable):
+            codecs.append('copy')
+        else:
+            # 'copy' in the table means a copy of the format's own codec, e.g. not mov_text into Matroska
+            converted = [codec for codec in usable if codec != 'copy']
+            codecs.append(converted[0] if converted else None)
+    return codecs
+
+def combine_video_and_subtitles(video_path, srt_path, output_path=None, overwrite=False, verbose=True):
     """
+    Combines a video file with one or more subtitle files using FFmpeg.
+
+    srt_path may be a single SRT/ASS/VTT file, a list of them, or a list of
+    (path, language) pairs; without an explicit language the tag is read
+    from the file name (movie.en.srt), defaulting to English. Every
+    subtitle is added in one remux, with its codec chosen up front for the
+    output container. Pass overwrite=True to replace an existing output.
+    """
+    subtitles = normalize_subtitles(srt_path)
     # Validate input files
     if not os.path.exists(video_path):
         raise FileNotFoundError(f"Video file not found: {video_path}")
-    if not os.path.exists(srt_path):
-        raise FileNotFoundError(f"Subtitle file not found: {srt_path}")
+    for path, _ in subtitles:
+        if not os.path.exists(path):
+            raise FileNotFoundError(f"Subtitle file not found: {path}")
     
     # Create output path if not provided
     if output_path is None:
@@ -21,49 +147,54 @@ def combine_video_and_subtitles(video_path, srt_path, output_path=None):
     if not Path(output_path).suffix:
         output_path += '.mp4'
     
+    # Fail fast, before reading the video, if a subtitle cannot go in this container
+    with span('ffmpeg_check', step='subtitle_codecs'):
+        codecs = choose_subtitle_codecs(output_path, [path for path, _ in subtitles])
+        existing_codecs = choose_existing_subtitle_codecs(probe_media(video_path), output_path)
+    
     try:
-        # Simpler FFmpeg command with more compatible parameters
-        cmd = [
-            'ffmpeg',
-            '-i', video_path,
-            '-i', srt_path,
+        cmd = ['ffmpeg', '-y' if overwrite else '-n', '-nostdin', '-i', video_path]
+        for path, _ in subtitles:
+            cmd += ['-i', path]
+        cmd += [
+            '-map', '0:v', '-map', '0:a?',
             '-c:v', 'copy',              # Copy video stream exactly
             '-c:a', 'copy',              # Copy audio stream exactly
-            '-scodec', 'mov_text',       # More compatible subtitle codec
-            '-metadata:s:s:0', 'language=eng',
-            output_path
         ]
+        # Keep the subtitle tracks the video already has, ahead of the new ones
+        kept = 0
+        for source_index, codec in enumerate(existing_codecs):
+            if codec is None:
+                if verbose:
+                    print(f"Dropping subtitle track {source_index}: it cannot be stored in {Path(output_path).suffix} files")
+                continue
+            cmd += ['-map', f'0:s:{source_index}', f'-c:s:{kept}', codec]
+            kept += 1
+        for index, ((path, language), codec) in enumerate(zip(subtitles, codecs)):
+            cmd += [
+                '-map', f'{index + 1}:0',
+                f'-c:s:{kept + index}', codec,
+                f'-metadata:s:s:{kept + index}', f'language={language}',
+            ]
+        cmd.append(output_path)
         
-        print("\nProcessing video...")
-        print("Command:", ' '.join(cmd))  # Print command for debugging
+        if verbose:
+            print("\nProcessing video...")
+            print("Command:", ' '.join(cmd))  # Print command for debugging
         
         # Run FFmpeg with full error output
-        result = subprocess.run(cmd, capture_output=True, text=True)
+        with span('mux', video=video_path, subtitles=len(subtitles)):
+            result = subprocess.run(cmd, capture_output=True, text=True)
         
         if result.returncode != 0:
-            print("\nFFmpeg Error Output:")
-            print(result.stderr)
-            
-            # Try alternative method if first method fails
-            print("\nTrying alternative method...")
-            cmd_alt = [
-                'ffmpeg',
-                '-i', video_path,
-                '-i', srt_path,
-                '-c:v', 'copy',
-                '-c:a', 'copy',
-                '-c:s', 'srt',           # Try with SRT subtitle codec
-                output_path
-            ]
-            
-            result_alt = subprocess.run(cmd_alt, capture_output=True, text=True)
-            
-            if result_alt.returncode != 0:
-                print("\nAlternative method also failed. FFmpeg Error Output:")
-                print(result_alt.stderr)
-                raise Exception("Both subtitle embedding methods failed")
+            if verbose:
+                print("\nFFmpeg Error Output:")
+                print(result.stderr)
+            last_line = result.stderr.strip().splitlines()[-1] if result.stderr.strip() else ''
+            raise Exception(f"Subtitle embedding failed: {last_line}")
         
-        print(f"\nSuccessfully combined video and subtitles to: {output_path}")
+        if verbose:
+            print(f"\nSuccessfully combined video and {len(subtitles)} subtitle track(s) to: {output_path}")
         return output_path
         
     except subprocess.CalledProcessError as e:
@@ -71,9 +202,127 @@ def combine_video_and_subtitles(video_path, srt_path, output_path=None):
         print(f"FFmpeg error output: {e.stderr}")
         raise
     except Exception as e:
-        print(f"\nAn unexpected error occurred: {str(e)}")
+        if verbose:
+            print(f"\nAn unexpected error occurred: {str(e)}")
         raise
 
+def _subtitle_base(path: Path) -> str:
+    """Subtitle stem without its language tag: movie.en.srt -> movie."""
+    stem = path.stem
+    tag = Path(stem).suffix.lstrip('.').lower()
+    if tag in LANGUAGE_CODES or tag in LANGUAGE_CODES.values():
+        stem = Path(stem).stem
+    return stem.lower()
+
+def _episode(name: str):
+    """(season, episode) from a name containing e.g. S11E22, else None."""
+    match = EPISODE_PATTERN.search(name)
+    return (int(match.group(1)), int(match.group(2))) if match else None
+
+def pair_videos_and_subtitles(directory: str) -> tuple:
+    """
+    Match the videos in a directory tree with their subtitle files.
+
+    A subtitle belongs to a video when their names match once the language
+    tag is dropped (movie.mkv + movie.en.srt), or failing that when both
+    carry the same unambiguous episode number (S11E22). Returns
+    (pairs, unmatched subtitles), where pairs maps each video to its list
+    of subtitle files.
+    """
+    files = [p for p in Path(directory).rglob('*') if p.is_file()]
+    # Outputs of an earlier run are not sources
+    videos = sorted(p for p in files if p.suffix.lower() in VIDEO_EXTENSIONS
+                    and not p.stem.endswith('_with_subtitles'))
+    subtitles = sorted(p for p in files if p.suffix.lower() in SUBTITLE_FORMATS)
+
+    by_stem = {(video.parent, video.stem.lower()): video for video in videos}
+    by_episode = {}
+    for video in videos:
+        episode = _episode(video.name)
+        if episode:
+            by_episode.setdefault(episode, []).append(video)
+
+    pairs = {str(video): [] for video in videos}
+    unmatched = []
+    for subtitle in subtitles:
+        video = by_stem.get((subtitle.parent, _subtitle_base(subtitle)))
+        if video is None:
+            candidates = by_episode.get(_episode(subtitle.name), [])
+            video = candidates[0] if len(candidates) == 1 else None
+        if video is None:
+            unmatched.append(str(subtitle))
+        else:
+            pairs[str(video)].append(str(subtitle))
+    return pairs, unmatched
+
+def merged_output_path(video_path: str, output_dir: str = None) -> str:
+    """Output next to the video (or in output_dir), in a container that can hold subtitles."""
+    video = Path(video_path)
+    ext = video.suffix.lower() if video.suffix.lower() in CONTAINER_SUBTITLE_CODECS else '.mkv'
+    return str(Path(output_dir or video.parent) / f"{video.stem}_with_subtitles{ext}")
+
+def _disk_of(path: str) -> int:
+    return os.stat(path).st_dev
+
+def merge_directory(directory: str, output_dir: str = None, jobs_per_disk: int = JOBS_PER_DISK,
+                    force: bool = False) -> dict:
+    """
+    Add matching subtitles to every video in a directory tree, several at a time.
+
+    Each remux is a stream copy, so the limit is disk throughput: at most
+    jobs_per_disk remuxes read from the same disk at once, and videos on
+    different disks run side by side. Outputs newer than their video and
+    subtitles are skipped unless force is set. Returns lists of merged,
+    skipped, failed and unmatched files.
+    """
+    pairs, unmatched_subtitles = pair_videos_and_subtitles(directory)
+    if output_dir:
+        os.makedirs(output_dir, exist_ok=True)
+    summary = {'merged': [], 'skipped': [], 'failed': [], 'unmatched_videos': [],
+               'unmatched_subtitles': unmatched_subtitles}
+
+    work = []
+    for video_path, subtitle_paths in pairs.items():
+        if not subtitle_paths:
+            summary['unmatched_videos'].append(video_path)
+            continue
+        output_path = merged_output_path(video_path, output_dir)
+        newest_input = max(os.path.getmtime(p) for p in [video_path, *subtitle_paths])
+        if not force and os.path.exists(output_path) and os.path.getmtime(output_path) >= newest_input:
+            summary['skipped'].append(output_path)
+            continue
+        work.append((video_path, subtitle_paths, output_path))
+
+    disk_slots = {disk: threading.Semaphore(jobs_per_disk) for disk in {_disk_of(v) for v, _, _ in work}}
+
+    def merge(video_path, subtitle_paths, output_path):
+        with disk_slots[_disk_of(video_path)]:
+            try:
+                combine_video_and_subtitles(video_path, subtitle_paths, output_path, overwrite=True, verbose=False)
+            except Exception as e:
+                print(f"[failed] {video_path}: {e}")
+                return 'failed', f"{video_path}: {e}"
+        print(f"[merged] {output_path} ({len(subtitle_paths)} subtitle track(s))")
+        return 'merged', output_path
+
+    workers = max(1, len(disk_slots) * jobs_per_disk)
+    print(f"{len(work)} video(s) to merge, running up to {jobs_per_disk} per disk on {len(disk_slots)} disk(s)")
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        for status, item in pool.map(lambda args: merge(*args), work):
+            summary[status].append(item)
+    return summary
+
+def print_merge_summary(summary: dict):
+    """Print what a directory merge did."""
+    print(f"\nMerged: {len(summary['merged'])}, skipped (up to date): {len(summary['skipped'])}, "
+          f"failed: {len(summary['failed'])}")
+    for item in summary['failed']:
+        print(f"  Failed: {item}")
+    for path in summary['unmatched_videos']:
+        print(f"  No subtitles found for: {path}")
+    for path in summary['unmatched_subtitles']:
+        print(f"  No video found for: {path}")
+
 def main():
     print("Video and Subtitle Merger")
     print("========================")
@@ -81,8 +330,13 @@ def main():
     
     try:
         # Get paths directly from user input
-        video_path = input("Enter the path to your video file: ").strip('"').strip("'")
-        srt_path = input("Enter the path to your subtitle file: ").strip('"').strip("'")
+        video_path = input("Enter the path to your video file (or a folder to process all of it): ").strip('"').strip("'")
+        if os.path.isdir(video_path):
+            # Batch mode: pair every video in the folder with its subtitles
+            print_merge_summary(merge_directory(video_path))
+            return
+        srt_input = input("Enter the path to your subtitle file (separate several with ;): ")
+        srt_path = [p.strip().strip('"').strip("'") for p in srt_input.split(';') if p.strip()]
         
         # Ask for output filename only (not full path)
         print("\nWould you like to specify an output filename?")
@@ -0,0 +1,138 @@
+import json
+import os
+import time
+from video_filters import scaled_size
+
+HISTORY_PATH = os.environ.get('VIDEO_ENCODE_HISTORY', './cache/encode_history.jsonl')
+MIN_SAMPLES = 3  # Records a group needs before its own fit is trusted
+
+# Starting point before any history exists: x264 'slower' core-seconds per
+# encoded pixel and per decoded pixel
+DEFAULT_ENCODE_COST = 1 / (1920 * 1080 * 5)
+DEFAULT_DECODE_COST = 1 / (1920 * 1080 * 200)
+
+def job_features(media, resolution: str, preset: str = 'slower', cores: int = None) -> dict:
+    """Describe a job by what drives its encode cost."""
+    video = media.video
+    frames = media.duration * (video.fps or 25)
+    out_size = scaled_size(video.width, video.height, resolution) or (video.width, video.height)
+    return {
+        'source_pixels': video.width * video.height,
+        'output_pixels': out_size[0] * out_size[1],
+        'duration': media.duration,
+        'fps': video.fps,
+        'frames': frames,
+        'codec': video.codec_name,
+        'resolution': resolution,
+        'preset': preset,
+        'cores': cores or os.cpu_count() or 1,
+    }
+
+def _work(features: dict) -> tuple:
+    """Pixels decoded and pixels encoded over the whole job."""
+    return features['frames'] * features['source_pixels'], features['frames'] * features['output_pixels']
+
+def _fit(records: list) -> tuple:
+    """
+    Least-squares fit of core_seconds = decode_cost * decoded + encode_cost * encoded.
+
+    Falls back to a single encode cost (decode folded in) when the two
+    work terms cannot be told apart, e.g. every record used the same scaling.
+    """
+    sdd = sde = see = sdy = sey = 0.0
+    for r in records:
+        decoded, encoded = _work(r)
+        y = r['seconds'] * r['cores']
+        sdd += decoded * decoded
+        sde += decoded * encoded
+        see += encoded * encoded
+        sdy += decoded * y
+        sey += encoded * y
+    det = sdd * see - sde * sde
+    if det > 1e-9 * sdd * see:
+        decode_cost = (sdy * see - sey * sde) / det
+        encode_cost = (sey * sdd - sdy * sde) / det
+        if decode_cost >= 0 and encode_cost > 0:
+            return decode_cost, encode_cost
+    return 0.0, sey / see if see else DEFAULT_ENCODE_COST
+
+
+class EncodeTimePredictor:
+    """
+    Predict encode seconds from recorded history.
+
+    Every finished job is appended to a JSON-lines history file. Predictions
+    use the records with the same preset and source codec, falling back to
+    the same preset, then to all history, then to built-in defaults. Time
+    is modelled in core-seconds, so a job is assumed to scale linearly with
+    the cores it gets.
+    """
+
+    def __init__(self, history_path: str = HISTORY_PATH):
+        self.history_path = history_path
+        self._records = None
+        self._fits = {}
+
+    def _load(self) -> list:
+        if self._records is None:
+            self._records = []
+            if os.path.exists(self.history_path):
+                with open(self.history_path) as f:
+                    for line in f:
+                        try:
+                            self._records.append(json.loads(line))
+                        except json.JSONDecodeError:
+                            continue
+        return self._records
+
+    def _costs(self, features: dict) -> tuple:
+        records = self._load()
+        groups = [
+            ('preset+codec', lambda r: r['preset'] == features['preset'] and r['codec'] == features['codec']),
+            ('preset', lambda r: r['preset'] == features['preset']),
+            ('all', lambda r: True),
+        ]
+        for name, matches in groups:
+            key = (name, features['preset'], features['codec'])
+            if key not in self._fits:
+                subset = [r for r in records if matches(r)]
+                self._fits[key] = _fit(subset) if len(subset) >= MIN_SAMPLES else None
+            if self._fits[key] is not None:
+                return self._fits[key]
+        return DEFAULT_DECODE_COST, DEFAULT_ENCODE_COST
+
+    def predict(self, media, resolution: str, preset: str = 'slower', cores: int = None) -> float:
+        """Predict the encode time in seconds for a probed source."""
+        features = job_features(media, resolution, preset, cores)
+        decode_cost, encode_cost = self._costs(features)
+        decoded, encoded = _work(features)
+        return (decode_cost * decoded + encode_cost * encoded) / features['cores']
+
+    def record(self, media, resolution: str, seconds: float, preset: str = 'slower', cores: int = None):
+        """Add a finished job to the history so later predictions learn from it."""
+        record = dict(job_features(media, resolution, preset, cores), seconds=seconds, time=time.time())
+        directory = os.path.dirname(self.history_path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        with open(self.history_path, 'a') as f:
+            f.write(json.dumps(record) + '\n')
+        self._load().append(record)
+        self._fits.clear()
+
+def describe_encode_speed(media, resolution: str, seconds: float, preset: str = 'slower', cores: int = None,
+                          predictor: EncodeTimePredictor = None) -> str:
+    """
+    One line with the measured encode fps and, when the frame was scaled
+    down, the fps estimated for encoding at the source size instead. The
+    estimate scales the measured fps by the predicted cost of both sizes.
+    """
+    fps = job_features(media, resolution, preset, cores)['frames'] / seconds
+    line = f"Encode speed: {fps:.1f} fps"
+    video = media.video
+    out_size = scaled_size(video.width, video.height, resolution)
+    if out_size:
+        predictor = predictor or EncodeTimePredictor()
+        ratio = predictor.predict(media, resolution, preset, cores) / predictor.predict(media, None, preset, cores)
+        line += (f" at {out_size[0]}x{out_size[1]}, about {1 / ratio:.1f}x the estimated {fps * ratio:.1f} fps "
+                 f"at the source {video.width}x{video.height}")
+    return line
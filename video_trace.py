@@ -0,0 +1,176 @@
+import argparse
+import atexit
+import functools
+import json
+import os
+import sys
+import threading
+import time
+from contextlib import contextmanager
+try:
+    import resource
+except ImportError:  # Windows: spans are recorded without child CPU and memory
+    resource = None
+
+# Set to a file path to record spans for this process: a .json path gets a
+# Chrome trace (chrome://tracing or ui.perfetto.dev), anything else JSON lines.
+# Spans are appended to the JSON-lines file (path + 'l' for .json) as they
+# finish, so a killed process keeps its trace. Several processes can share a
+# JSON-lines path; convert it afterwards.
+TRACE_PATH = os.environ.get('VIDEO_TRACE')
+# Add the CPU time and peak memory of child processes (ffmpeg, ffprobe) to spans
+TRACE_RUSAGE = os.environ.get('VIDEO_TRACE_RUSAGE', '1') != '0' and resource is not None
+
+def _children_usage() -> tuple:
+    """(user, system, peak RSS in MB) of every child process waited for so far."""
+    usage = resource.getrusage(resource.RUSAGE_CHILDREN)
+    # ru_maxrss is in kilobytes on Linux and bytes on macOS
+    rss_mb = usage.ru_maxrss / (1024 * 1024 if sys.platform == 'darwin' else 1024)
+    return usage.ru_utime, usage.ru_stime, rss_mb
+
+
+class Tracer:
+    """
+    Records timed spans for the stages of a job.
+
+    A span has a name, its wall time, the track it ran on (the thread, or a
+    job id passed as track, so concurrent jobs get their own rows) and free
+    attributes. With rusage, the user/system CPU time of child processes
+    that finished during the span and the peak RSS of the largest child so
+    far are added; the kernel only counts children per process, so spans
+    running at the same time share those numbers.
+
+    With a path, each span is appended to that JSON-lines file as it
+    finishes and nothing is kept in memory, so long-running processes do
+    not grow; without one, spans collect in self.spans.
+    """
+
+    def __init__(self, enabled: bool = True, rusage: bool = TRACE_RUSAGE, path: str = None):
+        self.enabled = enabled
+        self.rusage = rusage and resource is not None
+        self.path = path
+        self.spans = []
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def span(self, name: str, track=None, **attrs):
+        """Time the body as a span; yields the attrs dict so the body can add to it."""
+        if not self.enabled:
+            yield attrs
+            return
+        start, started = time.time(), time.perf_counter()
+        before = _children_usage() if self.rusage else None
+        try:
+            yield attrs
+        except BaseException as e:
+            attrs['error'] = type(e).__name__
+            raise
+        finally:
+            record = {
+                'name': name,
+                'start': start,
+                'duration': time.perf_counter() - started,
+                'pid': os.getpid(),
+                'track': str(track) if track is not None else threading.current_thread().name,
+                'attrs': attrs,
+            }
+            if before is not None:
+                after = _children_usage()
+                record['child_user_seconds'] = round(after[0] - before[0], 3)
+                record['child_system_seconds'] = round(after[1] - before[1], 3)
+                record['child_max_rss_mb'] = round(after[2], 1)
+            self._record(record)
+
+    def _record(self, record: dict):
+        with self._lock:
+            if self.path is None:
+                self.spans.append(record)
+                return
+            # One short append per span; lines from several processes do not interleave
+            with open(self.path, 'a') as f:
+                f.write(json.dumps(record, default=str) + '\n')
+
+    def traced(self, name: str = None):
+        """Decorator recording every call of a function as a span."""
+        def decorate(func):
+            @functools.wraps(func)
+            def wrapper(*args, **kwargs):
+                with self.span(name or func.__name__):
+                    return func(*args, **kwargs)
+            return wrapper
+        return decorate
+
+    def write_jsonl(self, path: str):
+        """Append the spans to a JSON-lines file, one span per line."""
+        spans = read_jsonl(self.path) if self.path else self.spans
+        with self._lock, open(path, 'a') as f:
+            for record in spans:
+                f.write(json.dumps(record, default=str) + '\n')
+
+    def write_chrome_trace(self, path: str):
+        write_chrome_trace(read_jsonl(self.path) if self.path else self.spans, path)
+
+    def export(self, path: str):
+        """Write the spans to path, as a Chrome trace for .json and JSON lines otherwise."""
+        if path.lower().endswith('.json'):
+            self.write_chrome_trace(path)
+        elif path != self.path:
+            self.write_jsonl(path)
+
+
+def write_chrome_trace(spans: list, path: str):
+    """Write spans in the Trace Event format read by chrome://tracing and Perfetto."""
+    tracks, events = {}, []
+    for record in spans:
+        key = (record['pid'], record['track'])
+        tid = tracks.setdefault(key, len(tracks) + 1)
+        args = dict(record['attrs'], **{k: v for k, v in record.items() if k.startswith('child_')})
+        events.append({'name': record['name'], 'ph': 'X', 'ts': record['start'] * 1e6,
+                       'dur': record['duration'] * 1e6, 'pid': record['pid'], 'tid': tid, 'args': args})
+    for (pid, track), tid in tracks.items():
+        events.append({'name': 'thread_name', 'ph': 'M', 'pid': pid, 'tid': tid, 'args': {'name': track}})
+    with open(path, 'w') as f:
+        json.dump({'traceEvents': events, 'displayTimeUnit': 'ms'}, f, default=str)
+
+def read_jsonl(path: str) -> list:
+    with open(path) as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+def summarize(spans: list) -> dict:
+    """Total wall time, count and child CPU time per span name, slowest first."""
+    totals = {}
+    for record in spans:
+        total = totals.setdefault(record['name'], {'count': 0, 'seconds': 0.0, 'child_cpu_seconds': 0.0})
+        total['count'] += 1
+        total['seconds'] += record['duration']
+        total['child_cpu_seconds'] += record.get('child_user_seconds', 0) + record.get('child_system_seconds', 0)
+    return dict(sorted(totals.items(), key=lambda item: item[1]['seconds'], reverse=True))
+
+def stream_path(path: str) -> str:
+    """The JSON-lines file spans are appended to while tracing to path."""
+    return path + 'l' if path.lower().endswith('.json') else path
+
+# The process-wide tracer; spans cost next to nothing while VIDEO_TRACE is unset
+tracer = Tracer(enabled=bool(TRACE_PATH), path=stream_path(TRACE_PATH) if TRACE_PATH else None)
+span = tracer.span
+traced = tracer.traced
+if TRACE_PATH and TRACE_PATH.lower().endswith('.json'):
+    # The spans are already on disk; only the Chrome conversion waits for exit
+    atexit.register(tracer.export, TRACE_PATH)
+
+def main():
+    parser = argparse.ArgumentParser(description="Summarize a JSON-lines trace and optionally convert it to a Chrome trace.")
+    parser.add_argument('trace', help="JSON-lines file written with VIDEO_TRACE")
+    parser.add_argument('--chrome', default=None, help="Also write a Chrome trace (.json) here")
+    args = parser.parse_args()
+
+    spans = read_jsonl(args.trace)
+    print(f"{'stage':<24}{'count':>7}{'wall s':>11}{'child CPU s':>13}")
+    for name, total in summarize(spans).items():
+        print(f"{name:<24}{total['count']:>7}{total['seconds']:>11.2f}{total['child_cpu_seconds']:>13.2f}")
+    if args.chrome:
+        write_chrome_trace(spans, args.chrome)
+        print(f"Chrome trace written to {args.chrome}")
+
+if __name__ == "__main__":
+    main()